@@ -0,0 +1,114 @@
+# Copyright 2021 Bhargav SNV
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+'''
+Compare like throughput on a single hot video with and without the
+write-behind like buffer.
+
+Several threads like the same video as different users, against a
+throwaway file-backed test database so they contend on the SQLite lock
+the way server workers do. From the oyt_python directory:
+
+    python benchmarks/like_benchmark.py --threads 8 --likes 200
+'''
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'oyt_python.settings')
+
+import django
+django.setup()
+
+from django.contrib.auth.models import User
+from django.db import OperationalError, connection, connections
+from django.test import override_settings
+from oyt import likes
+from oyt.likebuffer import buffer
+from oyt.models import Like, Video
+
+
+def hammer(video, users, results):
+    '''
+    Like the video once per user, counting failures instead of stopping
+    '''
+    errors = 0
+    for user in users:
+        try:
+            likes.like(user, video.id)
+        except OperationalError:
+            errors += 1
+    results.append(errors)
+    connections.close_all()
+
+
+def run(label, threads, per_thread):
+    owner = User.objects.create(username='bench_owner_' + label)
+    video = Video.objects.create(title='hot video', description='', user=owner,
+                                 path='/media/bench.mp4')
+    User.objects.bulk_create([User(username='bench_{}_{}'.format(label, i))
+                              for i in range(threads * per_thread)])
+    users = list(User.objects.filter(username__startswith='bench_{}_'.format(label)))
+
+    results = []
+    workers = [threading.Thread(target=hammer, args=(
+        video, users[i::threads], results)) for i in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+    buffer.flush()
+
+    errors = sum(results)
+    stored = Like.objects.filter(video=video).count()
+    print('{:<10} {:>8} {:>10.0f} {:>8} {:>10} {:>10}'.format(
+        label, len(users), len(users) / elapsed, errors, stored,
+        Video.objects.get(id=video.id).num_likes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--likes', type=int, default=200,
+                        help='likes per thread')
+    parser.add_argument('--busy-timeout', type=float, default=1.0,
+                        help='seconds a writer waits for the lock before failing')
+    parser.add_argument('--flush-interval', type=float, default=0.5)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'like_benchmark.sqlite3')
+    connection.settings_dict['TEST']['NAME'] = path
+    connection.settings_dict['OPTIONS']['timeout'] = args.busy_timeout
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        print('{:<10} {:>8} {:>10} {:>8} {:>10} {:>10}'.format(
+            'mode', 'likes', 'likes/s', 'errors', 'rows', 'num_likes'))
+        run('direct', args.threads, args.likes)
+        with override_settings(LIKE_BUFFER=True,
+                               LIKE_BUFFER_FLUSH_INTERVAL=args.flush_interval):
+            run('buffered', args.threads, args.likes)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,493 @@
+# Copyright 2021 Bhargav SNV
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+'''
+Load test a running site over HTTP with scripted user journeys.
+
+Virtual users browse the home page, search, watch videos (the page and
+range requests of the media file), like, comment and add videos to a
+playlist, picked at random by weight, until the run ends. Each endpoint
+is reported with its throughput, p50/p95/p99 latency and error rate. When
+the server runs with SERVER_TIMING = True, the database time, write time
+(where SQLite lock waits show up) and lock errors are reported too.
+
+Reports are JSON, so runs can be compared. From the oyt_python directory,
+with the server running:
+
+    python benchmarks/loadtest.py run --url http://127.0.0.1:8000 \
+        --users 16 --duration 60 --report after.json
+    python benchmarks/loadtest.py compare before.json after.json
+
+Journeys that need an account log in as loadtest_<n>, registering the
+accounts on first use.
+'''
+
+from http.cookiejar import CookieJar
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode
+import argparse
+import json
+import math
+import random
+import re
+import sys
+import threading
+import time
+import urllib.request
+
+# Relative weight of each journey in the default mix
+DEFAULT_MIX = 'browse=4,search=2,watch=4,like=1,comment=1,playlist=1'
+
+# Journeys that run as a logged in user
+ACCOUNT_JOURNEYS = {'like', 'comment', 'playlist'}
+
+# Bytes fetched by each range request of the watch journey
+RANGE_SIZE = 256 * 1024
+
+PASSWORD = 'loadtest-password'
+
+video_link_re = re.compile(r'href="/video/(\d+)"')
+title_re = re.compile(r'<h2>(.*?)</h2>', re.S)
+media_re = re.compile(r'<source src="(/media/[^"]+)" type="video/')
+playlist_check_re = re.compile(r'name="checks\[\]"\s+value="(\d+)"')
+error_page_re = re.compile(r'<title>\s*Error Occurred!')
+content_range_re = re.compile(r'/(\d+)$')
+word_re = re.compile(r'\w{3,}')
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    '''
+    Time redirecting form posts on their own, without the page they
+    redirect to
+    '''
+
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def parse_server_timing(header):
+    '''
+    Read the db, db-write and db-locked metrics of a Server-Timing header
+    '''
+    metrics = {}
+    for entry in (header or '').split(','):
+        name, _, params = entry.strip().partition(';')
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key in ('dur', 'desc') and name:
+                try:
+                    metrics.setdefault(name, float(value.strip('"').split()[0]))
+                except (ValueError, IndexError):
+                    pass
+    return metrics
+
+
+class Recorder:
+    '''
+    Collect request samples of all virtual users per endpoint
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+
+    def add(self, endpoint, sample):
+        with self.lock:
+            self.samples.setdefault(endpoint, []).append(sample)
+
+
+class Session:
+    '''
+    A virtual user with its own cookies, timing every request it makes
+    '''
+
+    def __init__(self, base_url, recorder=None, timeout=30):
+        self.base_url = base_url.rstrip('/')
+        self.recorder = recorder
+        self.timeout = timeout
+        self.cookies = CookieJar()
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(self.cookies), NoRedirect)
+
+    def csrf_token(self):
+        for cookie in self.cookies:
+            if cookie.name == 'csrftoken':
+                return cookie.value
+        return ''
+
+    def request(self, endpoint, path, data=None, headers=None, expect=(200,)):
+        '''
+        Make a request and return (status, headers, body). Unexpected
+        statuses, error pages and connection failures count as errors.
+        '''
+        headers = dict(headers or {})
+        body = None
+        if data is not None:
+            body = urlencode(data, doseq=True).encode()
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+            headers['X-CSRFToken'] = self.csrf_token()
+        request = urllib.request.Request(self.base_url + path, body, headers)
+
+        started = time.perf_counter()
+        try:
+            try:
+                response = self.opener.open(request, timeout=self.timeout)
+            except HTTPError as e:
+                response = e
+            status, response_headers, content = response.status, response.headers, response.read()
+        except (URLError, OSError) as e:
+            status, response_headers, content = 0, {}, str(e).encode()
+        elapsed = time.perf_counter() - started
+
+        ok = status in expect
+        if ok and 'html' in response_headers.get('Content-Type', ''):
+            ok = error_page_re.search(content.decode(errors='replace')) is None
+        if self.recorder is not None:
+            timing = parse_server_timing(response_headers.get('Server-Timing'))
+            self.recorder.add(endpoint, {
+                'seconds': elapsed,
+                'status': status,
+                'ok': ok,
+                'db_ms': timing.get('db'),
+                'db_write_ms': timing.get('db-write'),
+                'db_locked': timing.get('db-locked'),
+            })
+        return status, response_headers, content.decode(errors='replace') if ok else ''
+
+    def log_in(self, username):
+        '''
+        Log in, registering the account first if it does not exist
+        '''
+        self.request('login', '/login')
+        status, _, _ = self.request('login', '/login', {
+            'username': username, 'password': PASSWORD}, expect=(302,))
+        if status == 302 and self.logged_in():
+            return True
+
+        self.request('register', '/register')
+        self.request('register', '/register', {
+            'username': username, 'password': PASSWORD, 'email': username + '@example.com',
+            'first_name': 'Load', 'last_name': 'Test'}, expect=(200, 302))
+        self.request('login', '/login')
+        self.request('login', '/login', {
+            'username': username, 'password': PASSWORD}, expect=(302,))
+        return self.logged_in()
+
+    def logged_in(self):
+        return any(cookie.name == 'sessionid' for cookie in self.cookies)
+
+
+class Catalogue:
+    '''
+    Videos and search terms found on the site, for journeys to pick from
+    '''
+
+    def __init__(self, video_ids, terms):
+        self.video_ids = video_ids
+        self.terms = terms
+
+    @classmethod
+    def discover(cls, base_url, terms=None):
+        session = Session(base_url)
+        status, _, home = session.request('discover', '/')
+        if status != 200:
+            raise SystemExit('Could not load {}: status {}'.format(base_url, status))
+        video_ids = sorted(set(int(id) for id in video_link_re.findall(home)))
+        if not video_ids:
+            raise SystemExit('No videos linked from the home page, seed some first')
+
+        found = set()
+        for video_id in video_ids[:10]:
+            _, _, page = session.request('discover', '/video/{}'.format(video_id))
+            for title in title_re.findall(page):
+                found.update(word.lower() for word in word_re.findall(title))
+        return cls(video_ids, terms or sorted(found) or ['video'])
+
+
+def browse(session, catalogue, rng):
+    session.request('home', '/')
+    session.request('playlist_index', '/playlist_index')
+
+
+def search(session, catalogue, rng):
+    # The search box posts to the home page, with the CSRF cookie every
+    # page sets
+    if not session.csrf_token():
+        session.request('home', '/')
+    session.request('search', '/', {'search_value': rng.choice(catalogue.terms)})
+
+
+def watch(session, catalogue, rng):
+    video_id = rng.choice(catalogue.video_ids)
+    _, _, page = session.request('video', '/video/{}'.format(video_id))
+    match = media_re.search(page)
+    if match is None:
+        return
+
+    # The first range starts playback, the second is a seek
+    status, headers, _ = session.request('media_range', match.group(1), headers={
+        'Range': 'bytes=0-{}'.format(RANGE_SIZE - 1)}, expect=(200, 206))
+    size = content_range_re.search(headers.get('Content-Range', '') if status else '')
+    if size is not None and int(size.group(1)) > RANGE_SIZE:
+        start = rng.randrange(int(size.group(1)))
+        session.request('media_range', match.group(1), headers={
+            'Range': 'bytes={}-{}'.format(start, start + RANGE_SIZE - 1)}, expect=(206,))
+
+
+def like(session, catalogue, rng):
+    video_id = rng.choice(catalogue.video_ids)
+    session.request('video', '/video/{}'.format(video_id))
+    session.request('like', '/video/{}'.format(video_id), {
+        'like': rng.choice(['True', 'False'])}, expect=(200, 302))
+
+
+def comment(session, catalogue, rng):
+    video_id = rng.choice(catalogue.video_ids)
+    session.request('comment', '/comment', {
+        'text': 'load test comment {}'.format(rng.randrange(10 ** 6)),
+        'video': video_id}, expect=(302,))
+
+
+def playlist(session, catalogue, rng):
+    video_id = rng.choice(catalogue.video_ids)
+    _, _, page = session.request('add_to_playlist_form', '/add_to_playlist/{}'.format(video_id))
+    playlist_ids = playlist_check_re.findall(page)
+    if not playlist_ids:
+        session.request('new_playlist', '/new_playlist', {
+            'name': 'load test playlist', 'description': ''})
+        return
+    session.request('add_to_playlist', '/add_to_playlist/{}'.format(video_id), {
+        'checks[]': [rng.choice(playlist_ids)]}, expect=(302,))
+
+
+JOURNEYS = {
+    'browse': browse,
+    'search': search,
+    'watch': watch,
+    'like': like,
+    'comment': comment,
+    'playlist': playlist,
+}
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name.strip() not in JOURNEYS:
+            raise argparse.ArgumentTypeError('unknown journey {}'.format(name))
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def virtual_user(number, args, catalogue, recorder, deadline, failures):
+    rng = random.Random(args.seed + number)
+    session = Session(args.url, timeout=args.timeout)
+    names = list(args.mix)
+    weights = [args.mix[name] for name in names]
+    if ACCOUNT_JOURNEYS & set(names) and not session.log_in('loadtest_{}'.format(number)):
+        failures.append('loadtest_{} could not log in'.format(number))
+        names = [name for name in names if name not in ACCOUNT_JOURNEYS]
+        weights = [args.mix[name] for name in names]
+        if not names:
+            return
+
+    session.recorder = recorder
+    iterations = 0
+    while time.monotonic() < deadline and (not args.iterations or iterations < args.iterations):
+        JOURNEYS[rng.choices(names, weights)[0]](session, catalogue, rng)
+        iterations += 1
+        if args.think_time:
+            time.sleep(rng.uniform(0, 2 * args.think_time))
+
+
+def percentile(values, fraction):
+    '''
+    Nearest rank percentile of a sorted list
+    '''
+    if not values:
+        return None
+    # Rounded first, 0.07 * 100 is a hair over 7
+    rank = max(math.ceil(round(fraction * len(values), 9)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+def summarize(samples, elapsed):
+    latencies = sorted(sample['seconds'] * 1000 for sample in samples)
+    errors = sum(1 for sample in samples if not sample['ok'])
+    summary = {
+        'requests': len(samples),
+        'errors': errors,
+        'error_rate': errors / len(samples) if samples else 0,
+        'throughput': len(samples) / elapsed if elapsed else 0,
+        'p50_ms': percentile(latencies, 0.50),
+        'p95_ms': percentile(latencies, 0.95),
+        'p99_ms': percentile(latencies, 0.99),
+        'max_ms': latencies[-1] if latencies else None,
+        'statuses': {},
+    }
+    for sample in samples:
+        key = str(sample['status'])
+        summary['statuses'][key] = summary['statuses'].get(key, 0) + 1
+
+    timed = [sample for sample in samples if sample['db_ms'] is not None]
+    if timed:
+        writes = sorted(sample['db_write_ms'] or 0 for sample in timed)
+        summary['db_ms_mean'] = sum(sample['db_ms'] for sample in timed) / len(timed)
+        summary['db_write_ms_p95'] = percentile(writes, 0.95)
+        summary['db_write_ms_max'] = writes[-1]
+        summary['db_locked'] = int(sum(sample['db_locked'] or 0 for sample in timed))
+    return summary
+
+
+def run(args):
+    catalogue = Catalogue.discover(args.url, args.terms)
+    recorder = Recorder()
+    failures = []
+    started = time.monotonic()
+    deadline = started + args.duration
+    users = [threading.Thread(target=virtual_user, args=(
+        number, args, catalogue, recorder, deadline, failures)) for number in range(args.users)]
+    for user in users:
+        user.start()
+    for user in users:
+        user.join()
+    elapsed = time.monotonic() - started
+
+    samples = [sample for endpoint in recorder.samples.values() for sample in endpoint]
+    report = {
+        'url': args.url,
+        'started': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'users': args.users,
+        'duration': elapsed,
+        'mix': args.mix,
+        'seed': args.seed,
+        'videos': len(catalogue.video_ids),
+        'failures': failures,
+        'total': summarize(samples, elapsed),
+        'endpoints': dict((endpoint, summarize(endpoint_samples, elapsed))
+                          for endpoint, endpoint_samples in sorted(recorder.samples.items())),
+    }
+
+    print_report(report)
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print('Report written to {}'.format(args.report))
+
+
+def format_ms(value):
+    return '-' if value is None else '{:.1f}'.format(value)
+
+
+def print_report(report):
+    print('{} users for {:.0f}s against {}'.format(
+        report['users'], report['duration'], report['url']))
+    for failure in report['failures']:
+        print('  ' + failure)
+    print('{:<22} {:>8} {:>8} {:>7} {:>8} {:>8} {:>8} {:>8} {:>7}'.format(
+        'endpoint', 'requests', 'req/s', 'errors', 'p50', 'p95', 'p99', 'dbw p95', 'locked'))
+    rows = list(report['endpoints'].items()) + [('total', report['total'])]
+    for endpoint, summary in rows:
+        print('{:<22} {:>8} {:>8.1f} {:>6.1%} {:>8} {:>8} {:>8} {:>8} {:>7}'.format(
+            endpoint, summary['requests'], summary['throughput'], summary['error_rate'],
+            format_ms(summary['p50_ms']), format_ms(summary['p95_ms']),
+            format_ms(summary['p99_ms']), format_ms(summary.get('db_write_ms_p95')),
+            summary.get('db_locked', '-')))
+
+
+def change(before, after):
+    if before is None or after is None:
+        return '-'
+    if before == 0:
+        return '-' if after == 0 else '+inf'
+    return '{:+.0%}'.format((after - before) / before)
+
+
+def compare(args):
+    '''
+    Print the change of every endpoint between two reports. Exits with
+    status 1 when a p95 latency grew by more than --fail-over percent, or
+    an error rate grew, so it can gate a CI job.
+    '''
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+
+    print('{:<22} {:>9} {:>9} {:>9} {:>9} {:>12}'.format(
+        'endpoint', 'req/s', 'p50', 'p95', 'p99', 'error rate'))
+    regressions = []
+    endpoints = sorted(set(before['endpoints']) | set(after['endpoints']))
+    for endpoint in endpoints + ['total']:
+        old = before['total'] if endpoint == 'total' else before['endpoints'].get(endpoint)
+        new = after['total'] if endpoint == 'total' else after['endpoints'].get(endpoint)
+        if old is None or new is None:
+            print('{:<22} only in {}'.format(endpoint, 'after' if old is None else 'before'))
+            continue
+        print('{:<22} {:>9} {:>9} {:>9} {:>9} {:>5.1%} {:>6.1%}'.format(
+            endpoint, change(old['throughput'], new['throughput']),
+            change(old['p50_ms'], new['p50_ms']), change(old['p95_ms'], new['p95_ms']),
+            change(old['p99_ms'], new['p99_ms']), old['error_rate'], new['error_rate']))
+
+        if args.fail_over is not None and old['p95_ms'] and new['p95_ms'] and (
+                new['p95_ms'] - old['p95_ms']) / old['p95_ms'] * 100 > args.fail_over:
+            regressions.append('{} p95 {:.1f}ms -> {:.1f}ms'.format(
+                endpoint, old['p95_ms'], new['p95_ms']))
+        if args.fail_over is not None and new['error_rate'] > old['error_rate']:
+            regressions.append('{} error rate {:.1%} -> {:.1%}'.format(
+                endpoint, old['error_rate'], new['error_rate']))
+
+    for regression in regressions:
+        print('Regression: ' + regression)
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='Run the journeys against a server')
+    run_parser.add_argument('--url', default='http://127.0.0.1:8000')
+    run_parser.add_argument('--users', type=int, default=8,
+                            help='concurrent virtual users')
+    run_parser.add_argument('--duration', type=float, default=30,
+                            help='seconds to run for')
+    run_parser.add_argument('--iterations', type=int, default=0,
+                            help='stop each user after this many journeys (0 for no limit)')
+    run_parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                            help='journey weights, default ' + DEFAULT_MIX)
+    run_parser.add_argument('--think-time', type=float, default=0,
+                            help='mean seconds a user pauses between journeys')
+    run_parser.add_argument('--terms', nargs='*',
+                            help='search terms, default words from video titles')
+    run_parser.add_argument('--timeout', type=float, default=30)
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--report', help='write the JSON report to this file')
+
+    compare_parser = commands.add_parser('compare', help='Compare two JSON reports')
+    compare_parser.add_argument('before')
+    compare_parser.add_argument('after')
+    compare_parser.add_argument('--fail-over', type=float,
+                                help='exit 1 if a p95 grew by more than this percent')
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        run(args)
+        return 0
+    return compare(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,125 @@
+# Copyright 2021 Bhargav SNV
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+'''
+Compare FTS5 video search against the LIKE queries it replaced.
+
+Runs against a throwaway test database, from the oyt_python directory:
+
+    python benchmarks/search_benchmark.py --rows 100000
+'''
+
+import argparse
+import itertools
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'oyt_python.settings')
+
+import django
+django.setup()
+
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import Q
+from oyt import search
+from oyt.models import Video
+
+
+def populate(rows, seed):
+    '''
+    Bulk create videos with titles and descriptions drawn from a
+    Zipf-like vocabulary, so some words are common and most are rare
+    '''
+    rng = random.Random(seed)
+    vocabulary = [''.join(rng.choice('abcdefghijklmnopqrstuvwxyz')
+                          for _ in range(rng.randint(4, 9))) for _ in range(20000)]
+    cum_weights = list(itertools.accumulate(
+        1 / (rank + 1) for rank in range(len(vocabulary))))
+
+    def words(count):
+        return ' '.join(rng.choices(vocabulary, cum_weights=cum_weights, k=count))
+
+    User.objects.bulk_create(
+        [User(username='bench_{}'.format(i)) for i in range(100)])
+    users = list(User.objects.filter(username__startswith='bench_'))
+    with transaction.atomic():
+        for start in range(0, rows, 10000):
+            Video.objects.bulk_create([Video(
+                title=words(3)[:30],
+                description=words(25)[:300],
+                user=rng.choice(users),
+                path='/media/bench.mp4',
+                is_private=rng.random() < 0.1
+            ) for _ in range(start, min(start + 10000, rows))])
+        search.rebuild(Video)
+    return vocabulary, users
+
+
+def measure(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        started = time.perf_counter()
+        vocabulary, users = populate(args.rows, args.seed)
+        print('Created {} videos in {:.1f}s'.format(
+            args.rows, time.perf_counter() - started))
+
+        user = users[0]
+        terms = {
+            'common word': vocabulary[0],
+            'mid word': vocabulary[200],
+            'rare word': vocabulary[15000],
+            'two words': vocabulary[3] + ' ' + vocabulary[40],
+        }
+
+        print('{:<12} {:>10} {:>14} {:>12} {:>9}'.format(
+            'query', 'matches', 'LIKE all (ms)', 'LIKE 20 (ms)', 'FTS (ms)'))
+        for label, term in terms.items():
+            visible = Q(is_private=False) | Q(user_id=user.id)
+            like = Video.objects.filter(visible).filter(
+                Q(title__contains=term) | Q(description__contains=term))
+
+            matches = like.count()
+            like_all = measure(lambda: list(like.all()), args.repeat)
+            like_page = measure(lambda: list(like[:20]), args.repeat)
+            fts = measure(lambda: search.search(
+                Video, term, user, per_page=20), args.repeat)
+            print('{:<12} {:>10} {:>14.2f} {:>12.2f} {:>9.2f}'.format(
+                label, matches, like_all, like_page, fts))
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
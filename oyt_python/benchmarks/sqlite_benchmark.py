@@ -0,0 +1,173 @@
+# Copyright 2021 Bhargav SNV
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+'''
+Compare mixed read/write throughput of SQLite with the default settings
+and with the production profile (WAL, tuned pragmas and persistent
+connections).
+
+Threads play requests against a throwaway file-backed test database,
+one per mode. A request either reads a video page (the video, its first
+page of comments and whether the viewer liked it) or writes a comment or
+a like toggle. Each request ends the way Django ends one, closing the
+connection unless CONN_MAX_AGE keeps it open. From the oyt_python
+directory:
+
+    python benchmarks/sqlite_benchmark.py --threads 8 --duration 10 --writes 0.2
+'''
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'oyt_python.settings')
+
+import django
+django.setup()
+
+from django.contrib.auth.models import User
+from django.db import OperationalError, close_old_connections, connection, connections
+from django.test import override_settings
+from oyt import likes
+from oyt.models import Comment, Video
+from oyt.views import video_comments
+from oyt_python import settings, settings_production
+
+# Database engine, CONN_MAX_AGE and pragmas of each mode
+MODES = dict((name, (module.DATABASES['default']['ENGINE'],
+                     module.DATABASES['default'].get('CONN_MAX_AGE', 0),
+                     module.SQLITE_PRAGMAS))
+             for name, module in [('default', settings), ('production', settings_production)])
+
+
+def seed(users, videos, comments):
+    owner = User.objects.create(username='bench_owner')
+    User.objects.bulk_create([User(username='bench_{}'.format(i)) for i in range(users)])
+    Video.objects.bulk_create([Video(title='video {}'.format(i), description='',
+                                     user=owner, path='/media/bench.mp4')
+                               for i in range(videos)])
+    user_list = list(User.objects.filter(username__startswith='bench_').exclude(id=owner.id))
+    video_ids = list(Video.objects.values_list('id', flat=True))
+    rng = random.Random(1)
+    Comment.objects.bulk_create([Comment(text='comment', user=rng.choice(user_list),
+                                         video_id=rng.choice(video_ids))
+                                 for i in range(comments)])
+    return user_list, video_ids
+
+
+def read_page(user, video_id):
+    Video.objects.select_related('user').get(id=video_id)
+    video_comments(video_id)
+    likes.has_liked(user, video_id)
+
+
+def write(user, video_id, rng):
+    if rng.random() < 0.5:
+        Comment.objects.create(text='benchmark comment', user=user, video_id=video_id)
+    elif likes.has_liked(user, video_id):
+        likes.unlike(user, video_id)
+    else:
+        likes.like(user, video_id)
+
+
+def play(seed, users, video_ids, writes, deadline, results):
+    '''
+    Run requests until the deadline, counting reads, writes, lock errors
+    and each request's latency
+    '''
+    rng = random.Random(seed)
+    counts = {'read': 0, 'write': 0, 'errors': 0}
+    latencies = []
+    while time.perf_counter() < deadline:
+        user = rng.choice(users)
+        video_id = rng.choice(video_ids)
+        kind = 'write' if rng.random() < writes else 'read'
+        started = time.perf_counter()
+        try:
+            if kind == 'read':
+                read_page(user, video_id)
+            else:
+                write(user, video_id, rng)
+            counts[kind] += 1
+        except OperationalError:
+            counts['errors'] += 1
+        finally:
+            close_old_connections()
+        latencies.append(time.perf_counter() - started)
+    results.append((counts, latencies))
+    connections.close_all()
+
+
+def run(mode, args):
+    engine, max_age, pragmas = MODES[mode]
+    connection.settings_dict['TEST']['NAME'] = os.path.join(
+        tempfile.mkdtemp(), 'sqlite_benchmark_{}.sqlite3'.format(mode))
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        users, video_ids = seed(args.users, args.videos, args.comments)
+        # The worker threads open their own connections from these settings
+        connection.settings_dict['ENGINE'] = engine
+        connection.settings_dict['CONN_MAX_AGE'] = max_age
+        with override_settings(SQLITE_PRAGMAS=pragmas):
+            results = []
+            deadline = time.perf_counter() + args.duration
+            workers = [threading.Thread(target=play, args=(
+                i, users, video_ids, args.writes, deadline, results))
+                for i in range(args.threads)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+    finally:
+        connection.settings_dict['ENGINE'] = MODES['default'][0]
+        connection.settings_dict['CONN_MAX_AGE'] = 0
+        connection.close()
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    reads = sum(counts['read'] for counts, _ in results)
+    writes = sum(counts['write'] for counts, _ in results)
+    errors = sum(counts['errors'] for counts, _ in results)
+    latencies = sorted(latency for _, times in results for latency in times)
+    p95 = latencies[int(len(latencies) * 0.95)] * 1000 if latencies else 0
+    print('{:<12} {:>10.0f} {:>10.0f} {:>10.0f} {:>8} {:>10.1f}'.format(
+        mode, (reads + writes) / args.duration, reads / args.duration,
+        writes / args.duration, errors, p95))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10,
+                        help='seconds per mode')
+    parser.add_argument('--writes', type=float, default=0.2,
+                        help='share of requests that write')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--videos', type=int, default=500)
+    parser.add_argument('--comments', type=int, default=5000)
+    args = parser.parse_args()
+
+    print('{:<12} {:>10} {:>10} {:>10} {:>8} {:>10}'.format(
+        'mode', 'requests/s', 'reads/s', 'writes/s', 'errors', 'p95 ms'))
+    for mode in MODES:
+        run(mode, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -14,6 +14,47 @@
 
 from django.contrib import admin
 from .models import Video, Comment
+from . import shards
 # Register your models here.
 
-admin.site.register([Video, Comment])
+admin.site.register(Video)
+
+
+class CommentDatabaseFilter(admin.SimpleListFilter):
+    '''
+    Pick the comment database to list, a list can only come from one
+    '''
+    title = 'database'
+    parameter_name = 'database'
+
+    def lookups(self, request, model_admin):
+        return [(database, database) for database in shards.databases()]
+
+    def queryset(self, request, queryset):
+        # Applied in CommentAdmin.get_queryset, so counts use it too
+        return queryset
+
+
+@admin.register(Comment)
+class CommentAdmin(admin.ModelAdmin):
+    list_display = ['id', 'video_id', 'user_id', 'datetime', 'text']
+    list_filter = [CommentDatabaseFilter]
+    raw_id_fields = ['user', 'video']
+
+    def get_queryset(self, request):
+        database = request.GET.get(CommentDatabaseFilter.parameter_name)
+        if database not in shards.databases():
+            database = shards.databases()[0]
+        return super().get_queryset(request).using(database)
+
+    def get_object(self, request, object_id, from_field=None):
+        try:
+            return shards.find(int(object_id))
+        except ValueError:
+            return None
+
+    def get_readonly_fields(self, request, obj=None):
+        # Changing the video could move the comment to another database
+        if obj is not None:
+            return ['video']
+        return []
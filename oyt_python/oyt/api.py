@@ -0,0 +1,250 @@
+# Copyright 2021 Bhargav SNV
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+from django.db.models import Q
+from django.http import JsonResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from .feeds import FEEDS, home_feeds
+from .media import hls_url, storyboard_url
+from .models import Playlist, PlaylistEntry, Video
+from .pagination import keyset_page
+from . import shards
+import hashlib
+import json
+
+# Fields of a video document, mapping each to the columns it is read
+# from and how its value is taken from the row
+VIDEO_FIELDS = {
+    'id': ([], lambda video: video.id),
+    'title': (['title'], lambda video: video.title),
+    'description': (['description'], lambda video: video.description),
+    'user': (['user', 'user__username'], lambda video: video.user.username),
+    'uploaded': (['uploaded'], lambda video: video.uploaded),
+    'private': (['is_private'], lambda video: video.is_private),
+    'likes': (['num_likes'], lambda video: video.num_likes),
+    'views': (['num_views'], lambda video: video.num_views),
+    'url': (['path'], lambda video: video.path),
+    'hls_url': (['path', 'hls_status'], hls_url),
+    'storyboard_url': (['path', 'storyboard_status'], storyboard_url),
+    'thumbnails': (['thumbnails'], lambda video: video.thumbnails),
+}
+
+# Fields that change without the version: the uploader's name lives in
+# another table, and the version triggers leave out the counters so likes
+# and views do not bump it. Their values go into the validator instead.
+UNVERSIONED_FIELDS = ['user', 'likes', 'views']
+
+
+def versions_enabled():
+    '''
+    Whether row versions are kept up to date, by the triggers of
+    migration 0036 that only exist on SQLite
+    '''
+    return connection.vendor == 'sqlite'
+
+
+class ApiError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def parse_fields(value):
+    '''
+    Parse "?fields=a,b" into the list of video fields to return, every
+    field when none are given
+    '''
+    if not value:
+        return list(VIDEO_FIELDS)
+    fields = set(field.strip() for field in value.split(',') if field.strip())
+    unknown = fields.difference(VIDEO_FIELDS)
+    if unknown:
+        raise ApiError('Unknown fields: {}'.format(', '.join(sorted(unknown))))
+    # Keep a fixed order, so the ETag does not depend on how they are listed
+    return [field for field in VIDEO_FIELDS if field in fields]
+
+
+def parse_ids(value):
+    '''
+    Parse "?ids=1,2,3" into a list of distinct video ids
+    '''
+    try:
+        ids = [int(id) for id in value.split(',') if id.strip()]
+    except ValueError:
+        raise ApiError('ids must be a comma separated list of integers')
+    ids = list(dict.fromkeys(ids))
+    if not ids:
+        raise ApiError('No ids given')
+    if len(ids) > settings.API_BATCH_SIZE:
+        raise ApiError('At most {} ids per request'.format(settings.API_BATCH_SIZE))
+    return ids
+
+
+def visible(user):
+    return Q(is_private=False) | Q(user_id=user.id)
+
+
+def video_columns(fields, prefix=''):
+    columns = ['id', 'version']
+    for field in fields:
+        columns += VIDEO_FIELDS[field][0]
+    return [prefix + column for column in columns]
+
+
+def only_fields(queryset, fields):
+    '''
+    Restrict a video query to the columns of the requested fields, so
+    heavy columns a client did not ask for are never read
+    '''
+    if 'user' in fields:
+        queryset = queryset.select_related('user')
+    return queryset.only(*video_columns(fields))
+
+
+def video_data(video, fields):
+    return dict((field, VIDEO_FIELDS[field][1](video)) for field in fields)
+
+
+def video_version(video, fields):
+    '''
+    The parts of a video document that can change without its version
+    '''
+    return [video.id, video.version] + [
+        VIDEO_FIELDS[field][1](video) for field in UNVERSIONED_FIELDS if field in fields]
+
+
+def etag(value):
+    '''
+    Build a strong validator from a JSON serializable value
+    '''
+    data = json.dumps(value, cls=DjangoJSONEncoder, sort_keys=True)
+    return '"{}"'.format(hashlib.sha1(data.encode()).hexdigest())
+
+
+def respond(request, validator, build):
+    '''
+    Answer a GET with the document made by build(), tagged with an ETag
+    derived from validator (the ids and versions of the rows in it).
+
+    A matching If-None-Match gets a 304 without building the document.
+    Without row versions (other backends) the ETag is taken from the
+    document itself, so it is still correct but always built.
+    '''
+    if versions_enabled():
+        document = None
+        tag = etag(validator)
+    else:
+        document = build()
+        tag = etag(document)
+
+    response = get_conditional_response(request, etag=tag)
+    if response is None:
+        response = JsonResponse(document if document is not None else build())
+        response['ETag'] = tag
+    # Documents include the user's private rows, so only the client may
+    # keep them, and must revalidate before reuse
+    response['Cache-Control'] = 'private, no-cache'
+    patch_vary_headers(response, ['Cookie'])
+    return response
+
+
+def feed_videos(user, feed, fields):
+    '''
+    Validator and builder of a home page feed
+    '''
+    if feed not in FEEDS:
+        raise ApiError('Unknown feed: {}'.format(feed))
+    videos = home_feeds(user, [feed])[feed]
+    return ([video_version(video, fields) for video in videos] + [fields],
+            lambda: {'videos': [video_data(video, fields) for video in videos]})
+
+
+def batch_videos(user, ids, fields):
+    '''
+    Validator and builder of the videos with the given ids, in that order.
+    Missing and private videos of other users are left out.
+    '''
+    found = only_fields(Video.objects.filter(visible(user)), fields).in_bulk(ids)
+    videos = [found[id] for id in ids if id in found]
+    return ([video_version(video, fields) for video in videos] + [fields],
+            lambda: {'videos': [video_data(video, fields) for video in videos]})
+
+
+def single_video(user, id, fields):
+    '''
+    Validator and builder of one video
+    '''
+    video = only_fields(Video.objects.filter(visible(user)), fields).filter(id=id).first()
+    if video is None:
+        raise ApiError('Video does not exist', 404)
+    return [video_version(video, fields), fields], lambda: video_data(video, fields)
+
+
+def playlist_videos(user, playlist_id, cursor, fields):
+    '''
+    Validator and builder of a playlist and one page of its videos
+    '''
+    playlist = Playlist.objects.select_related('user').filter(
+        visible(user), id=playlist_id).first()
+    if playlist is None:
+        raise ApiError('Playlist does not exist', 404)
+
+    entries = PlaylistEntry.objects.select_related(
+        'video__user' if 'user' in fields else 'video').filter(playlist=playlist).only(
+        'id', 'position', 'video', *video_columns(fields, 'video__'))
+    entries, next_cursor = keyset_page(entries, ['position', 'id'], cursor,
+                                       settings.PLAYLIST_PAGE_SIZE)
+    videos = [entry.video for entry in entries]
+
+    def build():
+        return {
+            'id': playlist.id,
+            'name': playlist.name,
+            'description': playlist.description,
+            'user': playlist.user.username,
+            'private': playlist.is_private,
+            'videos': [video_data(video, fields) for video in videos],
+            'next': next_cursor,
+        }
+    validator = [playlist.id, playlist.version, playlist.user.username, next_cursor, fields]
+    return validator + [video_version(video, fields) for video in videos], build
+
+
+def video_comments(user, video_id, cursor):
+    '''
+    Validator and builder of one page of comments on a video, newest first
+    '''
+    if not Video.objects.filter(visible(user), id=video_id).exists():
+        raise ApiError('Video does not exist', 404)
+
+    comments, next_cursor = keyset_page(shards.comments(video_id), ['-datetime', '-id'],
+                                        cursor, settings.COMMENT_PAGE_SIZE)
+    comments = shards.attach_users(comments)
+
+    def build():
+        return {
+            'comments': [{
+                'id': comment.id,
+                'user': comment.user.username,
+                'text': comment.text,
+                'datetime': comment.datetime,
+            } for comment in comments],
+            'next': next_cursor,
+        }
+    # Comments have no version, an edit moves their datetime
+    return [[comment.id, comment.datetime, comment.user.username]
+            for comment in comments] + [next_cursor], build
@@ -17,3 +17,6 @@ from django.apps import AppConfig
 
 class OytConfig(AppConfig):
     name = 'oyt'
+
+    def ready(self):
+        from . import signals
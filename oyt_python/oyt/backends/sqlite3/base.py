@@ -0,0 +1,31 @@
+# Copyright 2021 Bhargav SNV
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    '''
+    SQLite backend starting transactions with BEGIN IMMEDIATE.
+
+    A plain BEGIN only takes the write lock at the first write. A
+    transaction that reads first (get_or_create, delete collecting rows)
+    and then writes while another connection holds the lock fails at once
+    with "database is locked", busy_timeout does not apply to that
+    upgrade. Taking the lock at BEGIN makes such transactions wait their
+    turn instead. Reads outside transactions are not affected.
+    '''
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute('BEGIN IMMEDIATE')
@@ -0,0 +1,174 @@
+# Copyright 2021 Bhargav SNV
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+from contextlib import contextmanager
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+import os
+import pickle
+import sqlite3
+import time
+
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS cache ('
+    'key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL, accessed REAL NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)',
+]
+
+
+class SQLiteCache(BaseCache):
+    '''
+    Cache kept in a SQLite file, shared by every process on the host and
+    kept across restarts, without a cache server to run.
+
+    Beyond MAX_ENTRIES the least recently used 1/CULL_FREQUENCY of the
+    entries are dropped. The size is checked every CULL_EVERY writes of a
+    process rather than on each one, so the table can run over by that
+    many entries per process. Hits only write the access time back once
+    it is ACCESS_RESOLUTION seconds old, so a hot key is not a write per
+    read. add() and incr() are atomic across processes.
+    '''
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self.path = location
+        options = params.get('OPTIONS', {})
+        self.access_resolution = options.get('ACCESS_RESOLUTION', 10)
+        self.busy_timeout = options.get('BUSY_TIMEOUT', 5)
+        self.cull_every = options.get('CULL_EVERY', 100)
+        self.writes = 0
+        self.connection = None
+        self.pid = None
+
+    def connect(self):
+        # A connection must not cross a fork, workers forked after the
+        # cache was used open their own
+        if self.connection is None or self.pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=self.busy_timeout,
+                                         isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            for statement in SCHEMA:
+                connection.execute(statement)
+            self.connection, self.pid = connection, os.getpid()
+        return self.connection
+
+    @contextmanager
+    def transaction(self):
+        connection = self.connect()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield connection
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    def key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def get(self, key, default=None, version=None):
+        key = self.key(key, version)
+        row = self.connect().execute(
+            'SELECT value, expires, accessed FROM cache WHERE key = ?', [key]).fetchone()
+        now = time.time()
+        if row is None or (row[1] is not None and row[1] <= now):
+            return default
+        if now - row[2] >= self.access_resolution:
+            self.connect().execute('UPDATE cache SET accessed = ? WHERE key = ?', [now, key])
+        return pickle.loads(row[0])
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.key(key, version)
+        with self.transaction() as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO cache (key, value, expires, accessed) VALUES (?, ?, ?, ?)',
+                [key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL),
+                 self.get_backend_timeout(timeout), time.time()])
+            self.cull(connection)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.key(key, version)
+        now = time.time()
+        with self.transaction() as connection:
+            connection.execute('DELETE FROM cache WHERE key = ? AND expires <= ?', [key, now])
+            added = connection.execute(
+                'INSERT OR IGNORE INTO cache (key, value, expires, accessed) VALUES (?, ?, ?, ?)',
+                [key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL),
+                 self.get_backend_timeout(timeout), now]).rowcount
+            if added:
+                self.cull(connection)
+        return bool(added)
+
+    def incr(self, key, delta=1, version=None):
+        key = self.key(key, version)
+        with self.transaction() as connection:
+            row = connection.execute(
+                'SELECT value FROM cache WHERE key = ? AND (expires IS NULL OR expires > ?)',
+                [key, time.time()]).fetchone()
+            if row is None:
+                raise ValueError("Key '%s' not found" % key)
+            value = pickle.loads(row[0]) + delta
+            connection.execute('UPDATE cache SET value = ? WHERE key = ?',
+                               [pickle.dumps(value, pickle.HIGHEST_PROTOCOL), key])
+        return value
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.key(key, version)
+        return bool(self.connect().execute(
+            'UPDATE cache SET expires = ? WHERE key = ? AND (expires IS NULL OR expires > ?)',
+            [self.get_backend_timeout(timeout), key, time.time()]).rowcount)
+
+    def delete(self, key, version=None):
+        key = self.key(key, version)
+        return bool(self.connect().execute('DELETE FROM cache WHERE key = ?', [key]).rowcount)
+
+    def delete_many(self, keys, version=None):
+        keys = [self.key(key, version) for key in keys]
+        if keys:
+            self.connect().execute('DELETE FROM cache WHERE key IN ({})'.format(
+                ', '.join('?' * len(keys))), keys)
+
+    def has_key(self, key, version=None):
+        key = self.key(key, version)
+        return self.connect().execute(
+            'SELECT 1 FROM cache WHERE key = ? AND (expires IS NULL OR expires > ?)',
+            [key, time.time()]).fetchone() is not None
+
+    def clear(self):
+        self.connect().execute('DELETE FROM cache')
+
+    def cull(self, connection):
+        '''
+        Drop expired entries, then the least recently used ones, once the
+        table is over MAX_ENTRIES
+        '''
+        self.writes += 1
+        if self.writes % self.cull_every:
+            return
+        entries = connection.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+        if entries <= self._max_entries:
+            return
+        entries -= connection.execute(
+            'DELETE FROM cache WHERE expires <= ?', [time.time()]).rowcount
+        if entries <= self._max_entries:
+            return
+        if self._cull_frequency == 0:
+            connection.execute('DELETE FROM cache')
+            return
+        connection.execute(
+            'DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed LIMIT ?)',
+            [entries // self._cull_frequency])
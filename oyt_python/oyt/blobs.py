@@ -0,0 +1,194 @@
+# Copyright 2021 Bhargav SNV
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from hashlib import sha256
+from .media import DERIVED_DIRS
+from .models import Blob
+from .storage import media_storage
+import fcntl
+import os
+import shutil
+import tempfile
+
+# Size of the blocks read when hashing a file on disk
+BLOCK_SIZE = 1024 * 1024
+
+# Blob file extensions by upload content type, so media is served with
+# the right type
+EXTENSIONS = {
+    'video/mp4': '.mp4',
+    'video/webm': '.webm',
+}
+
+
+class HashingUploadHandler(FileUploadHandler):
+    '''
+    Hash uploaded files as their chunks arrive, passing the data on to
+    the handlers that store it. Must run before the request body is read.
+    '''
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.digests = {}
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.hash = sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.hash.update(raw_data)
+        return raw_data
+
+    def file_complete(self, file_size):
+        self.digests[self.field_name] = self.hash.hexdigest()
+        return None
+
+
+def file_digest(path):
+    '''
+    SHA-256 of a file on disk, read in fixed size blocks
+    '''
+    digest = sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def blob_path(blob):
+    return media_storage().path(blob.name)
+
+
+def acquire(digest, user=None, size=None):
+    '''
+    Take a reference on the stored blob with the given hash, None if there
+    is none. With a user, only blobs of videos visible to them are found,
+    so knowing the hash of a private video does not give access to it.
+    '''
+    blobs = Blob.objects.filter(sha256=digest)
+    if size is not None:
+        blobs = blobs.filter(size=size)
+    if user is not None:
+        blobs = blobs.filter(Q(video__is_private=False) | Q(video__user_id=user.id))
+    blob_id = blobs.values_list('id', flat=True).first()
+
+    # The last reference is dropped in the same transaction that deletes
+    # the row, so a blob that is still there is safe to reference
+    if blob_id is None or not Blob.objects.filter(id=blob_id).update(
+            refcount=F('refcount') + 1):
+        return None
+    return Blob.objects.get(id=blob_id)
+
+
+def store(path, digest, content_type):
+    '''
+    Move a fully received file into storage under its hash and return its
+    blob with a reference taken. A file already stored is discarded.
+    '''
+    blob = acquire(digest)
+    if blob is not None:
+        os.remove(path)
+        return blob
+
+    name = digest + EXTENSIONS.get(content_type, '')
+    size = os.path.getsize(path)
+    # Blob files never change, so racing uploads replacing each other's
+    # file leave the same content in place
+    with files_lock():
+        media_storage().move_in(path, name)
+    try:
+        with transaction.atomic():
+            return Blob.objects.create(sha256=digest, name=name, size=size, refcount=1)
+    except IntegrityError:
+        return acquire(digest)
+
+
+def store_upload(uploaded, digest, content_type):
+    '''
+    Store a file received by a form upload, skipping the copy when its
+    content is already stored
+    '''
+    blob = acquire(digest)
+    if blob is not None:
+        return blob
+
+    # Write next to MEDIA_ROOT so the file is usually moved into place by rename
+    os.makedirs(settings.CHUNKED_UPLOAD_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(suffix='.part', dir=settings.CHUNKED_UPLOAD_DIR)
+    with os.fdopen(fd, 'wb') as f:
+        for chunk in uploaded.chunks():
+            f.write(chunk)
+    return store(path, digest, content_type)
+
+
+def remove_files(path):
+    '''
+    Remove a media file along with everything derived from it
+    '''
+    for name in [path, path + '.jpg']:
+        try:
+            os.remove(name)
+        except FileNotFoundError:
+            pass
+    for marker in DERIVED_DIRS:
+        shutil.rmtree(path + marker.rstrip('/'), ignore_errors=True)
+
+
+@contextmanager
+def files_lock():
+    '''
+    Hold the lock that serializes moving blob files in with removing
+    them, across processes
+    '''
+    os.makedirs(settings.CHUNKED_UPLOAD_DIR, exist_ok=True)
+    with open(os.path.join(settings.CHUNKED_UPLOAD_DIR, 'blobs.lock'), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+
+
+def file_id(path):
+    try:
+        return os.stat(path).st_ino
+    except FileNotFoundError:
+        return None
+
+
+def release(blob_id):
+    '''
+    Drop a reference to a blob. The last reference deletes the blob, and
+    its files once the deletion is committed.
+    '''
+    with transaction.atomic():
+        Blob.objects.filter(id=blob_id).update(refcount=F('refcount') - 1)
+        blob = Blob.objects.filter(id=blob_id, refcount__lte=0).first()
+        if blob is None:
+            return
+        blob.delete()
+        # A store of the same content can only start once the delete is
+        # committed, and always moves in a new file
+        stored = file_id(blob_path(blob))
+
+    def collect():
+        # Skip files the same content was stored again under, whether
+        # its row is committed yet or not
+        with files_lock():
+            if (not Blob.objects.filter(sha256=blob.sha256).exists()
+                    and file_id(blob_path(blob)) == stored):
+                remove_files(blob_path(blob))
+    transaction.on_commit(collect)
@@ -0,0 +1,138 @@
+# Copyright 2021 Bhargav SNV
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from .models import Video
+from . import singleflight
+
+# Home page feeds, mapping feed name to the fields it is ordered by,
+# all descending
+FEEDS = {
+    'recent': ['datetime', 'id'],
+    'trending': ['trending_score', 'id'],
+    'viewed': ['num_views', 'id'],
+}
+
+HITS_KEY = 'feeds:hits'
+MISSES_KEY = 'feeds:misses'
+
+
+def cache_key(feed):
+    return 'feeds:public:{}'.format(feed)
+
+
+def count(key):
+    '''
+    Bump a hit/miss counter, kept in the cache so every process served
+    by a shared cache backend adds to the same numbers
+    '''
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Evicted between add() and incr()
+        cache.add(key, 1, timeout=None)
+
+
+def stats():
+    hits = cache.get(HITS_KEY, 0)
+    misses = cache.get(MISSES_KEY, 0)
+    return {'hits': hits, 'misses': misses}
+
+
+def reset_stats():
+    cache.delete_many([HITS_KEY, MISSES_KEY])
+
+
+def load_public_ids(feed):
+    # Read from the primary, a list cached from a lagging replica would be
+    # served to everyone until it expires
+    ordering = ['-' + field for field in FEEDS[feed]]
+    return list(Video.objects.using(DEFAULT_DB_ALIAS).filter(is_private=False).order_by(
+        *ordering).values_list('id', flat=True)[:settings.HOME_FEED_SIZE])
+
+
+def public_ids(feed):
+    '''
+    IDs of the public videos of a feed, from the cache when possible. An
+    expired list is rebuilt by one process while the others keep using
+    the old one, see singleflight.get_or_set
+    '''
+    loaded = []
+
+    def load():
+        loaded.append(feed)
+        return load_public_ids(feed)
+
+    ids = singleflight.get_or_set(cache_key(feed), load, settings.HOME_FEED_CACHE_TIMEOUT)
+    count(MISSES_KEY if loaded else HITS_KEY)
+    return ids
+
+
+def warm():
+    '''
+    Rebuild the cached list of every feed, returning the keys written.
+    A rebuild lock held by a request is left to it.
+    '''
+    keys = []
+    for feed in FEEDS:
+        singleflight.refresh(cache_key(feed), lambda: load_public_ids(feed),
+                             settings.HOME_FEED_CACHE_TIMEOUT)
+        keys.append(cache_key(feed))
+    return keys
+
+
+def cached_ids(feed):
+    '''
+    The cached public list of a feed without computing it, None when it
+    is not cached
+    '''
+    return singleflight.peek(cache_key(feed))
+
+
+def invalidate(*feeds):
+    '''
+    Drop the cached public lists of the given feeds, or of all feeds
+    '''
+    cache.delete_many([cache_key(feed) for feed in feeds or FEEDS])
+
+
+def home_feeds(user, names=None):
+    '''
+    Build the home page feeds for a user, every feed unless names are
+    given. Public videos come from the cached id lists and are loaded in
+    one query; the user's own private videos are read separately and
+    merged in by the same ordering.
+    '''
+    size = settings.HOME_FEED_SIZE
+    ids = dict((feed, public_ids(feed)) for feed in names or FEEDS)
+    rows = Video.objects.select_related('user').in_bulk(
+        set(id for feed_ids in ids.values() for id in feed_ids))
+
+    feeds = {}
+    for feed in ids:
+        fields = FEEDS[feed]
+        # Skip rows made private or deleted since the list was cached
+        videos = [rows[id] for id in ids[feed] if id in rows and not rows[id].is_private]
+        if user.is_authenticated:
+            videos += Video.objects.select_related('user').filter(
+                user_id=user.id, is_private=True).order_by(
+                *['-' + field for field in fields])[:size]
+
+        videos.sort(key=lambda video: [getattr(video, field) for field in fields],
+                    reverse=True)
+        feeds[feed] = videos[:size]
+    return feeds
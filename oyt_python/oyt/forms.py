@@ -41,6 +41,16 @@ class NewVideoForm(forms.Form):
     video = forms.FileField()
 
 
+class ChunkedUploadForm(forms.Form):
+    title = forms.CharField(label='Title', max_length=30)
+    description = forms.CharField(label='Description', max_length=300)
+    is_private = forms.BooleanField(label='Private', required=False)
+    filename = forms.CharField(max_length=200)
+    content_type = forms.CharField(max_length=100)
+    size = forms.IntegerField(min_value=1)
+    sha256 = forms.RegexField(regex=r'^[0-9a-f]{64}$', required=False)
+
+
 class EditVideoForm(forms.Form):
     title = forms.CharField(label='Title', max_length=100, required=False)
     description = forms.CharField(
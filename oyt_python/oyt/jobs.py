@@ -0,0 +1,469 @@
+# Copyright 2021 Bhargav SNV
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+from hashlib import sha256
+from .models import Job, MediaStatus, Video
+from .storage import media_storage
+import json
+import math
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+# Registered job kinds, mapping kind to (handler, Video status field)
+HANDLERS = {}
+
+
+class JobError(Exception):
+    pass
+
+
+def register(kind, status_field):
+    '''
+    Register a handler for a job kind. The handler receives the Job and
+    runs inside a worker process; status_field names the Video column
+    that is set to ready or failed once the job settles.
+    '''
+    def decorator(func):
+        HANDLERS[kind] = (func, status_field)
+        return func
+    return decorator
+
+
+def enqueue(video, kind, timeout=None):
+    '''
+    Queue a job of the given kind for a video
+    '''
+    return Job.objects.create(
+        kind=kind,
+        video=video,
+        max_attempts=settings.MEDIA_JOB_MAX_ATTEMPTS,
+        timeout=timeout or settings.MEDIA_JOB_TIMEOUT
+    )
+
+
+def enqueue_processing(video):
+    '''
+    Queue everything a freshly uploaded video needs. Videos sharing a
+    stored file share its derived files too, so outputs another video of
+    the same file already has are taken over instead of rebuilt.
+    '''
+    sibling = None
+    if video.blob_id is not None:
+        sibling = Video.objects.filter(blob_id=video.blob_id).exclude(id=video.id).first()
+
+    done = {}
+    for kind, timeout in [('thumbnail', None),
+                          ('hls', settings.HLS_JOB_TIMEOUT),
+                          ('storyboard', None)]:
+        status_field = HANDLERS[kind][1]
+        if sibling is not None and getattr(sibling, status_field) == MediaStatus.READY:
+            done[status_field] = MediaStatus.READY
+        else:
+            enqueue(video, kind, timeout=timeout)
+
+    if done:
+        if 'thumbnail_status' in done:
+            done['thumbnails'] = sibling.thumbnails
+        if 'hls_status' in done:
+            done['hls_progress'] = 100
+        Video.objects.filter(id=video.id).update(**done)
+
+
+def source_path(video):
+    '''
+    Absolute path of the uploaded file for a video
+    '''
+    return media_storage().path(video.path[len(settings.MEDIA_URL):])
+
+
+def run_tool(command, timeout):
+    '''
+    Run an external tool with an argument list and return its output,
+    raising JobError on failure
+    '''
+    name = os.path.basename(command[0])
+    try:
+        result = subprocess.run(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, timeout=timeout, check=True)
+    except subprocess.TimeoutExpired:
+        raise JobError('{} timed out after {}s'.format(name, timeout))
+    except subprocess.CalledProcessError as e:
+        raise JobError(e.stderr.decode(errors='replace').strip()
+                       or '{} exited with status {}'.format(name, e.returncode))
+    except OSError as e:
+        raise JobError('could not run {}: {}'.format(name, e))
+    return result.stdout
+
+
+def ffmpeg_command(args):
+    return [settings.FFMPEG_BINARY, '-hide_banner', '-loglevel', 'error', '-y'] + args
+
+
+def run_ffmpeg(args, timeout):
+    '''
+    Run ffmpeg with an argument list, raising JobError on failure
+    '''
+    run_tool(ffmpeg_command(args), timeout)
+
+
+def run_ffmpeg_with_progress(args, timeout, duration, on_progress):
+    '''
+    Run ffmpeg and report the fraction of the input processed so far by
+    reading its -progress output
+    '''
+    command = ffmpeg_command(['-nostats', '-progress', 'pipe:1'] + args)
+
+    with tempfile.TemporaryFile() as stderr:
+        try:
+            process = subprocess.Popen(command, stdin=subprocess.DEVNULL,
+                                       stdout=subprocess.PIPE, stderr=stderr)
+        except OSError as e:
+            raise JobError('could not run ffmpeg: {}'.format(e))
+
+        # Kill ffmpeg from a timer, the progress loop blocks on its output
+        expired = threading.Event()
+
+        def expire():
+            expired.set()
+            process.kill()
+
+        timer = threading.Timer(timeout, expire)
+        timer.start()
+        try:
+            with process:
+                for line in process.stdout:
+                    key, _, value = line.decode(errors='replace').strip().partition('=')
+                    if key == 'out_time_us' and value.isdigit() and duration:
+                        on_progress(min(int(value) / 1e6 / duration, 1.0))
+        finally:
+            timer.cancel()
+
+        if expired.is_set():
+            raise JobError('ffmpeg timed out after {}s'.format(timeout))
+        if process.returncode != 0:
+            stderr.seek(0)
+            raise JobError(stderr.read().decode(errors='replace').strip()
+                           or 'ffmpeg exited with status {}'.format(process.returncode))
+
+
+def probe(path, timeout):
+    '''
+    Read the duration, frame size and presence of audio of a video file
+    '''
+    output = run_tool([settings.FFPROBE_BINARY, '-v', 'error', '-show_entries',
+                       'format=duration:stream=codec_type,width,height', '-of', 'json', path],
+                      timeout)
+    info = json.loads(output)
+    streams = info.get('streams', [])
+    frames = [(st.get('width') or 0, st['height']) for st in streams
+              if st.get('codec_type') == 'video' and st.get('height')]
+    return {
+        'duration': float(info.get('format', {}).get('duration') or 0),
+        'width': frames[0][0] if frames else 0,
+        'height': frames[0][1] if frames else 0,
+        'audio': any(st.get('codec_type') == 'audio' for st in streams),
+    }
+
+
+@register('thumbnail', 'thumbnail_status')
+def generate_thumbnail(job):
+    '''
+    Extract the first frame of the video as the player poster, and scale
+    it to every THUMBNAIL_WIDTHS in every THUMBNAIL_FORMATS for listings.
+
+    Scaled files are named after a hash of their content, so they can be
+    cached forever and a regenerated thumbnail gets new URLs.
+    '''
+    video = job.video
+    path = source_path(video)
+    started = time.monotonic()
+    run_ffmpeg(['-i', path, '-ss', '00:00:00.000',
+                '-vframes', '1', path + '.jpg'], job.timeout)
+
+    output_dir = path + '.thumbs'
+    build_dir = '{}.{}.tmp'.format(output_dir, job.id)
+    shutil.rmtree(build_dir, ignore_errors=True)
+    os.makedirs(build_dir)
+
+    srcsets = {}
+    try:
+        for width in sorted(settings.THUMBNAIL_WIDTHS):
+            for ext in settings.THUMBNAIL_FORMATS:
+                scaled = os.path.join(build_dir, '{}.{}'.format(width, ext))
+                remaining = job.timeout - (time.monotonic() - started)
+                run_ffmpeg(['-i', path + '.jpg', '-vf', "scale='min({},iw)':-2".format(width),
+                            '-frames:v', '1', scaled], remaining)
+
+                with open(scaled, 'rb') as f:
+                    digest = sha256(f.read()).hexdigest()[:12]
+                name = '{}.{}.{}'.format(width, digest, ext)
+                os.rename(scaled, os.path.join(build_dir, name))
+                srcsets.setdefault(ext, []).append('{}.thumbs/{} {}w'.format(
+                    video.path, name, width))
+    except JobError:
+        shutil.rmtree(build_dir, ignore_errors=True)
+        raise
+
+    shutil.rmtree(output_dir, ignore_errors=True)
+    os.rename(build_dir, output_dir)
+
+    thumbnails = dict((ext, ', '.join(srcset)) for ext, srcset in srcsets.items())
+    # Fallback src for browsers without srcset, the widest JPEG
+    if 'jpg' in srcsets:
+        thumbnails['src'] = srcsets['jpg'][-1].rsplit(' ', 1)[0]
+    # Videos of the same file point at the same thumbnails
+    Video.objects.filter(path=video.path).update(thumbnails=thumbnails)
+
+
+def hls_ladder(height):
+    '''
+    Pick the renditions that do not upscale the source, always keeping
+    the smallest one
+    '''
+    ladder = sorted(settings.HLS_RENDITIONS)
+    fitting = [rendition for rendition in ladder if rendition[0] <= height]
+    return fitting or ladder[:1]
+
+
+@register('hls', 'hls_status')
+def generate_hls(job):
+    '''
+    Transcode the video into an HLS rendition ladder with a master
+    playlist, in a single decode of the source
+    '''
+    video = job.video
+    path = source_path(video)
+    started = time.monotonic()
+    Video.objects.filter(id=video.id).update(
+        hls_status=MediaStatus.PROCESSING, hls_progress=0)
+
+    info = probe(path, job.timeout)
+    ladder = hls_ladder(info['height'])
+
+    # Build next to the final directory and swap it in once complete, so
+    # players never see a half written manifest. Build directories are per
+    # job, as videos of the same file share the output.
+    output_dir = path + '.hls'
+    build_dir = '{}.{}.tmp'.format(output_dir, job.id)
+    shutil.rmtree(build_dir, ignore_errors=True)
+    os.makedirs(build_dir)
+
+    split = '[0:v]split={}{}'.format(
+        len(ladder), ''.join('[s{}]'.format(i) for i in range(len(ladder))))
+    scales = ['[s{i}]scale=-2:{h}[v{i}]'.format(i=i, h=height)
+              for i, (height, bitrate) in enumerate(ladder)]
+    args = ['-i', path, '-filter_complex', ';'.join([split] + scales)]
+
+    stream_map = []
+    for i, (height, bitrate) in enumerate(ladder):
+        args += ['-map', '[v{}]'.format(i),
+                 '-c:v:{}'.format(i), 'libx264',
+                 '-b:v:{}'.format(i), '{}k'.format(bitrate),
+                 '-maxrate:v:{}'.format(i), '{}k'.format(bitrate * 107 // 100),
+                 '-bufsize:v:{}'.format(i), '{}k'.format(bitrate * 2)]
+        entry = 'v:{}'.format(i)
+        if info['audio']:
+            args += ['-map', '0:a:0', '-c:a:{}'.format(i), 'aac',
+                     '-b:a:{}'.format(i), '96k', '-ac:a:{}'.format(i), '2']
+            entry += ',a:{}'.format(i)
+        stream_map.append(entry + ',name:{}p'.format(height))
+
+    args += ['-preset', 'veryfast', '-g', '48', '-keyint_min', '48', '-sc_threshold', '0',
+             '-f', 'hls', '-hls_time', str(settings.HLS_SEGMENT_SECONDS),
+             '-hls_playlist_type', 'vod',
+             '-hls_segment_filename', os.path.join(build_dir, '%v', 'segment_%05d.ts'),
+             '-master_pl_name', 'master.m3u8',
+             '-var_stream_map', ' '.join(stream_map),
+             os.path.join(build_dir, '%v', 'index.m3u8')]
+
+    reported = [0]
+
+    def on_progress(fraction):
+        percent = int(fraction * 100)
+        if percent > reported[0]:
+            reported[0] = percent
+            Video.objects.filter(id=video.id).update(hls_progress=percent)
+
+    remaining = job.timeout - (time.monotonic() - started)
+    try:
+        run_ffmpeg_with_progress(args, remaining, info['duration'], on_progress)
+    except JobError:
+        shutil.rmtree(build_dir, ignore_errors=True)
+        raise
+
+    shutil.rmtree(output_dir, ignore_errors=True)
+    os.rename(build_dir, output_dir)
+    Video.objects.filter(id=video.id).update(hls_progress=100)
+
+
+def vtt_timestamp(seconds):
+    milliseconds = int(round(seconds * 1000))
+    hours, milliseconds = divmod(milliseconds, 3600000)
+    minutes, milliseconds = divmod(milliseconds, 60000)
+    return '{:02d}:{:02d}:{:02d}.{:03d}'.format(
+        hours, minutes, milliseconds // 1000, milliseconds % 1000)
+
+
+def storyboard_interval(duration):
+    '''
+    Seconds between storyboard frames, stretched for long videos so the
+    frame count stays within STORYBOARD_MAX_FRAMES
+    '''
+    return max(settings.STORYBOARD_INTERVAL, duration / settings.STORYBOARD_MAX_FRAMES)
+
+
+def storyboard_vtt(duration, interval, tile_width, tile_height):
+    '''
+    Build the WebVTT thumbnails track mapping each interval of the video
+    to its tile in the sprite sheets, as sprite_NNN.jpg#xywh=x,y,w,h
+    '''
+    per_sheet = settings.STORYBOARD_COLUMNS * settings.STORYBOARD_ROWS
+    frames = max(int(math.ceil(duration / interval)), 1)
+    cues = ['WEBVTT', '']
+    for frame in range(frames):
+        sheet, tile = divmod(frame, per_sheet)
+        row, column = divmod(tile, settings.STORYBOARD_COLUMNS)
+        start = frame * interval
+        end = min(start + interval, duration) if duration else interval
+        cues += ['{} --> {}'.format(vtt_timestamp(start), vtt_timestamp(end)),
+                 'sprite_{:03d}.jpg#xywh={},{},{},{}'.format(
+                     sheet + 1, column * tile_width, row * tile_height, tile_width, tile_height),
+                 '']
+    return '\n'.join(cues)
+
+
+@register('storyboard', 'storyboard_status')
+def generate_storyboard(job):
+    '''
+    Sample a frame every interval into tiled sprite sheets, with a WebVTT
+    track the player uses for seek previews. The whole timeline costs one
+    or two image requests instead of one per frame.
+    '''
+    video = job.video
+    path = source_path(video)
+    started = time.monotonic()
+
+    info = probe(path, job.timeout)
+    if not info['width'] or not info['height']:
+        raise JobError('no video stream to sample')
+    tile_width = settings.STORYBOARD_TILE_WIDTH
+    # Scale to an explicit even height, so the track matches the sprites
+    tile_height = max(int(round(tile_width * info['height'] / info['width'] / 2)) * 2, 2)
+    interval = storyboard_interval(info['duration'])
+
+    output_dir = path + '.storyboard'
+    build_dir = '{}.{}.tmp'.format(output_dir, job.id)
+    shutil.rmtree(build_dir, ignore_errors=True)
+    os.makedirs(build_dir)
+
+    remaining = job.timeout - (time.monotonic() - started)
+    try:
+        run_ffmpeg(['-i', path, '-vf', 'fps=1/{:g},scale={}:{},tile={}x{}'.format(
+                        interval, tile_width, tile_height,
+                        settings.STORYBOARD_COLUMNS, settings.STORYBOARD_ROWS),
+                    '-q:v', '5', os.path.join(build_dir, 'sprite_%03d.jpg')], remaining)
+    except JobError:
+        shutil.rmtree(build_dir, ignore_errors=True)
+        raise
+
+    with open(os.path.join(build_dir, 'storyboard.vtt'), 'w') as f:
+        f.write(storyboard_vtt(info['duration'], interval, tile_width, tile_height))
+
+    shutil.rmtree(output_dir, ignore_errors=True)
+    os.rename(build_dir, output_dir)
+
+
+def reclaim_stale_jobs(now=None):
+    '''
+    Requeue running jobs whose worker died without reporting back
+    '''
+    now = now or timezone.now()
+    for job in Job.objects.filter(status=Job.RUNNING):
+        grace = timedelta(seconds=job.timeout + settings.MEDIA_WORKER_POLL_INTERVAL * 10)
+        if job.locked_at is None or job.locked_at + grace < now:
+            Job.objects.filter(id=job.id, status=Job.RUNNING).update(
+                status=Job.QUEUED, locked_at=None, error='worker lost')
+
+
+def claim_jobs(limit, now=None):
+    '''
+    Claim up to limit runnable jobs. Each job is moved to running with a
+    conditional update, so concurrent workers never claim the same job.
+    '''
+    now = now or timezone.now()
+    candidates = Job.objects.filter(status=Job.QUEUED, run_after__lte=now).order_by(
+        'run_after', 'id').values_list('id', flat=True)[:limit]
+
+    claimed = []
+    for job_id in list(candidates):
+        updated = Job.objects.filter(id=job_id, status=Job.QUEUED).update(
+            status=Job.RUNNING, locked_at=now, attempts=F('attempts') + 1)
+        if updated:
+            claimed.append(job_id)
+    return claimed
+
+
+def execute_job(job_id):
+    '''
+    Run a claimed job and return None on success or the error message.
+    This is the entry point executed in pool processes.
+    '''
+    try:
+        job = Job.objects.select_related('video').get(id=job_id)
+        handler, status_field = HANDLERS[job.kind]
+        handler(job)
+    except Exception as e:
+        return str(e) or e.__class__.__name__
+    return None
+
+
+def finish_job(job_id, error=None, now=None):
+    '''
+    Record the outcome of a job, retrying with backoff until it runs out
+    of attempts and updating the status field on the video
+    '''
+    now = now or timezone.now()
+    job = Job.objects.get(id=job_id)
+    status_field = HANDLERS[job.kind][1] if job.kind in HANDLERS else None
+
+    if error is None:
+        job.status = Job.DONE
+        job.error = ''
+        video_status = MediaStatus.READY
+    elif job.attempts < job.max_attempts:
+        job.status = Job.QUEUED
+        job.error = error
+        job.run_after = now + timedelta(seconds=30 * 2 ** (job.attempts - 1))
+        video_status = None
+    else:
+        job.status = Job.FAILED
+        job.error = error
+        video_status = MediaStatus.FAILED
+
+    job.locked_at = None
+    job.save()
+
+    # Use update() so the upload time (auto_now) is left untouched
+    if video_status is not None and status_field is not None:
+        Video.objects.filter(id=job.video_id).update(
+            **{status_field: video_status})
+
@@ -0,0 +1,229 @@
+# Copyright 2021 Bhargav SNV
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection, connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import Like, Video
+from . import trending
+import atexit
+import logging
+import threading
+import time
+
+logger = logging.getLogger('oyt.likes')
+
+# Largest number of likes in one INSERT, below SQLite's variable limit
+INSERT_BATCH = 300
+
+
+def state_key(user_id, video_id):
+    return 'likes:pending:{}:{}'.format(user_id, video_id)
+
+
+def sequence_key(user_id, video_id):
+    return 'likes:sequence:{}:{}'.format(user_id, video_id)
+
+
+def next_sequence(user_id, video_id, timeout):
+    '''
+    Number a like event, higher than every earlier event on the same
+    user and video in any process. The counter is kept alive while events
+    keep coming, and only restarts once the earlier ones were flushed.
+    '''
+    key = sequence_key(user_id, video_id)
+    while True:
+        cache.add(key, 0, timeout)
+        try:
+            sequence = cache.incr(key)
+        except ValueError:
+            # Expired between the add and the incr
+            continue
+        cache.touch(key, timeout)
+        return sequence
+
+
+def newest(events):
+    '''
+    Turn buffered {(user_id, video_id): (sequence, liked)} events into
+    states, without the ones another process has a newer event for. That
+    process writes its own event, so the last click wins whichever
+    process flushes first.
+    '''
+    keys = dict((sequence_key(*key), key) for key in events)
+    current = dict((keys[name], sequence) for name, sequence in cache.get_many(keys).items())
+    return dict((key, liked) for key, (sequence, liked) in events.items()
+                if current.get(key, sequence) <= sequence)
+
+
+def insert_likes(keys):
+    '''
+    Insert likes for [(user_id, video_id)] that do not exist yet, returning
+    the keys actually inserted. A like another process inserted after they
+    were read is skipped by the unique constraint, and not returned.
+    '''
+    table = connection.ops.quote_name(Like._meta.db_table)
+    now = connection.ops.adapt_datetimefield_value(timezone.now())
+    inserted = []
+    with connection.cursor() as cursor:
+        for start in range(0, len(keys), INSERT_BATCH):
+            batch = keys[start:start + INSERT_BATCH]
+            cursor.execute(
+                'INSERT INTO {} (user_id, video_id, datetime) VALUES {} '
+                'ON CONFLICT DO NOTHING RETURNING user_id, video_id'.format(
+                    table, ', '.join(['(%s, %s, %s)'] * len(batch))),
+                [value for user_id, video_id in batch for value in (user_id, video_id, now)])
+            inserted.extend(tuple(row) for row in cursor.fetchall())
+    return inserted
+
+
+def pending_state(user_id, video_id):
+    '''
+    The like state a user last set on a video if it may not have been
+    flushed yet, None otherwise
+    '''
+    return cache.get(state_key(user_id, video_id))
+
+
+def apply_likes(states):
+    '''
+    Write a batch of {(user_id, video_id): liked} states in one
+    transaction: insert and delete the Like rows that actually change and
+    move each num_likes by the net number of rows inserted and deleted,
+    with one UPDATE per distinct delta. Returns the number of likes added
+    or removed.
+    '''
+    if not states:
+        return 0
+
+    with transaction.atomic():
+        # Drop states of videos or users deleted in the meantime
+        video_ids = set(Video.objects.filter(
+            id__in=set(video_id for _, video_id in states)).values_list('id', flat=True))
+        user_ids = set(User.objects.filter(
+            id__in=set(user_id for user_id, _ in states)).values_list('id', flat=True))
+        states = dict((key, liked) for key, liked in states.items()
+                      if key[0] in user_ids and key[1] in video_ids)
+
+        existing = set(Like.objects.filter(
+            video_id__in=video_ids, user_id__in=user_ids).values_list('user_id', 'video_id'))
+        added = insert_likes(
+            [key for key, liked in states.items() if liked and key not in existing])
+        removed = [key for key, liked in states.items() if not liked and key in existing]
+
+        deltas = {}
+        for user_id, video_id in added:
+            deltas[video_id] = deltas.get(video_id, 0) + 1
+        removed_by_video = {}
+        for user_id, video_id in removed:
+            removed_by_video.setdefault(video_id, []).append(user_id)
+        removed_count = 0
+        for video_id, removed_users in removed_by_video.items():
+            # Only count rows still there, another process may have
+            # deleted some since they were read
+            deleted, _ = Like.objects.filter(
+                video_id=video_id, user_id__in=removed_users).delete()
+            deltas[video_id] = deltas.get(video_id, 0) - deleted
+            removed_count += deleted
+
+        by_delta = {}
+        for video_id, delta in deltas.items():
+            if delta:
+                by_delta.setdefault(delta, []).append(video_id)
+        for delta, ids in by_delta.items():
+            Video.objects.filter(id__in=ids).update(num_likes=F('num_likes') + delta)
+
+    if by_delta:
+        trending.refresh(deltas.keys())
+    return len(added) + removed_count
+
+
+class LikeBuffer:
+    '''
+    Coalesce like/unlike events in memory and write them in batches.
+
+    Only the last state per (user, video) is kept, so a user toggling a
+    like costs nothing until the flush. The buffer is flushed from a
+    background thread every LIKE_BUFFER_FLUSH_INTERVAL seconds, as soon as
+    LIKE_BUFFER_MAX_EVENTS states are pending, and at exit. Pending states
+    are also written to the cache, which makes a user's own like state
+    read-your-writes consistent before the flush.
+
+    Each process has its own buffer, so events are numbered through the
+    shared cache and a flush skips states that a newer event in another
+    process replaced.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.states = {}
+        self.thread = None
+
+    def record(self, user_id, video_id, liked):
+        interval = settings.LIKE_BUFFER_FLUSH_INTERVAL
+        # Outlive the flush, so the state is in the DB before it expires
+        timeout = max(interval * 10, 60)
+        sequence = next_sequence(user_id, video_id, timeout)
+        cache.set(state_key(user_id, video_id), liked, timeout)
+
+        key = (user_id, video_id)
+        with self.lock:
+            if key not in self.states or self.states[key][0] < sequence:
+                self.states[key] = (sequence, liked)
+            full = len(self.states) >= settings.LIKE_BUFFER_MAX_EVENTS
+            if interval and self.thread is None:
+                self.thread = threading.Thread(
+                    target=self.run, name='like-buffer', daemon=True)
+                self.thread.start()
+
+        if full:
+            self.flush()
+
+    def flush(self):
+        '''
+        Write out every pending state, returning the number of changes
+        '''
+        with self.lock:
+            events, self.states = self.states, {}
+        try:
+            return apply_likes(newest(events))
+        except Exception:
+            # Put the batch back unless newer states replaced it
+            with self.lock:
+                for key, event in events.items():
+                    self.states.setdefault(key, event)
+            raise
+
+    def run(self):
+        while True:
+            time.sleep(settings.LIKE_BUFFER_FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Flushing buffered likes failed, retrying')
+            finally:
+                # This thread's connection is not closed by any request
+                connections.close_all()
+
+
+buffer = LikeBuffer()
+
+
+@atexit.register
+def flush_at_exit():
+    if buffer.states:
+        buffer.flush()
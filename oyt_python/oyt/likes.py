@@ -0,0 +1,86 @@
+# Copyright 2021 Bhargav SNV
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from .models import Like, Video
+from . import likebuffer, trending
+
+
+def like(user, video_id):
+    '''
+    Record a like, returning False if the user already liked the video.
+    The unique constraint makes a concurrent duplicate fail instead of
+    counting twice.
+
+    With LIKE_BUFFER the like is only queued, and None is returned since
+    the outcome is known once the buffer is flushed.
+    '''
+    if settings.LIKE_BUFFER:
+        likebuffer.buffer.record(user.id, video_id, True)
+        return None
+
+    with transaction.atomic():
+        _, created = Like.objects.get_or_create(user=user, video_id=video_id)
+        if created:
+            Video.objects.filter(id=video_id).update(
+                num_likes=F('num_likes') + 1)
+            trending.refresh([video_id])
+    return created
+
+
+def unlike(user, video_id):
+    '''
+    Remove a like, returning False if there was none, or None when
+    queued with LIKE_BUFFER
+    '''
+    if settings.LIKE_BUFFER:
+        likebuffer.buffer.record(user.id, video_id, False)
+        return None
+
+    with transaction.atomic():
+        deleted, _ = Like.objects.filter(
+            user=user, video_id=video_id).delete()
+        if deleted:
+            Video.objects.filter(id=video_id).update(
+                num_likes=F('num_likes') - 1)
+            trending.refresh([video_id])
+    return bool(deleted)
+
+
+def has_liked(user, video_id):
+    '''
+    Check whether the user liked a video, using the unique index
+    '''
+    return like_state(user, video_id, 0)[0]
+
+
+def like_state(user, video_id, num_likes):
+    '''
+    Return whether the user liked a video and the like count to show them.
+
+    With LIKE_BUFFER the user's own unflushed like or unlike is applied to
+    both, so they always see the result of their last click.
+    '''
+    if not user.is_authenticated:
+        return False, num_likes
+    stored = Like.objects.filter(user_id=user.id, video_id=video_id).exists()
+    if not settings.LIKE_BUFFER:
+        return stored, num_likes
+
+    pending = likebuffer.pending_state(user.id, video_id)
+    if pending is None or pending == stored:
+        return stored, num_likes
+    return pending, num_likes + (1 if pending else -1)
@@ -0,0 +1,31 @@
+# Copyright 2021 Bhargav SNV
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+from django.core.management.base import BaseCommand
+from oyt import jobs
+from oyt.models import Job, Video
+
+
+class Command(BaseCommand):
+    help = 'Queue thumbnail jobs for videos without scaled thumbnails'
+
+    def handle(self, *args, **options):
+        videos = Video.objects.filter(thumbnails={}).exclude(id__in=Job.objects.filter(
+            kind='thumbnail', status__in=[Job.QUEUED, Job.RUNNING]).values('video_id'))
+
+        count = 0
+        for video in videos.iterator():
+            jobs.enqueue(video, 'thumbnail')
+            count += 1
+        self.stdout.write('Queued {} thumbnail job(s), run them with run_media_worker'.format(count))
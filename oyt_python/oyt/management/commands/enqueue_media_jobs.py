@@ -0,0 +1,45 @@
+# Copyright 2021 Bhargav SNV
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from oyt import jobs
+from oyt.models import Job, MediaStatus, Video
+
+
+class Command(BaseCommand):
+    help = 'Queue media jobs of one kind for existing videos, e.g. to backfill HLS renditions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', help='Job kind: ' + ', '.join(sorted(jobs.HANDLERS)))
+        parser.add_argument('--all', action='store_true',
+                            help='Also queue videos whose output is already ready')
+
+    def handle(self, *args, **options):
+        kind = options['kind']
+        if kind not in jobs.HANDLERS:
+            raise CommandError('Unknown job kind {}'.format(kind))
+        status_field = jobs.HANDLERS[kind][1]
+
+        videos = Video.objects.exclude(id__in=Job.objects.filter(
+            kind=kind, status__in=[Job.QUEUED, Job.RUNNING]).values('video_id'))
+        if not options['all']:
+            videos = videos.exclude(**{status_field: MediaStatus.READY})
+
+        timeout = settings.HLS_JOB_TIMEOUT if kind == 'hls' else None
+        count = 0
+        for video in videos.iterator():
+            jobs.enqueue(video, kind, timeout=timeout)
+            count += 1
+        self.stdout.write('Queued {} {} job(s)'.format(count, kind))
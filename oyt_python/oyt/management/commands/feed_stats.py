@@ -0,0 +1,33 @@
+# Copyright 2021 Bhargav SNV
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+from django.core.management.base import BaseCommand
+from oyt import feeds
+
+
+class Command(BaseCommand):
+    help = 'Show hits and misses of the cached home page feeds'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true',
+                            help='Reset the counters after printing them')
+
+    def handle(self, *args, **options):
+        counts = feeds.stats()
+        lookups = counts['hits'] + counts['misses']
+        ratio = counts['hits'] / lookups if lookups else 0
+        self.stdout.write('hits: {hits}, misses: {misses}'.format(**counts)
+                          + ', hit ratio: {:.1%}'.format(ratio))
+        if options['reset']:
+            feeds.reset_stats()
@@ -0,0 +1,29 @@
+# Copyright 2021 Bhargav SNV
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from oyt.models import Job
+from oyt.storage import media_storage, migrate_flat
+
+
+class Command(BaseCommand):
+    help = 'Move media stored flat in the volume roots into the fanned out layout, while serving'
+
+    def handle(self, *args, **options):
+        # Leave uploads alone while a job writes next to them, a later
+        # run picks them up
+        busy = set(path[len(settings.MEDIA_URL):] for path in Job.objects.filter(
+            status=Job.RUNNING).values_list('video__path', flat=True))
+        moved = migrate_flat(media_storage(), busy)
+        self.stdout.write('Moved {} upload(s)'.format(moved))
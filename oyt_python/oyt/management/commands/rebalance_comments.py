@@ -0,0 +1,61 @@
+# Copyright 2021 Bhargav SNV
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from oyt import shards
+from oyt.models import Comment
+
+
+class Command(BaseCommand):
+    help = ('Show where comment shards live, or move shards to another comment database. '
+            'Moved comments get new ids in the target database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shard', type=int, action='append', default=[],
+                            help='Shard to move, may be repeated')
+        parser.add_argument('--to', help='Database alias to move the shards to')
+        parser.add_argument('--wait', type=float, default=None,
+                            help='Seconds to wait for every process to see a placement '
+                                 'change, default COMMENT_PLACEMENT_TTL + 1')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Comments copied per transaction')
+
+    def handle(self, *args, **options):
+        if not options['shard']:
+            self.show()
+            return
+
+        if options['to'] not in settings.COMMENT_DATABASES:
+            raise CommandError('--to must be one of {}'.format(
+                ', '.join(settings.COMMENT_DATABASES)))
+        for shard in options['shard']:
+            if not 0 <= shard < settings.COMMENT_SHARD_COUNT:
+                raise CommandError('Shards are numbered 0 to {}'.format(
+                    settings.COMMENT_SHARD_COUNT - 1))
+
+        for shard in options['shard']:
+            moved = shards.move(shard, options['to'], options['wait'],
+                                options['batch_size'], self.stdout.write)
+            self.stdout.write('Moved shard {}, {} comment(s)'.format(shard, moved))
+
+    def show(self):
+        shards.placement.clear()
+        for database in shards.databases():
+            placed = [shard for shard in range(settings.COMMENT_SHARD_COUNT)
+                      if shards.placement.database(shard) == database]
+            moving = [shard for shard in placed if shards.placement.is_moving(shard)]
+            self.stdout.write('{}: {} shard(s), {} comment(s){}'.format(
+                database, len(placed), Comment.objects.using(database).count(),
+                ', moving {}'.format(moving) if moving else ''))
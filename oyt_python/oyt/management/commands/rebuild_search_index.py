@@ -0,0 +1,31 @@
+# Copyright 2021 Bhargav SNV
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from oyt import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search indexes of videos and playlists'
+
+    def handle(self, *args, **options):
+        if not search.fts_enabled():
+            raise CommandError('Full-text search needs the SQLite FTS5 backend')
+
+        for model in search.INDEXES:
+            with transaction.atomic():
+                search.rebuild(model)
+            self.stdout.write('Rebuilt {} index ({} rows)'.format(
+                model._meta.model_name, model.objects.count()))
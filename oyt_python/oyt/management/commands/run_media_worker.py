@@ -0,0 +1,94 @@
+# Copyright 2021 Bhargav SNV
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from oyt import jobs
+from oyt.uploads import collect_stale
+from oyt.viewcounts import flush_views
+import django
+import multiprocessing
+import time
+
+# Seconds between sweeps for abandoned chunked uploads
+UPLOAD_SWEEP_INTERVAL = 600
+
+
+class Command(BaseCommand):
+    help = 'Run queued media jobs (thumbnails etc.) in a pool of processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int,
+                            default=settings.MEDIA_WORKER_PROCESSES,
+                            help='Number of jobs to run in parallel')
+        parser.add_argument('--poll-interval', type=float,
+                            default=settings.MEDIA_WORKER_POLL_INTERVAL,
+                            help='Seconds to wait between polls of the queue')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once the queue is drained')
+
+    def handle(self, *args, **options):
+        processes = options['processes']
+        poll_interval = options['poll_interval']
+
+        running = {}
+        last_sweep = 0
+        last_view_flush = time.monotonic()
+
+        # Spawn fresh interpreters rather than forking, so pool processes
+        # never share this process's database connections
+        pool = ProcessPoolExecutor(max_workers=processes, initializer=django.setup,
+                                   mp_context=multiprocessing.get_context('spawn'))
+        with pool:
+            try:
+                while True:
+                    if time.monotonic() - last_sweep > UPLOAD_SWEEP_INTERVAL:
+                        collect_stale()
+                        last_sweep = time.monotonic()
+
+                    if time.monotonic() - last_view_flush > settings.VIEW_FLUSH_INTERVAL:
+                        flush_views()
+                        last_view_flush = time.monotonic()
+
+                    jobs.reclaim_stale_jobs()
+                    for job_id in jobs.claim_jobs(processes - len(running)):
+                        running[pool.submit(jobs.execute_job, job_id)] = job_id
+
+                    if not running:
+                        if options['once']:
+                            break
+                        time.sleep(poll_interval)
+                        continue
+
+                    done, _ = wait(running, timeout=poll_interval,
+                                   return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self.record(future, running.pop(future))
+            except KeyboardInterrupt:
+                self.stdout.write('Waiting for running jobs to finish...')
+                for future in list(running):
+                    self.record(future, running.pop(future))
+
+    def record(self, future, job_id):
+        '''
+        Store the result of a finished job
+        '''
+        try:
+            error = future.result()
+        except BaseException as e:
+            error = 'worker crashed: {!r}'.format(e)
+        jobs.finish_job(job_id, error)
+        self.stdout.write('job {} {}'.format(
+            job_id, 'done' if error is None else 'failed: ' + error))
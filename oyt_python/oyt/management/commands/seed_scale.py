@@ -0,0 +1,66 @@
+# Copyright 2021 Bhargav SNV
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+from django.core.management.base import BaseCommand, CommandError
+from oyt.seeding import Seeder
+import time
+
+
+class Command(BaseCommand):
+    help = 'Bulk create a reproducible synthetic dataset of users, videos and engagement for scale testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--videos', type=int, default=10000)
+        parser.add_argument('--comments', type=int, default=50000)
+        parser.add_argument('--likes', type=int, default=100000,
+                            help='Likes to draw, repeats of a user and video are dropped')
+        parser.add_argument('--views', type=int, default=None,
+                            help='Total views spread over the videos, default 100 per video')
+        parser.add_argument('--playlists', type=int, default=1000)
+        parser.add_argument('--media', type=int, default=20,
+                            help='Distinct media files shared by the videos')
+        parser.add_argument('--media-size', type=int, default=64 * 1024,
+                            help='Bytes per media file')
+        parser.add_argument('--days', type=int, default=365,
+                            help='Spread upload times over this many days')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--batch-size', type=int, default=10000,
+                            help='Rows per transaction')
+        parser.add_argument('--password', default='seed-password',
+                            help='Password of every seeded user')
+
+    def handle(self, *args, **options):
+        if options['users'] < 1 or options['videos'] < 1 or options['media'] < 1:
+            raise CommandError('At least one user, video and media file are needed')
+
+        started = time.monotonic()
+
+        def log(message):
+            self.stdout.write('{:7.1f}s {}'.format(time.monotonic() - started, message))
+
+        seeder = Seeder(options['seed'], options['batch_size'], options['days'], log)
+        user_ids = seeder.users(options['users'], options['password'])
+        media = seeder.media(options['media'], options['media_size'])
+        views = options['views']
+        if views is None:
+            views = options['videos'] * 100
+        video_ids, uploaded, weights = seeder.videos(
+            options['videos'], user_ids, media, views)
+
+        if any(weights):
+            seeder.comments(options['comments'], user_ids, video_ids, uploaded, weights)
+            seeder.likes(options['likes'], user_ids, video_ids, uploaded, weights)
+        seeder.playlists(options['playlists'], user_ids, video_ids, weights)
+        seeder.finish()
+        log('done')
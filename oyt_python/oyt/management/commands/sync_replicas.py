@@ -0,0 +1,46 @@
+# Copyright 2021 Bhargav SNV
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from oyt import replicas
+import time
+
+
+class Command(BaseCommand):
+    help = 'Copy the primary SQLite database into the files of the DATABASE_REPLICAS'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=None,
+                            help='Keep syncing every this many seconds')
+
+    def handle(self, *args, **options):
+        paths = []
+        for alias in settings.DATABASE_REPLICAS:
+            if connections[alias].vendor != 'sqlite':
+                raise CommandError('Replica {} is not a SQLite database'.format(alias))
+            paths.append((alias, connections[alias].settings_dict['NAME']))
+        if not paths:
+            raise CommandError('No DATABASE_REPLICAS configured')
+
+        while True:
+            for alias, path in paths:
+                started = time.monotonic()
+                replicas.sync(path)
+                self.stdout.write('Synced {} in {:.2f}s'.format(
+                    alias, time.monotonic() - started))
+            if options['interval'] is None:
+                break
+            time.sleep(options['interval'])
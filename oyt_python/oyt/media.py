@@ -0,0 +1,226 @@
+# Copyright 2021 Bhargav SNV
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+import mimetypes
+import mmap
+import os
+import re
+import stat
+import uuid
+
+# Largest number of ranges honoured in one request, anything beyond
+# this is answered with the full file instead
+MAX_RANGES = 16
+
+# Size of the slices handed to the WSGI server per iteration
+CHUNK_SIZE = 256 * 1024
+
+# Directories of files derived from an upload, named after the upload
+DERIVED_DIRS = ['.hls/', '.thumbs/', '.storyboard/']
+
+# Directories whose files are named after their content and never change
+IMMUTABLE_DIRS = ['.thumbs/']
+
+range_spec_re = re.compile(r'^\s*(\d*)\s*-\s*(\d*)\s*$')
+
+mimetypes.add_type('application/vnd.apple.mpegurl', '.m3u8')
+mimetypes.add_type('video/mp2t', '.ts')
+mimetypes.add_type('text/vtt', '.vtt')
+
+
+def source_name(name):
+    '''
+    Map the name of a media file to the upload it was derived from
+    '''
+    for marker in DERIVED_DIRS:
+        index = name.find(marker)
+        if index != -1:
+            return name[:index]
+    if name.endswith('.jpg'):
+        return name[:-len('.jpg')]
+    return name
+
+
+def hls_url(video):
+    '''
+    URL of the HLS master playlist of a video, None until it is transcoded
+    '''
+    if video.hls_status != 'ready':
+        return None
+    return video.path + '.hls/master.m3u8'
+
+
+def storyboard_url(video):
+    '''
+    URL of the seek preview WebVTT track of a video, None until it is built
+    '''
+    if video.storyboard_status != 'ready':
+        return None
+    return video.path + '.storyboard/storyboard.vtt'
+
+
+def is_immutable(name):
+    '''
+    Check whether a media file is content-addressed, so clients may cache
+    it without revalidating
+    '''
+    return any(marker in name for marker in IMMUTABLE_DIRS)
+
+
+def file_etag(result):
+    '''
+    Build a strong validator from the size and modification time of a file
+    '''
+    return '"{:x}-{:x}"'.format(result.st_size, result.st_mtime_ns)
+
+
+def parse_range_header(header, size):
+    '''
+    Parse a "Range: bytes=..." header into a list of inclusive
+    (start, end) tuples.
+
+    Returns None when the header is malformed or should be ignored, and an
+    empty list when none of the requested ranges can be satisfied.
+    '''
+    units, _, specs = header.partition('=')
+    if units.strip().lower() != 'bytes' or not specs:
+        return None
+
+    ranges = []
+    for spec in specs.split(','):
+        match = range_spec_re.match(spec)
+        if match is None:
+            return None
+        first, last = match.groups()
+
+        if first == '':
+            # Suffix range, last N bytes of the file
+            if last == '':
+                return None
+            length = int(last)
+            if length == 0:
+                continue
+            ranges.append((max(size - length, 0), size - 1))
+            continue
+
+        start = int(first)
+        end = size - 1 if last == '' else min(int(last), size - 1)
+        if last != '' and int(last) < start:
+            return None
+        if start >= size:
+            continue
+        ranges.append((start, end))
+
+    if len(ranges) > MAX_RANGES:
+        return None
+    return ranges
+
+
+class RangeFile:
+    '''
+    File-like view over a byte range of an open file.
+
+    The real descriptor is exposed through fileno() and positioned at the
+    start of the range, so WSGI servers whose wsgi.file_wrapper supports
+    it (gunicorn, uwsgi) hand the range to os.sendfile using the response
+    Content-Length. Servers without sendfile fall back to read(), which
+    never returns data past the end of the range.
+    '''
+
+    def __init__(self, path, start, length):
+        self.file = open(path, 'rb')
+        self.file.seek(start)
+        self.remaining = length
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+class MultiRangeIterator:
+    '''
+    Iterate over a multipart/byteranges body backed by a memory map, so
+    each part is sliced straight out of the page cache instead of going
+    through buffered reads of the file.
+    '''
+
+    def __init__(self, path, ranges, size, content_type):
+        self.path = path
+        self.ranges = ranges
+        self.size = size
+        self.content_type = content_type
+        self.boundary = uuid.uuid4().hex
+        self.file = None
+        self.map = None
+
+    def part_header(self, start, end):
+        return (
+            '\r\n--{boundary}\r\n'
+            'Content-Type: {type}\r\n'
+            'Content-Range: bytes {start}-{end}/{size}\r\n\r\n'
+        ).format(boundary=self.boundary, type=self.content_type,
+                 start=start, end=end, size=self.size).encode()
+
+    def closing(self):
+        return '\r\n--{}--\r\n'.format(self.boundary).encode()
+
+    def content_length(self):
+        length = len(self.closing())
+        for start, end in self.ranges:
+            length += len(self.part_header(start, end)) + end - start + 1
+        return length
+
+    def __iter__(self):
+        self.file = open(self.path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        for start, end in self.ranges:
+            yield self.part_header(start, end)
+            for offset in range(start, end + 1, CHUNK_SIZE):
+                yield self.map[offset:min(offset + CHUNK_SIZE, end + 1)]
+        yield self.closing()
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+        if self.file is not None:
+            self.file.close()
+
+
+def open_range(path, start, end):
+    '''
+    Open the inclusive byte range [start, end] of the file at path
+    '''
+    return RangeFile(path, start, end - start + 1)
+
+
+def stat_media(path):
+    '''
+    Stat a media file, returning None if it is missing or not a file
+    '''
+    try:
+        result = os.stat(path)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    if not stat.S_ISREG(result.st_mode):
+        return None
+    return result
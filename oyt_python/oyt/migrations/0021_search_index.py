@@ -0,0 +1,39 @@
+# Generated by Django 3.2 on 2026-10-18 20:05
+
+from django.db import migrations
+
+
+def create_indexes(apps, schema_editor):
+    '''
+    Create and fill the FTS5 tables, only SQLite has them
+    '''
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE oyt_video_fts USING fts5(title, description, prefix='2 3')")
+    schema_editor.execute(
+        "INSERT INTO oyt_video_fts (rowid, title, description) "
+        "SELECT id, title, description FROM oyt_video")
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE oyt_playlist_fts USING fts5(name, description, prefix='2 3')")
+    schema_editor.execute(
+        "INSERT INTO oyt_playlist_fts (rowid, name, description) "
+        "SELECT id, name, coalesce(description, '') FROM oyt_playlist")
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute('DROP TABLE oyt_video_fts')
+    schema_editor.execute('DROP TABLE oyt_playlist_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('oyt', '0020_chunked_upload'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 3.2 on 2026-10-18 19:25
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def likes_to_rows(apps, schema_editor):
+    '''
+    Convert the JSON lists of liker IDs into Like rows and recount
+    '''
+    Video = apps.get_model('oyt', 'Video')
+    Like = apps.get_model('oyt', 'Like')
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    user_ids = set(User.objects.values_list('id', flat=True))
+
+    for video in Video.objects.only('id', 'likes').iterator():
+        likers = set(id for id in video.likes or [] if id in user_ids)
+        Like.objects.bulk_create(
+            [Like(user_id=id, video_id=video.id) for id in likers],
+            ignore_conflicts=True)
+        Video.objects.filter(id=video.id).update(num_likes=len(likers))
+
+
+def rows_to_likes(apps, schema_editor):
+    Video = apps.get_model('oyt', 'Video')
+    Like = apps.get_model('oyt', 'Like')
+
+    likers = {}
+    for user_id, video_id in Like.objects.values_list('user_id', 'video_id').iterator():
+        likers.setdefault(video_id, []).append(user_id)
+    for video_id, user_ids in likers.items():
+        Video.objects.filter(id=video_id).update(likes=user_ids)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('oyt', '0021_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Like',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('datetime', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('video', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='oyt.video')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='like',
+            constraint=models.UniqueConstraint(fields=('user', 'video'), name='unique_like'),
+        ),
+        # A default lets the field be restored when migrating backwards
+        migrations.AlterField(
+            model_name='video',
+            name='likes',
+            field=models.JSONField(default=list),
+        ),
+        migrations.RunPython(likes_to_rows, rows_to_likes),
+        migrations.RemoveField(
+            model_name='video',
+            name='likes',
+        ),
+    ]
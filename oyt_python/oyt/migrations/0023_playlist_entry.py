@@ -0,0 +1,80 @@
+# Generated by Django 3.2 on 2026-10-18 19:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def video_ids_to_entries(apps, schema_editor):
+    '''
+    Convert the JSON lists of video IDs into ordered PlaylistEntry rows,
+    dropping duplicates and videos that no longer exist
+    '''
+    Playlist = apps.get_model('oyt', 'Playlist')
+    PlaylistEntry = apps.get_model('oyt', 'PlaylistEntry')
+    Video = apps.get_model('oyt', 'Video')
+    existing = set(Video.objects.values_list('id', flat=True))
+
+    for playlist in Playlist.objects.only('id', 'video_ids').iterator():
+        entries = []
+        seen = set()
+        for video_id in playlist.video_ids or []:
+            if video_id in existing and video_id not in seen:
+                seen.add(video_id)
+                entries.append(PlaylistEntry(
+                    playlist_id=playlist.id, video_id=video_id, position=len(entries)))
+        PlaylistEntry.objects.bulk_create(entries)
+
+
+def entries_to_video_ids(apps, schema_editor):
+    Playlist = apps.get_model('oyt', 'Playlist')
+    PlaylistEntry = apps.get_model('oyt', 'PlaylistEntry')
+
+    video_ids = {}
+    for playlist_id, video_id in PlaylistEntry.objects.order_by(
+            'playlist_id', 'position', 'id').values_list('playlist_id', 'video_id').iterator():
+        video_ids.setdefault(playlist_id, []).append(video_id)
+    for playlist_id, ids in video_ids.items():
+        Playlist.objects.filter(id=playlist_id).update(video_ids=ids)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('oyt', '0022_like'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlaylistEntry',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('position', models.IntegerField()),
+                ('playlist', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='oyt.playlist')),
+                ('video', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='oyt.video')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='playlist',
+            name='videos',
+            field=models.ManyToManyField(through='oyt.PlaylistEntry', to='oyt.Video'),
+        ),
+        migrations.AddIndex(
+            model_name='playlistentry',
+            index=models.Index(fields=['playlist', 'position'], name='playlist_entry_position'),
+        ),
+        migrations.AddConstraint(
+            model_name='playlistentry',
+            constraint=models.UniqueConstraint(fields=('playlist', 'video'), name='unique_playlist_entry'),
+        ),
+        # A default lets the field be restored when migrating backwards
+        migrations.AlterField(
+            model_name='playlist',
+            name='video_ids',
+            field=models.JSONField(default=list),
+        ),
+        migrations.RunPython(video_ids_to_entries, entries_to_video_ids),
+        migrations.RemoveField(
+            model_name='playlist',
+            name='video_ids',
+        ),
+    ]
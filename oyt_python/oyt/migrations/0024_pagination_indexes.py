@@ -0,0 +1,21 @@
+# Generated by Django 3.2 on 2026-10-18 19:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('oyt', '0023_playlist_entry'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['video', 'datetime', 'id'], name='comment_video_datetime'),
+        ),
+        migrations.AddIndex(
+            model_name='playlist',
+            index=models.Index(fields=['name', 'id'], name='playlist_name'),
+        ),
+    ]
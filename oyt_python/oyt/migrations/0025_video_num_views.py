@@ -0,0 +1,18 @@
+# Generated by Django 3.2 on 2026-10-18 19:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('oyt', '0024_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='num_views',
+            field=models.IntegerField(default=0),
+        ),
+    ]
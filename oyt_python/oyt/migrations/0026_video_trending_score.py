@@ -0,0 +1,50 @@
+# Generated by Django 3.2 on 2026-10-18 19:36
+
+from datetime import datetime, timezone
+from django.db import migrations, models
+from django.db.models import Count
+import math
+
+# Frozen copy of oyt.trending.score with the default settings, so later
+# changes to the formula or its settings leave this migration as it was.
+# Run manage.py recompute_trending to apply other weights.
+EPOCH = datetime(2021, 1, 1, tzinfo=timezone.utc)
+HALF_LIFE = 24 * 60 * 60
+WEIGHTS = {'likes': 3.0, 'comments': 5.0, 'views': 1.0}
+
+
+def score(uploaded, num_likes, num_comments, num_views):
+    engagement = (WEIGHTS['likes'] * max(num_likes, 0)
+                  + WEIGHTS['comments'] * num_comments
+                  + WEIGHTS['views'] * num_views)
+    age = (uploaded - EPOCH).total_seconds() / HALF_LIFE
+    return math.log2(1 + engagement) + age
+
+
+def score_videos(apps, schema_editor):
+    Video = apps.get_model('oyt', 'Video')
+    Comment = apps.get_model('oyt', 'Comment')
+    comment_counts = dict(Comment.objects.values('video_id').annotate(
+        count=Count('id')).values_list('video_id', 'count'))
+
+    videos = list(Video.objects.only('id', 'datetime', 'num_likes', 'num_views'))
+    for video in videos:
+        video.trending_score = score(video.datetime, video.num_likes,
+                                     comment_counts.get(video.id, 0), video.num_views)
+    Video.objects.bulk_update(videos, ['trending_score'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('oyt', '0025_video_num_views'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='trending_score',
+            field=models.FloatField(db_index=True, default=0),
+        ),
+        migrations.RunPython(score_videos, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2 on 2026-10-18 19:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('oyt', '0026_video_trending_score'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='thumbnails',
+            field=models.JSONField(default=dict),
+        ),
+    ]
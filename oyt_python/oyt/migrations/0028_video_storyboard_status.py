@@ -0,0 +1,18 @@
+# Generated by Django 3.2 on 2026-10-18 19:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('oyt', '0027_video_thumbnails'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='storyboard_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('ready', 'Ready'), ('failed', 'Failed')], default='pending', max_length=10),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.2 on 2026-10-18 19:45
+
+from django.db import migrations, models
+import oyt.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('oyt', '0029_blob'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='video',
+            name='video',
+            field=models.FileField(null=True, storage=oyt.storage.media_storage, upload_to=''),
+        ),
+    ]
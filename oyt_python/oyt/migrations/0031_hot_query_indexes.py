@@ -0,0 +1,50 @@
+# Generated by Django 3.2 on 2026-10-18 19:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('oyt', '0030_video_storage'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='video',
+            name='trending_score',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='playlist',
+            index=models.Index(fields=['user', 'name'], name='playlist_user_name'),
+        ),
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(condition=models.Q(is_private=False), fields=['datetime', 'id'], name='video_public_recent'),
+        ),
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(condition=models.Q(is_private=False), fields=['trending_score', 'id'], name='video_public_trending'),
+        ),
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(condition=models.Q(is_private=False), fields=['num_views', 'id'], name='video_public_viewed'),
+        ),
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(condition=models.Q(is_private=True), fields=['user', 'datetime', 'id'], name='video_private_recent'),
+        ),
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(condition=models.Q(is_private=True), fields=['user', 'trending_score', 'id'], name='video_private_trending'),
+        ),
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(condition=models.Q(is_private=True), fields=['user', 'num_views', 'id'], name='video_private_viewed'),
+        ),
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(fields=['path', 'is_private'], name='video_path'),
+        ),
+    ]
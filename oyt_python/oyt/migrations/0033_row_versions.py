@@ -0,0 +1,52 @@
+# Generated by Django 3.2 on 2026-10-18 20:15
+
+from django.db import migrations, models
+
+# Bump version on every update of a row, whatever columns it writes. A
+# stale instance saved in full writes back its old version, so the new
+# value is always taken from the row being replaced. The UPDATE inside the
+# trigger does not fire it again, SQLite leaves recursive_triggers off.
+TRIGGER = (
+    'CREATE TRIGGER {table}_version AFTER UPDATE ON {table} FOR EACH ROW BEGIN '
+    'UPDATE {table} SET version = OLD.version + 1 WHERE id = OLD.id; END'
+)
+
+TABLES = ['oyt_video', 'oyt_playlist']
+
+
+def create_triggers(apps, schema_editor):
+    '''
+    Create the version triggers, other backends keep version at zero
+    '''
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for table in TABLES:
+        schema_editor.execute(TRIGGER.format(table=table))
+
+
+def drop_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for table in TABLES:
+        schema_editor.execute('DROP TRIGGER IF EXISTS {}_version'.format(table))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('oyt', '0032_comment_shards'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='playlist',
+            name='version',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='version',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(create_triggers, drop_triggers),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.2 on 2026-10-18 20:29
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('oyt', '0033_row_versions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='upload',
+            name='status',
+            field=models.CharField(choices=[('receiving', 'Receiving'), ('finalizing', 'Finalizing'), ('done', 'Done')], default='receiving', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='upload',
+            name='video',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='oyt.video'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 3.2 on 2026-10-18 21:40
+
+from django.db import migrations, models
+from django.db.models import F
+import django.utils.timezone
+
+# Adding a column rebuilds the table on SQLite, which drops the version
+# trigger made in 0033. Create it again after the rebuild either way.
+TRIGGER = (
+    'CREATE TRIGGER oyt_video_version AFTER UPDATE ON oyt_video FOR EACH ROW BEGIN '
+    'UPDATE oyt_video SET version = OLD.version + 1 WHERE id = OLD.id; END'
+)
+
+
+def create_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute('DROP TRIGGER IF EXISTS oyt_video_version')
+    schema_editor.execute(TRIGGER)
+
+
+def backfill_uploaded(apps, schema_editor):
+    '''
+    Existing videos were scored from datetime, keep their scores
+    '''
+    Video = apps.get_model('oyt', 'Video')
+    Video.objects.update(uploaded=F('datetime'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('oyt', '0034_upload_status'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, create_trigger),
+        migrations.AddField(
+            model_name='video',
+            name='uploaded',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.RunPython(backfill_uploaded, migrations.RunPython.noop),
+        migrations.RunPython(create_trigger, migrations.RunPython.noop),
+    ]
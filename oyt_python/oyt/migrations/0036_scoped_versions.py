@@ -0,0 +1,50 @@
+# Generated by Django 3.2 on 2026-10-18 22:05
+
+from django.db import migrations
+
+# Only bump version when a column the API serves is written. Counters and
+# trending scores move on every like and view, the API puts their values
+# in the ETag itself rather than dropping every cached document.
+TRIGGER = (
+    'CREATE TRIGGER {table}_version AFTER UPDATE OF {columns} ON {table} FOR EACH ROW BEGIN '
+    'UPDATE {table} SET version = OLD.version + 1 WHERE id = OLD.id; END'
+)
+
+COLUMNS = {
+    'oyt_video': ['title', 'description', 'user_id', 'uploaded', 'is_private', 'path',
+                  'hls_status', 'storyboard_status', 'thumbnails'],
+    'oyt_playlist': ['name', 'description', 'is_private', 'user_id'],
+}
+
+# The triggers of migration 0033, on any update
+UNSCOPED = (
+    'CREATE TRIGGER {table}_version AFTER UPDATE ON {table} FOR EACH ROW BEGIN '
+    'UPDATE {table} SET version = OLD.version + 1 WHERE id = OLD.id; END'
+)
+
+
+def scope_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for table, columns in COLUMNS.items():
+        schema_editor.execute('DROP TRIGGER IF EXISTS {}_version'.format(table))
+        schema_editor.execute(TRIGGER.format(table=table, columns=', '.join(columns)))
+
+
+def unscope_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for table in COLUMNS:
+        schema_editor.execute('DROP TRIGGER IF EXISTS {}_version'.format(table))
+        schema_editor.execute(UNSCOPED.format(table=table))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('oyt', '0035_video_uploaded'),
+    ]
+
+    operations = [
+        migrations.RunPython(scope_triggers, unscope_triggers),
+    ]
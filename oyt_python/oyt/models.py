@@ -13,30 +13,115 @@
 #    limitations under the License.
 
 from django.db import models
+from django.db.models import Q
 from django.contrib.auth.models import User
+from django.utils import timezone
+import uuid
+from .storage import media_storage
 
 # Create your models here.
 
 
+class MediaStatus(models.TextChoices):
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    READY = 'ready'
+    FAILED = 'failed'
+
+
+class Blob(models.Model):
+    id = models.AutoField(primary_key=True)
+    sha256 = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=100)
+    size = models.BigIntegerField()
+    refcount = models.IntegerField(default=0)
+    created = models.DateTimeField(auto_now_add=True)
+
+
 class Video(models.Model):
     id = models.AutoField(primary_key=True)
     title = models.CharField(max_length=30)
     description = models.CharField(max_length=300)
     path = models.CharField(max_length=1000)
     datetime = models.DateTimeField(auto_now=True, blank=False, null=False)
+    # datetime moves on every save, trending scores count from this instead
+    uploaded = models.DateTimeField(auto_now_add=True)
     user = models.ForeignKey('auth.User', on_delete=models.CASCADE)
-    video = models.FileField(null=True)
+    video = models.FileField(null=True, storage=media_storage)
+    blob = models.ForeignKey(Blob, null=True, on_delete=models.PROTECT)
     is_private = models.BooleanField(default=False)
-    likes = models.JSONField()
     num_likes = models.IntegerField(default=0)
+    num_views = models.IntegerField(default=0)
+    trending_score = models.FloatField(default=0)
+    thumbnails = models.JSONField(default=dict)
+    thumbnail_status = models.CharField(
+        max_length=10, choices=MediaStatus.choices, default=MediaStatus.PENDING)
+    hls_status = models.CharField(
+        max_length=10, choices=MediaStatus.choices, default=MediaStatus.PENDING)
+    hls_progress = models.IntegerField(default=0)
+    storyboard_status = models.CharField(
+        max_length=10, choices=MediaStatus.choices, default=MediaStatus.PENDING)
+    # Bumped by a trigger (migration 0036) on updates of the columns the
+    # API serves, not the counters. SQLite drops triggers when a migration
+    # rebuilds the table, such a migration has to create it again, which
+    # ApiTestCases.test_triggers checks
+    version = models.IntegerField(default=0, editable=False)
 
+    class Meta:
+        # Home feeds read public videos by each ordering, and a user's own
+        # private videos by the same orderings. Each ordering gets a pair
+        # of partial indexes, so a video is in exactly one of the pair.
+        indexes = [
+            models.Index(fields=['datetime', 'id'], condition=Q(is_private=False),
+                         name='video_public_recent'),
+            models.Index(fields=['trending_score', 'id'], condition=Q(is_private=False),
+                         name='video_public_trending'),
+            models.Index(fields=['num_views', 'id'], condition=Q(is_private=False),
+                         name='video_public_viewed'),
+            models.Index(fields=['user', 'datetime', 'id'], condition=Q(is_private=True),
+                         name='video_private_recent'),
+            models.Index(fields=['user', 'trending_score', 'id'], condition=Q(is_private=True),
+                         name='video_private_trending'),
+            models.Index(fields=['user', 'num_views', 'id'], condition=Q(is_private=True),
+                         name='video_private_viewed'),
+            models.Index(fields=['path', 'is_private'], name='video_path'),
+        ]
 
-class Comment(models.Model):
+
+class Like(models.Model):
     id = models.AutoField(primary_key=True)
-    text = models.CharField(max_length=300)
-    datetime = models.DateTimeField(auto_now=True, blank=False, null=False)
     user = models.ForeignKey('auth.User', on_delete=models.CASCADE)
     video = models.ForeignKey(Video, on_delete=models.CASCADE)
+    datetime = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'video'], name='unique_like'),
+        ]
+
+
+class Comment(models.Model):
+    # Comments live on the COMMENT_DATABASES, away from users and videos,
+    # so their foreign keys have no constraints and oyt.shards deletes them
+    # along with their video or user
+    id = models.BigAutoField(primary_key=True)
+    text = models.CharField(max_length=300)
+    datetime = models.DateTimeField(auto_now=True, blank=False, null=False)
+    user = models.ForeignKey('auth.User', on_delete=models.DO_NOTHING, db_constraint=False)
+    video = models.ForeignKey(Video, on_delete=models.DO_NOTHING, db_constraint=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['video', 'datetime', 'id'],
+                         name='comment_video_datetime'),
+        ]
+
+
+class CommentShard(models.Model):
+    shard = models.IntegerField(primary_key=True)
+    database = models.CharField(max_length=100)
+    moving = models.BooleanField(default=False)
 
 
 class Playlist(models.Model):
@@ -45,4 +130,88 @@ class Playlist(models.Model):
     is_private = models.BooleanField(default=False)
     description = models.CharField(max_length=300, null=True)
     user = models.ForeignKey('auth.User', on_delete=models.CASCADE)
-    video_ids = models.JSONField()
+    videos = models.ManyToManyField(Video, through='PlaylistEntry')
+    # Bumped like Video.version
+    version = models.IntegerField(default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['name', 'id'], name='playlist_name'),
+            models.Index(fields=['user', 'name'], name='playlist_user_name'),
+        ]
+
+
+class PlaylistEntry(models.Model):
+    id = models.AutoField(primary_key=True)
+    playlist = models.ForeignKey(Playlist, on_delete=models.CASCADE)
+    video = models.ForeignKey(Video, on_delete=models.CASCADE)
+    position = models.IntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['playlist', 'video'], name='unique_playlist_entry'),
+        ]
+        indexes = [
+            models.Index(fields=['playlist', 'position'],
+                         name='playlist_entry_position'),
+        ]
+
+
+class Job(models.Model):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    id = models.AutoField(primary_key=True)
+    kind = models.CharField(max_length=30)
+    video = models.ForeignKey(Video, on_delete=models.CASCADE)
+    status = models.CharField(
+        max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=3)
+    timeout = models.IntegerField(default=300)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True)
+    error = models.TextField(blank=True, default='')
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after']),
+        ]
+
+
+class Upload(models.Model):
+    RECEIVING = 'receiving'
+    FINALIZING = 'finalizing'
+    DONE = 'done'
+    STATUS_CHOICES = [
+        (RECEIVING, 'Receiving'),
+        (FINALIZING, 'Finalizing'),
+        (DONE, 'Done'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey('auth.User', on_delete=models.CASCADE)
+    filename = models.CharField(max_length=300)
+    content_type = models.CharField(max_length=100)
+    size = models.BigIntegerField()
+    received = models.BigIntegerField(default=0)
+    title = models.CharField(max_length=30)
+    description = models.CharField(max_length=300)
+    is_private = models.BooleanField(default=False)
+    sha256 = models.CharField(max_length=64, blank=True, default='')
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(default=timezone.now, db_index=True)
+    status = models.CharField(
+        max_length=10, choices=STATUS_CHOICES, default=RECEIVING)
+    # Video made by finalizing, kept so a repeated finalize returns it
+    video = models.ForeignKey(Video, null=True, on_delete=models.SET_NULL)
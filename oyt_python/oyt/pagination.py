@@ -0,0 +1,94 @@
+# Copyright 2021 Bhargav SNV
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+from datetime import datetime
+from django.core import signing
+from django.db.models import Q
+
+SALT = 'oyt.pagination'
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(values):
+    '''
+    Pack the sort key of the last row of a page into an opaque, signed
+    cursor string
+    '''
+    return signing.dumps(
+        [value.isoformat() if isinstance(value, datetime) else value for value in values],
+        salt=SALT)
+
+
+def decode_cursor(cursor, length):
+    '''
+    Unpack a cursor made by encode_cursor for an ordering of length fields
+    '''
+    try:
+        values = signing.loads(cursor, salt=SALT)
+    except signing.BadSignature:
+        raise InvalidCursor('Invalid cursor')
+    if not isinstance(values, list) or len(values) != length:
+        raise InvalidCursor('Invalid cursor')
+    return values
+
+
+def after(ordering, values):
+    '''
+    Filter for rows that sort after values in the given ordering.
+
+    Written as "a <= x AND (a < x OR <rest>)" rather than a plain OR of
+    the cases, so the leading column stays a range constraint SQLite can
+    seek to in a composite index.
+    '''
+    field = ordering[0]
+    name = field.lstrip('-')
+    op = 'lt' if field.startswith('-') else 'gt'
+    strictly = Q(**{'{}__{}'.format(name, op): values[0]})
+    if len(ordering) == 1:
+        return strictly
+    return Q(**{'{}__{}e'.format(name, op): values[0]}) & (
+        strictly | after(ordering[1:], values[1:]))
+
+
+def sort_key(row, ordering):
+    key = []
+    for field in ordering:
+        value = row
+        for name in field.lstrip('-').split('__'):
+            value = getattr(value, name)
+        key.append(value)
+    return key
+
+
+def keyset_page(queryset, ordering, cursor=None, size=20):
+    '''
+    Return the page of queryset following cursor, and the cursor of the
+    next page (None on the last page).
+
+    ordering must end in a unique field so the position is never
+    ambiguous. Every page is an index seek plus size + 1 rows, however
+    deep it is, unlike OFFSET which reads and discards every earlier row.
+    '''
+    rows = queryset.order_by(*ordering)
+    if cursor:
+        rows = rows.filter(after(ordering, decode_cursor(cursor, len(ordering))))
+    rows = list(rows[:size + 1])
+
+    if len(rows) <= size:
+        return rows, None
+    rows = rows[:size]
+    return rows, encode_cursor(sort_key(rows[-1], ordering))
@@ -0,0 +1,63 @@
+# Copyright 2021 Bhargav SNV
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+from django.db import transaction
+from django.db.models import Max
+from .models import PlaylistEntry, Video
+from .pagination import keyset_page
+
+
+def add_video(playlist_id, video_id):
+    '''
+    Append a video to the end of a playlist, returning False if it is
+    already in it. The unique constraint turns a concurrent duplicate into
+    a no-op instead of a second entry.
+    '''
+    with transaction.atomic():
+        last = PlaylistEntry.objects.filter(
+            playlist_id=playlist_id).aggregate(last=Max('position'))['last']
+        _, created = PlaylistEntry.objects.get_or_create(
+            playlist_id=playlist_id, video_id=video_id,
+            defaults={'position': 0 if last is None else last + 1})
+    return created
+
+
+def remove_videos(playlist_id, video_ids):
+    '''
+    Remove videos from a playlist, leaving the order of the rest intact
+    '''
+    deleted, _ = PlaylistEntry.objects.filter(
+        playlist_id=playlist_id, video_id__in=video_ids).delete()
+    return deleted
+
+
+def playlist_videos(playlist):
+    '''
+    Videos of a playlist in playlist order with their uploaders, read
+    with a single join
+    '''
+    return Video.objects.select_related('user').filter(
+        playlistentry__playlist=playlist).order_by(
+        'playlistentry__position', 'playlistentry__id')
+
+
+def playlist_page(playlist, cursor=None, size=20):
+    '''
+    One page of a playlist's videos in playlist order, and the cursor of
+    the next page
+    '''
+    entries, next_cursor = keyset_page(
+        PlaylistEntry.objects.select_related('video__user').filter(playlist=playlist),
+        ['position', 'id'], cursor, size)
+    return [entry.video for entry in entries], next_cursor
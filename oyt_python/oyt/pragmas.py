@@ -0,0 +1,40 @@
+# Copyright 2021 Bhargav SNV
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+from django.conf import settings
+
+
+def apply(connection):
+    '''
+    Run the SQLITE_PRAGMAS on a new SQLite connection, in order. Called
+    from the connection_created signal, so with CONN_MAX_AGE it runs once
+    per persistent connection rather than once per request.
+    '''
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute('PRAGMA {} = {}'.format(name, value))
+
+
+def current(connection, names):
+    '''
+    Read back the values of the given pragmas on a connection
+    '''
+    values = {}
+    with connection.cursor() as cursor:
+        for name in names:
+            cursor.execute('PRAGMA {}'.format(name))
+            values[name] = cursor.fetchone()[0]
+    return values
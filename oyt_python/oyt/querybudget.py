@@ -0,0 +1,121 @@
+# Copyright 2021 Bhargav SNV
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+from collections import Counter
+from contextlib import ExitStack
+from django.conf import settings
+from django.db import connections
+import logging
+
+logger = logging.getLogger('oyt.queries')
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def query_budget(limit):
+    '''
+    Declare the largest number of queries a view (or view method) may run
+    per request. Enforced by QueryBudgetMiddleware.
+    '''
+    def decorator(func):
+        func.query_budget = limit
+        return func
+    return decorator
+
+
+def view_budget(view_func, method):
+    '''
+    Find the budget declared on a view function or on the handler method
+    of a class-based view, None if there is none
+    '''
+    view_class = getattr(view_func, 'view_class', None)
+    if view_class is not None:
+        handler = getattr(view_class, method.lower(), None)
+        if handler is not None and hasattr(handler, 'query_budget'):
+            return handler.query_budget
+    return getattr(view_func, 'query_budget', None)
+
+
+class QueryRecorder:
+    '''
+    Database execute wrapper recording the SQL of every query. The SQL is
+    recorded with its placeholders, so queries that only differ in their
+    parameters share a shape.
+    '''
+
+    def __init__(self):
+        self.shapes = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.shapes.append(sql)
+        return execute(sql, params, many, context)
+
+    def count(self):
+        return len(self.shapes)
+
+    def repeated(self, threshold):
+        '''
+        Query shapes run at least threshold times, the usual sign of a
+        query per row (N+1) instead of a join or prefetch
+        '''
+        return [(sql, times) for sql, times in Counter(self.shapes).most_common()
+                if times >= threshold]
+
+
+class QueryBudgetMiddleware:
+    '''
+    Count the queries of every request and report views that run more
+    than their declared budget, or repeat the same query shape
+    QUERY_BUDGET_REPEAT_THRESHOLD times or more.
+
+    Reports are logged to the oyt.queries logger, or raised as
+    QueryBudgetExceeded when QUERY_BUDGET_STRICT is set.
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        request.query_budget = settings.QUERY_BUDGET_DEFAULT
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(recorder))
+            response = self.get_response(request)
+
+        self.check(request, recorder)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        budget = view_budget(view_func, request.method)
+        if budget is not None:
+            request.query_budget = budget
+
+    def check(self, request, recorder):
+        problems = []
+        budget = request.query_budget
+        if budget is not None and recorder.count() > budget:
+            problems.append('{} {} ran {} queries, budget is {}'.format(
+                request.method, request.path, recorder.count(), budget))
+
+        for sql, times in recorder.repeated(settings.QUERY_BUDGET_REPEAT_THRESHOLD):
+            problems.append('{} {} ran the same query {} times (N+1?): {}'.format(
+                request.method, request.path, times, sql))
+
+        if problems and settings.QUERY_BUDGET_STRICT:
+            raise QueryBudgetExceeded('\n'.join(problems))
+        for problem in problems:
+            logger.warning(problem)
@@ -0,0 +1,81 @@
+# Copyright 2021 Bhargav SNV
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+from contextlib import ExitStack, contextmanager
+from django.db import connections
+import re
+
+# Plan steps that read a whole table, or sort rows no index delivers in
+# order. "SCAN x USING INDEX" walks an index in order and is not matched.
+# SQLite before 3.36 writes "SCAN TABLE x".
+full_scan_re = re.compile(r'^SCAN (?:TABLE )?(\S+)$')
+temp_sort_re = re.compile(r'^USE TEMP B-TREE FOR ')
+
+
+class PlanRecorder:
+    '''
+    Database execute wrapper keeping every SELECT with its parameters, so
+    the plans can be explained afterwards with the same bound values
+    '''
+
+    def __init__(self, alias):
+        self.alias = alias
+        self.statements = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if sql.lstrip().upper().startswith('SELECT'):
+            self.statements.append((sql, params))
+        return execute(sql, params, many, context)
+
+    def problems(self):
+        '''
+        (sql, step) for each recorded statement and each plan step that
+        is a full scan or a temporary sort
+        '''
+        found = []
+        for sql, params in self.statements:
+            for step in plan_problems(explain(sql, params, self.alias)):
+                found.append((sql, step))
+        return found
+
+
+def explain(sql, params=None, using='default'):
+    '''
+    The steps of the SQLite query plan of a statement
+    '''
+    with connections[using].cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def plan_problems(steps):
+    return [step for step in steps
+            if full_scan_re.match(step) or temp_sort_re.match(step)]
+
+
+@contextmanager
+def record_plans():
+    '''
+    Record the SELECTs run inside the block on every SQLite connection,
+    yielding the list of recorders to check once the block is done
+    '''
+    recorders = []
+    with ExitStack() as stack:
+        for alias in connections:
+            if connections[alias].vendor != 'sqlite':
+                continue
+            recorder = PlanRecorder(alias)
+            stack.enter_context(connections[alias].execute_wrapper(recorder))
+            recorders.append(recorder)
+        yield recorders
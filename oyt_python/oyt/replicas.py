@@ -0,0 +1,198 @@
+# Copyright 2021 Bhargav SNV
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+import logging
+import random
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger('oyt.replicas')
+
+# Cookie marking a client that wrote recently, its reads go to the primary
+PIN_COOKIE = 'oyt_primary'
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class RoutingState(threading.local):
+    '''
+    Routing decisions of the request handled by the current thread.
+    Outside requests (workers, commands, the like buffer thread) replica
+    reads stay off and everything goes to the primary.
+    '''
+    replica_reads = False
+    replica = None
+    wrote = False
+
+
+state = RoutingState()
+
+
+class ReplicaPool:
+    '''
+    Health of the DATABASE_REPLICAS, each probed at most once every
+    REPLICA_CHECK_INTERVAL seconds per process. A replica that fails its
+    probe, or a query, is out of rotation until the next probe passes.
+    '''
+
+    def __init__(self, handler=connections):
+        self.handler = handler
+        self.checked = {}
+
+    def probe(self, alias):
+        '''
+        Check that a replica answers with the schema in place and, with
+        REPLICA_MAX_LAG, that its last sync is recent enough
+        '''
+        connection = self.handler[alias]
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1 FROM django_migrations LIMIT 1')
+                if settings.REPLICA_MAX_LAG is not None and connection.vendor == 'sqlite':
+                    # Stamped by sync()
+                    cursor.execute('PRAGMA user_version')
+                    lag = time.time() - cursor.fetchone()[0]
+                    if lag > settings.REPLICA_MAX_LAG:
+                        logger.warning('Replica %s is %.0fs behind', alias, lag)
+                        return False
+        except DatabaseError as e:
+            logger.warning('Replica %s failed its health check: %s', alias, e)
+            connection.close()
+            return False
+        return True
+
+    def is_healthy(self, alias):
+        now = time.monotonic()
+        checked_at, healthy = self.checked.get(alias, (None, False))
+        if checked_at is None or now - checked_at >= settings.REPLICA_CHECK_INTERVAL:
+            healthy = self.probe(alias)
+            self.checked[alias] = (now, healthy)
+        return healthy
+
+    def healthy(self):
+        return [alias for alias in settings.DATABASE_REPLICAS if self.is_healthy(alias)]
+
+    def fail(self, alias):
+        '''
+        Take a replica out of rotation after a query on it failed
+        '''
+        logger.warning('Replica %s taken out of rotation', alias)
+        self.checked[alias] = (time.monotonic(), False)
+
+
+pool = ReplicaPool()
+
+
+class ReplicaRouter:
+    '''
+    Send reads to a healthy replica and writes to the primary.
+
+    Replica reads are only on inside safe requests from clients that have
+    not written recently (see ReplicaMiddleware). A request reads from
+    one replica throughout, so it sees a single snapshot, and switches to
+    the primary for good at its first write. Reads inside transactions
+    go to the primary too. Without DATABASE_REPLICAS the router has no
+    opinion and everything stays on the default database.
+    '''
+
+    def __init__(self):
+        self.pool = pool
+
+    def db_for_read(self, model, **hints):
+        if not settings.DATABASE_REPLICAS:
+            return None
+        if not state.replica_reads or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        if state.replica is None:
+            healthy = self.pool.healthy()
+            if not healthy:
+                return DEFAULT_DB_ALIAS
+            state.replica = random.choice(healthy)
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        if not settings.DATABASE_REPLICAS:
+            return None
+        state.wrote = True
+        state.replica_reads = False
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = set([DEFAULT_DB_ALIAS] + settings.DATABASE_REPLICAS)
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get the schema along with the data
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
+
+
+class ReplicaMiddleware:
+    '''
+    Turn on replica reads for safe requests, and pin a client to the
+    primary for REPLICA_PIN_SECONDS after a request of theirs writes, so
+    they read their own writes until the replicas have caught up.
+
+    Placed before SessionMiddleware, so session saves count as writes.
+    '''
+
+    def __init__(self, get_response):
+        if not settings.DATABASE_REPLICAS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        state.replica_reads = (request.method in SAFE_METHODS
+                               and PIN_COOKIE not in request.COOKIES)
+        state.replica = None
+        state.wrote = False
+        try:
+            response = self.get_response(request)
+            if state.wrote:
+                response.set_cookie(PIN_COOKIE, '1', max_age=settings.REPLICA_PIN_SECONDS,
+                                    httponly=True, samesite='Lax')
+            return response
+        finally:
+            state.replica_reads = False
+            state.replica = None
+            state.wrote = False
+
+    def process_exception(self, request, exception):
+        if isinstance(exception, DatabaseError) and state.replica is not None:
+            pool.fail(state.replica)
+
+
+def sync(path, using=DEFAULT_DB_ALIAS):
+    '''
+    Copy a consistent snapshot of a SQLite primary into the replica file
+    at path with the online backup API, then stamp the snapshot time into
+    the replica's user_version for the lag check. Connections open on the
+    replica see the new data on their next read.
+    '''
+    primary = connections[using]
+    primary.ensure_connection()
+    started = int(time.time())
+    target = sqlite3.connect(path)
+    try:
+        primary.connection.backup(target)
+        target.execute('PRAGMA user_version = {}'.format(started))
+    finally:
+        target.close()
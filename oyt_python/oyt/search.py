@@ -0,0 +1,131 @@
+# Copyright 2021 Bhargav SNV
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+from django.db import connection
+from django.db.models import Q
+from .models import Video, Playlist
+from .pagination import decode_cursor, encode_cursor, keyset_page
+import re
+
+# Full-text indexes kept next to the model tables. Each is a standalone
+# FTS5 table keyed by the row id of the indexed model, with the columns
+# to index and their bm25 weights.
+INDEXES = {
+    Video: ('oyt_video_fts', ['title', 'description'], [10.0, 1.0]),
+    Playlist: ('oyt_playlist_fts', ['name', 'description'], [10.0, 1.0]),
+}
+
+token_re = re.compile(r'\w+', re.UNICODE)
+
+
+def fts_enabled():
+    return connection.vendor == 'sqlite'
+
+
+def match_expression(text):
+    '''
+    Turn user input into an FTS5 query matching every word as a prefix.
+    Words are quoted, so FTS5 operators in the input are matched literally.
+    '''
+    tokens = token_re.findall(text or '')
+    return ' '.join('"{}"*'.format(token) for token in tokens)
+
+
+def index_row(instance):
+    '''
+    Add or replace the index entry of a Video or Playlist
+    '''
+    if not fts_enabled():
+        return
+    table, columns, weights = INDEXES[type(instance)]
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM {} WHERE rowid = %s'.format(table), [instance.id])
+        cursor.execute('INSERT INTO {} (rowid, {}) VALUES (%s, {})'.format(
+            table, ', '.join(columns), ', '.join(['%s'] * len(columns))),
+            [instance.id] + [getattr(instance, column) or '' for column in columns])
+
+
+def unindex_row(instance):
+    '''
+    Remove the index entry of a deleted Video or Playlist
+    '''
+    if not fts_enabled():
+        return
+    table = INDEXES[type(instance)][0]
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM {} WHERE rowid = %s'.format(table), [instance.id])
+
+
+def rebuild(model):
+    '''
+    Repopulate the index of a model from its table
+    '''
+    table, columns, weights = INDEXES[model]
+    source = ', '.join("coalesce({}, '')".format(column) for column in columns)
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM {}'.format(table))
+        cursor.execute('INSERT INTO {} (rowid, {}) SELECT id, {} FROM {}'.format(
+            table, ', '.join(columns), source, model._meta.db_table))
+        cursor.execute("INSERT INTO {0} ({0}) VALUES ('optimize')".format(table))
+
+
+def search(model, text, user, cursor=None, per_page=20):
+    '''
+    Return one page of bm25 ranked matches visible to the user, and the
+    cursor of the next page (None on the last page).
+
+    Pages are keyed on (score, id) of the last row instead of an OFFSET.
+    Private rows are only returned to their owner. Without FTS5 (other
+    database backends) this falls back to substring matching, newest first.
+    '''
+    visible = Q(is_private=False) | Q(user_id=user.id)
+    query = match_expression(text)
+    if not query:
+        return [], None
+
+    if not fts_enabled():
+        columns = INDEXES[model][1]
+        matches = Q()
+        for column in columns:
+            matches |= Q(**{column + '__icontains': text})
+        return keyset_page(model.objects.filter(visible).filter(matches),
+                           ['-id'], cursor, per_page)
+
+    table, columns, weights = INDEXES[model]
+    score = 'bm25({}, {})'.format(table, ', '.join(str(weight) for weight in weights))
+    params = [query, user.id]
+    start = ''
+    if cursor:
+        last_score, last_id = decode_cursor(cursor, 2)
+        start = 'AND {score} >= %s AND ({score} > %s OR m.id > %s) '.format(score=score)
+        params += [last_score, last_score, last_id]
+
+    sql = (
+        'SELECT m.id, {score} FROM {fts} JOIN {table} m ON m.id = {fts}.rowid '
+        'WHERE {fts} MATCH %s AND (m.is_private = 0 OR m.user_id = %s) {start}'
+        'ORDER BY 2, m.id LIMIT %s'
+    ).format(fts=table, table=model._meta.db_table, score=score, start=start)
+
+    with connection.cursor() as db_cursor:
+        db_cursor.execute(sql, params + [per_page + 1])
+        matches = db_cursor.fetchall()
+
+    page = matches[:per_page]
+    found = model.objects.select_related('user').in_bulk([id for id, _ in page])
+    rows = [found[id] for id, _ in page if id in found]
+    next_cursor = None
+    if len(matches) > per_page:
+        last_id, last_score = page[-1]
+        next_cursor = encode_cursor([last_score, last_id])
+    return rows, next_cursor
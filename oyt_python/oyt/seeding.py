@@ -0,0 +1,350 @@
+# Copyright 2021 Bhargav SNV
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+from datetime import timedelta
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from hashlib import sha256
+from itertools import accumulate
+from .dates import explicit_dates
+from .models import Blob, Comment, Like, MediaStatus, Playlist, PlaylistEntry, Video
+from .storage import media_storage
+from . import feeds, search, shards, trending
+import bisect
+import os
+import random
+import struct
+import tempfile
+
+WORDS = (
+    'funny cat dog music live cover guitar piano drum tutorial python django '
+    'cooking pasta travel japan beach mountain review unboxing phone laptop '
+    'game speedrun highlights football tennis news weather science space rocket '
+    'history documentary vlog morning routine workout yoga dance remix lofi '
+    'study chill podcast interview comedy sketch prank challenge diy garden '
+    'woodworking painting drawing animation trailer movie reaction asmr'
+).split()
+
+
+def zipf_weights(count, exponent):
+    '''
+    Weights of count items ranked by a Zipf law, the first the heaviest
+    '''
+    return [1 / rank ** exponent for rank in range(1, count + 1)]
+
+
+class Picker:
+    '''
+    Draw items with fixed weights in O(log n) per draw
+    '''
+
+    def __init__(self, items, weights, rng):
+        self.items = items
+        self.cumulative = list(accumulate(weights))
+        self.rng = rng
+
+    def pick(self):
+        point = self.rng.random() * self.cumulative[-1]
+        return self.items[bisect.bisect_right(self.cumulative, point)]
+
+
+def bits_for(value):
+    '''
+    JPEG magnitude category and extra bits of a DC difference
+    '''
+    category = abs(value).bit_length()
+    if value < 0:
+        value += (1 << category) - 1
+    return category, value
+
+
+def solid_jpeg(rgb, width=16, height=9):
+    '''
+    Encode a baseline JPEG of a single colour. Every block only has a DC
+    coefficient, so two tiny Huffman tables cover the whole image.
+    '''
+    r, g, b = rgb
+    levels = [0.299 * r + 0.587 * g + 0.114 * b,
+              128 - 0.168736 * r - 0.331264 * g + 0.5 * b,
+              128 + 0.5 * r - 0.418688 * g - 0.081312 * b]
+    blocks = ((width + 7) // 8) * ((height + 7) // 8)
+
+    # DC of a flat block is 8 times its level shifted to zero
+    dc = [int(round((level - 128) * 8)) for level in levels]
+    categories = sorted(set([0] + [bits_for(value)[0] for value in dc]))
+    codes = dict((category, index) for index, category in enumerate(categories))
+
+    bits = []
+    for block in range(blocks):
+        for value in dc:
+            category, extra = bits_for(value if block == 0 else 0)
+            bits.append(format(codes[category], '03b'))
+            if category:
+                bits.append(format(extra, '0{}b'.format(category)))
+            # End of block, the only AC code
+            bits.append('0')
+    stream = ''.join(bits)
+    stream += '1' * (-len(stream) % 8)
+    data = bytearray()
+    for offset in range(0, len(stream), 8):
+        byte = int(stream[offset:offset + 8], 2)
+        data.append(byte)
+        if byte == 0xFF:
+            data.append(0)
+
+    def segment(marker, payload):
+        return struct.pack('>HH', marker, len(payload) + 2) + payload
+
+    components = b''.join(struct.pack('>BBB', id, 0x11, 0) for id in (1, 2, 3))
+    # Up to four DC categories, 3 bit codes never need the reserved all ones code
+    dc_table = bytes([0x00, 0, 0, len(categories)] + [0] * 13) + bytes(categories)
+    ac_table = bytes([0x10, 1] + [0] * 15) + bytes([0])
+    return (b'\xff\xd8'
+            + segment(0xFFDB, bytes([0]) + bytes([1] * 64))
+            + segment(0xFFC0, struct.pack('>BHHB', 8, height, width, 3) + components)
+            + segment(0xFFC4, dc_table + ac_table)
+            + segment(0xFFDA, bytes([3]) + b''.join(
+                struct.pack('>BB', id, 0x00) for id in (1, 2, 3)) + bytes([0, 63, 0]))
+            + bytes(data) + b'\xff\xd9')
+
+
+class Seeder:
+    '''
+    Bulk create a synthetic dataset for scale testing, reproducible from
+    its seed.
+
+    Uploads per user and engagement per video follow Zipf laws, playlist
+    lengths a Pareto law. Videos share a small set of tiny generated
+    media files through blobs, each with solid colour thumbnails.
+    '''
+
+    def __init__(self, seed=1, batch_size=10000, days=365, log=None):
+        self.rng = random.Random(seed)
+        self.batch_size = batch_size
+        self.days = days
+        self.log = log or (lambda message: None)
+        self.now = timezone.now()
+
+    def insert(self, model, objects):
+        '''
+        bulk_create objects in transactions of batch_size rows and return
+        the ids of the new rows, in insertion order
+        '''
+        last = model.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        batch = []
+        for obj in objects:
+            batch.append(obj)
+            if len(batch) >= self.batch_size:
+                self.flush(model, batch)
+                batch = []
+        self.flush(model, batch)
+        return list(model.objects.filter(id__gt=last).order_by('id').values_list('id', flat=True))
+
+    def flush(self, model, batch, **kwargs):
+        if batch:
+            with transaction.atomic():
+                model.objects.bulk_create(batch, **kwargs)
+
+    def past(self, after=None):
+        '''
+        A random time in the last days, after the given time if any
+        '''
+        start = after or self.now - timedelta(days=self.days)
+        return start + (self.now - start) * self.rng.random()
+
+    def words(self, low, high, limit):
+        return ' '.join(self.rng.sample(WORDS, self.rng.randint(low, high)))[:limit].strip()
+
+    def users(self, count, password):
+        # Hashing is slow on purpose, every seeded user shares one hash
+        hashed = make_password(password)
+        start = User.objects.count()
+        ids = self.insert(User, (User(username='seed_{}'.format(start + i), password=hashed,
+                                      email='seed_{}@example.com'.format(start + i))
+                                 for i in range(count)))
+        self.log('{} users'.format(len(ids)))
+        return ids
+
+    def media(self, count, size):
+        '''
+        Store count random media files as blobs, with a poster and scaled
+        thumbnails each, and return (blob, thumbnails) pairs
+        '''
+        storage = media_storage()
+        os.makedirs(settings.CHUNKED_UPLOAD_DIR, exist_ok=True)
+        stored = []
+        for i in range(count):
+            content = self.rng.randbytes(size)
+            digest = sha256(content).hexdigest()
+            name = digest + '.mp4'
+            fd, temp = tempfile.mkstemp(suffix='.part', dir=settings.CHUNKED_UPLOAD_DIR)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(content)
+            path = storage.move_in(temp, name)
+            blob, _ = Blob.objects.get_or_create(sha256=digest, defaults={
+                'name': name, 'size': size})
+
+            colour = tuple(self.rng.randrange(256) for _ in range(3))
+            widths = sorted(settings.THUMBNAIL_WIDTHS)
+            with open(path + '.jpg', 'wb') as f:
+                f.write(solid_jpeg(colour, widths[-1], widths[-1] * 9 // 16))
+            os.makedirs(path + '.thumbs', exist_ok=True)
+            srcset = []
+            for width in widths:
+                image = solid_jpeg(colour, width, width * 9 // 16)
+                thumb = '{}.{}.jpg'.format(width, sha256(image).hexdigest()[:12])
+                with open(os.path.join(path + '.thumbs', thumb), 'wb') as f:
+                    f.write(image)
+                srcset.append('/media/{}.thumbs/{} {}w'.format(name, thumb, width))
+            stored.append((blob, {'jpg': ', '.join(srcset),
+                                  'src': srcset[-1].rsplit(' ', 1)[0]}))
+        self.log('{} media files'.format(len(stored)))
+        return stored
+
+    def videos(self, count, user_ids, media, views, private_share=0.05):
+        '''
+        Create videos uploaded by Zipf distributed users, with Zipf
+        distributed popularity. Returns their ids, upload times and
+        popularity weights, zero for private videos.
+        '''
+        uploaders = list(user_ids)
+        self.rng.shuffle(uploaders)
+        uploader = Picker(uploaders, zipf_weights(len(uploaders), 1.0), self.rng)
+        popularity = zipf_weights(count, 1.1)
+        self.rng.shuffle(popularity)
+        total = sum(popularity)
+
+        uploaded = []
+        private = []
+
+        def build():
+            for i in range(count):
+                blob, thumbnails = self.rng.choice(media)
+                uploaded.append(self.past())
+                private.append(self.rng.random() < private_share)
+                yield Video(
+                    title=self.words(2, 4, 30),
+                    description=self.words(5, 20, 300),
+                    user_id=uploader.pick(),
+                    path='/media/' + blob.name,
+                    video=blob.name,
+                    blob=blob,
+                    is_private=private[-1],
+                    num_views=int(views * popularity[i] / total),
+                    thumbnails=thumbnails,
+                    thumbnail_status=MediaStatus.READY,
+                    datetime=uploaded[-1],
+                    uploaded=uploaded[-1]
+                )
+
+        with explicit_dates(Video._meta.get_field('datetime'), Video._meta.get_field('uploaded')):
+            ids = self.insert(Video, build())
+
+        # Reference counts cover every video of a blob, seeded or not
+        blob_ids = set(blob.id for blob, _ in media)
+        Blob.objects.filter(id__in=blob_ids).update(refcount=Coalesce(Subquery(
+            Video.objects.filter(blob_id=OuterRef('id')).values('blob_id').annotate(
+                count=Count('id')).values('count')), 0))
+
+        weights = [0 if is_private else weight for is_private, weight in zip(private, popularity)]
+        self.log('{} videos'.format(len(ids)))
+        return ids, uploaded, weights
+
+    def comments(self, count, user_ids, video_ids, uploaded, weights):
+        videos = Picker(range(len(video_ids)), weights, self.rng)
+
+        def build():
+            for _ in range(count):
+                index = videos.pick()
+                yield Comment(text=self.words(3, 15, 300), user_id=self.rng.choice(user_ids),
+                              video_id=video_ids[index], datetime=self.past(uploaded[index]))
+
+        # Comments go to the database of their video's shard, so they are
+        # batched here rather than by insert()
+        created = 0
+        batch = []
+        with explicit_dates(Comment._meta.get_field('datetime')):
+            for comment in build():
+                batch.append(comment)
+                if len(batch) >= self.batch_size:
+                    shards.bulk_create(batch)
+                    created += len(batch)
+                    batch = []
+            shards.bulk_create(batch)
+        self.log('{} comments'.format(created + len(batch)))
+
+    def likes(self, count, user_ids, video_ids, uploaded, weights):
+        '''
+        Create up to count likes, repeats of a user and video are dropped
+        '''
+        videos = Picker(range(len(video_ids)), weights, self.rng)
+        before = Like.objects.count()
+        batch = []
+        with explicit_dates(Like._meta.get_field('datetime')):
+            for _ in range(count):
+                index = videos.pick()
+                batch.append(Like(user_id=self.rng.choice(user_ids), video_id=video_ids[index],
+                                  datetime=self.past(uploaded[index])))
+                if len(batch) >= self.batch_size:
+                    self.flush(Like, batch, ignore_conflicts=True)
+                    batch = []
+            self.flush(Like, batch, ignore_conflicts=True)
+
+        Video.objects.filter(id__range=(video_ids[0], video_ids[-1])).update(num_likes=Coalesce(Subquery(
+            Like.objects.filter(video_id=OuterRef('id')).values('video_id').annotate(
+                count=Count('id')).values('count')), 0))
+        self.log('{} likes'.format(Like.objects.count() - before))
+
+    def playlists(self, count, user_ids, video_ids, weights, max_length=200):
+        '''
+        Create playlists with Pareto distributed lengths, most hold a few
+        videos and a long tail holds many
+        '''
+        ids = self.insert(Playlist, (Playlist(
+            name=self.words(1, 3, 100), description=self.words(0, 10, 300),
+            user_id=self.rng.choice(user_ids), is_private=self.rng.random() < 0.1)
+            for _ in range(count)))
+
+        videos = Picker(video_ids, weights, self.rng)
+        public = sum(1 for weight in weights if weight)
+
+        def build():
+            for playlist_id in ids:
+                length = min(int(self.rng.paretovariate(1.1)), max_length, public)
+                chosen = []
+                while len(chosen) < length:
+                    video_id = videos.pick()
+                    if video_id not in chosen:
+                        chosen.append(video_id)
+                for position, video_id in enumerate(chosen):
+                    yield PlaylistEntry(playlist_id=playlist_id, video_id=video_id,
+                                        position=position)
+
+        entries = self.insert(PlaylistEntry, build())
+        self.log('{} playlists with {} entries'.format(len(ids), len(entries)))
+
+    def finish(self):
+        '''
+        Bring derived state up to date, bulk inserts send no signals
+        '''
+        search.rebuild(Video)
+        search.rebuild(Playlist)
+        self.log('search indexes rebuilt')
+        self.log('{} trending scores'.format(trending.recompute()))
+        feeds.invalidate()
@@ -0,0 +1,78 @@
+# Copyright 2021 Bhargav SNV
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+from contextlib import ExitStack
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import OperationalError, connections
+import time
+
+write_verbs = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+
+class DatabaseTimer:
+    '''
+    Database execute wrapper adding up the time spent in queries, the part
+    of it spent in writes and how many statements failed on a locked
+    database. With SQLite, waiting for the write lock happens inside the
+    write statements, so their time is where lock contention shows.
+    '''
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+        self.write_seconds = 0.0
+        self.locked = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        except OperationalError as e:
+            if 'locked' in str(e):
+                self.locked += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            self.queries += 1
+            self.seconds += elapsed
+            if sql.lstrip().upper().startswith(write_verbs):
+                self.write_seconds += elapsed
+
+    def header(self):
+        return 'db;dur={:.2f};desc="{} queries", db-write;dur={:.2f}, db-locked;desc={}'.format(
+            self.seconds * 1000, self.queries, self.write_seconds * 1000, self.locked)
+
+
+class ServerTimingMiddleware:
+    '''
+    Report the database time of every response in a Server-Timing header,
+    read by benchmarks/loadtest.py. Only installed when SERVER_TIMING is
+    set, since it tells clients how long the server spent on a request.
+    '''
+
+    def __init__(self, get_response):
+        if not settings.SERVER_TIMING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timer = DatabaseTimer()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(timer))
+            response = self.get_response(request)
+
+        response['Server-Timing'] = timer.header()
+        return response
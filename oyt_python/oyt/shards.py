@@ -0,0 +1,348 @@
+# Copyright 2021 Bhargav SNV
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Count
+from django.db.models.functions import Mod
+from .dates import explicit_dates
+from .models import Comment, CommentShard, Video
+import time
+
+# Comment ids are allocated from a separate range on each database, from
+# its position in COMMENT_DATABASES times this. Moved comments get new ids
+# on their new database, so the range of an id tells where it lives.
+ID_SPACE = 10 ** 12
+
+
+class ShardMoving(Exception):
+    pass
+
+
+def shard_of(video_id):
+    return video_id % settings.COMMENT_SHARD_COUNT
+
+
+def home_database(shard):
+    '''
+    Database of a shard that was never moved, shards are dealt out over
+    the COMMENT_DATABASES in turn
+    '''
+    databases = settings.COMMENT_DATABASES
+    return databases[shard % len(databases)]
+
+
+class Placement:
+    '''
+    Where shards moved by rebalancing live and which shards are being
+    moved, read from the CommentShard table on the default database and
+    cached for COMMENT_PLACEMENT_TTL seconds per process
+    '''
+
+    def __init__(self):
+        self.loaded_at = None
+        self.moved = {}
+        self.moving = set()
+
+    def load(self):
+        if (self.loaded_at is not None
+                and time.monotonic() - self.loaded_at < settings.COMMENT_PLACEMENT_TTL):
+            return
+        rows = list(CommentShard.objects.using(DEFAULT_DB_ALIAS).all())
+        self.moved = dict((row.shard, row.database) for row in rows)
+        self.moving = set(row.shard for row in rows if row.moving)
+        self.loaded_at = time.monotonic()
+
+    def database(self, shard):
+        self.load()
+        return self.moved.get(shard) or home_database(shard)
+
+    def is_moving(self, shard):
+        self.load()
+        return shard in self.moving
+
+    def clear(self):
+        self.loaded_at = None
+
+
+placement = Placement()
+
+
+def database_for(video_id, write=False):
+    '''
+    Database holding the comments of a video. Writes are refused while
+    the video's shard is being moved.
+    '''
+    shard = shard_of(video_id)
+    if write and placement.is_moving(shard):
+        raise ShardMoving('Comments of video {} are being moved, try again shortly'.format(
+            video_id))
+    return placement.database(shard)
+
+
+def databases():
+    '''
+    Every database that may hold comments
+    '''
+    placement.load()
+    found = list(settings.COMMENT_DATABASES)
+    for database in placement.moved.values():
+        if database not in found:
+            found.append(database)
+    return found
+
+
+def comments(video_id):
+    return Comment.objects.using(database_for(video_id)).filter(video_id=video_id)
+
+
+def attach_users(rows):
+    '''
+    Load the authors of comments from the default database in one query,
+    in place of select_related which cannot join across databases
+    '''
+    users = User.objects.in_bulk(set(row.user_id for row in rows))
+    for row in rows:
+        if row.user_id in users:
+            row.user = users[row.user_id]
+    return rows
+
+
+def group_by_database(video_ids, write=False):
+    grouped = {}
+    for video_id in video_ids:
+        grouped.setdefault(database_for(video_id, write), []).append(video_id)
+    return grouped
+
+
+def count_by_video(video_ids):
+    '''
+    Number of comments of each video, with one query per database
+    '''
+    counts = {}
+    for database, ids in group_by_database(video_ids).items():
+        counts.update(Comment.objects.using(database).filter(video_id__in=ids).values(
+            'video_id').annotate(count=Count('id')).values_list('video_id', 'count'))
+    return counts
+
+
+def count_in_range(first, last):
+    '''
+    Number of comments of each video with an id in [first, last], with
+    one query per database
+    '''
+    counts = {}
+    for database in databases():
+        counts.update(Comment.objects.using(database).filter(
+            video_id__gte=first, video_id__lte=last).values(
+            'video_id').annotate(count=Count('id')).values_list('video_id', 'count'))
+    return counts
+
+
+def bulk_create(rows):
+    '''
+    bulk_create comments on the databases of their videos
+    '''
+    grouped = {}
+    for row in rows:
+        grouped.setdefault(database_for(row.video_id, write=True), []).append(row)
+    for database, batch in grouped.items():
+        Comment.objects.using(database).bulk_create(batch)
+
+
+def delete_for_videos(video_ids):
+    '''
+    Delete the comments of videos once their deletion is committed on the
+    default database, so a rolled back delete keeps its comments. Refused
+    up front while one of the shards is being moved.
+    '''
+    group_by_database(video_ids, write=True)
+
+    def delete():
+        for database, ids in group_by_database(video_ids).items():
+            Comment.objects.using(database).filter(video_id__in=ids).delete()
+    transaction.on_commit(delete, using=DEFAULT_DB_ALIAS)
+
+
+def delete_for_user(user_id):
+    '''
+    Delete a user's comments on every database once the user's deletion
+    is committed. Refused during a move, as deleted rows could already
+    have been copied.
+    '''
+    placement.load()
+    if placement.moving:
+        raise ShardMoving('Comments are being moved, try again shortly')
+
+    def delete():
+        for database in databases():
+            Comment.objects.using(database).filter(user_id=user_id).delete()
+    transaction.on_commit(delete, using=DEFAULT_DB_ALIAS)
+
+
+def find(comment_id):
+    '''
+    Look a comment up by id alone, on the database its id range belongs to
+    '''
+    position = comment_id // ID_SPACE
+    if not 0 <= position < len(settings.COMMENT_DATABASES):
+        return None
+    return Comment.objects.using(settings.COMMENT_DATABASES[position]).filter(
+        id=comment_id).first()
+
+
+def in_shard(queryset, shard):
+    return queryset.annotate(shard=Mod('video_id', settings.COMMENT_SHARD_COUNT)).filter(
+        shard=shard)
+
+
+def set_placement(shard, database, moving=False):
+    if database == home_database(shard) and not moving:
+        CommentShard.objects.using(DEFAULT_DB_ALIAS).filter(shard=shard).delete()
+    else:
+        CommentShard.objects.using(DEFAULT_DB_ALIAS).update_or_create(
+            shard=shard, defaults={'database': database, 'moving': moving})
+    placement.clear()
+
+
+def move(shard, target, wait=None, batch_size=1000, log=None):
+    '''
+    Move the comments of a shard to the target database, returning how
+    many were moved.
+
+    Writes to the shard are paused first. The pause is waited out for
+    COMMENT_PLACEMENT_TTL (or wait) seconds so every process has seen it.
+    The rows are then copied, the shard is pointed at the target, and the
+    source rows are deleted after a second wait. Readers never see a
+    partial shard.
+
+    Copies keep their dates and order but get new ids from the target's
+    range, as SQLite would otherwise continue the target's ids after the
+    largest copied one, inside another database's range. Links to a moved
+    comment by id (the admin, ids from the API) stop working. Comment
+    page cursors compare dates first, so an open page only repeats or
+    skips comments that share the exact date of its last comment.
+    '''
+    log = log or (lambda message: None)
+    if wait is None:
+        wait = settings.COMMENT_PLACEMENT_TTL + 1
+    if target not in settings.COMMENT_DATABASES:
+        raise ValueError('{} is not one of the COMMENT_DATABASES'.format(target))
+    placement.clear()
+    source = placement.database(shard)
+    if source == target:
+        return 0
+
+    set_placement(shard, source, moving=True)
+    try:
+        log('Paused writes to shard {}, waiting {}s'.format(shard, wait))
+        time.sleep(wait)
+
+        # Rows left by an interrupted move, the target does not serve them
+        in_shard(Comment.objects.using(target), shard).delete()
+
+        copied = 0
+        last_id = 0
+        with explicit_dates(Comment._meta.get_field('datetime')):
+            while True:
+                batch = list(in_shard(Comment.objects.using(source), shard).filter(
+                    id__gt=last_id).order_by('id')[:batch_size])
+                if not batch:
+                    break
+                last_id = batch[-1].id
+                for comment in batch:
+                    comment.id = None
+                with transaction.atomic(using=target):
+                    Comment.objects.using(target).bulk_create(batch)
+                copied += len(batch)
+        log('Copied {} comments of shard {} from {} to {}'.format(copied, shard, source, target))
+
+        remaining = in_shard(Comment.objects.using(source), shard).count()
+        if remaining != copied:
+            raise RuntimeError('Shard {} changed during the copy ({} rows, {} copied)'.format(
+                shard, remaining, copied))
+    except BaseException:
+        set_placement(shard, source)
+        raise
+
+    set_placement(shard, target)
+    log('Shard {} now on {}, waiting {}s before cleaning up {}'.format(
+        shard, target, wait, source))
+    time.sleep(wait)
+    in_shard(Comment.objects.using(source), shard).delete()
+    return copied
+
+
+def reserve_ids(database):
+    '''
+    Start comment ids on a database at its range in ID_SPACE. Only SQLite
+    sequences are handled, other backends need their sequence set by hand.
+    '''
+    connection = connections[database]
+    if database not in settings.COMMENT_DATABASES or connection.vendor != 'sqlite':
+        return
+    start = settings.COMMENT_DATABASES.index(database) * ID_SPACE
+    if not start:
+        return
+    table = Comment._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute('UPDATE sqlite_sequence SET seq = %s WHERE name = %s AND seq < %s',
+                       [start, table, start])
+        cursor.execute('INSERT INTO sqlite_sequence (name, seq) SELECT %s, %s '
+                       'WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = %s)',
+                       [table, start, table])
+
+
+class CommentRouter:
+    '''
+    Route comments to the database of their video's shard.
+
+    Queries on comments carry no instance to route by, so they go through
+    comments(video_id) (or .using(database_for(video_id))). Saves,
+    deletes and video.comment_set are routed here by their instance.
+    Videos and users reached from a comment are read from the default
+    database. Comment tables are only migrated on the COMMENT_DATABASES,
+    and those hold nothing else unless they are the default database.
+    '''
+
+    def route(self, model, hints, write):
+        instance = hints.get('instance')
+        if model is Comment:
+            if isinstance(instance, Comment) and instance.video_id is not None:
+                return database_for(instance.video_id, write)
+            if isinstance(instance, Video) and instance.id is not None:
+                return database_for(instance.id, write)
+            return None
+        if isinstance(instance, Comment):
+            return DEFAULT_DB_ALIAS
+        return None
+
+    def db_for_read(self, model, **hints):
+        return self.route(model, hints, False)
+
+    def db_for_write(self, model, **hints):
+        return self.route(model, hints, True)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if isinstance(obj1, Comment) or isinstance(obj2, Comment):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if app_label == 'oyt' and model_name == 'comment':
+            return db in settings.COMMENT_DATABASES
+        if db in settings.COMMENT_DATABASES and db != DEFAULT_DB_ALIAS:
+            return False
+        return None
@@ -0,0 +1,101 @@
+# Copyright 2021 Bhargav SNV
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+from django.contrib.auth.models import User
+from django.db.backends.signals import connection_created
+from django.db.models import F
+from django.db.models.signals import post_migrate, post_save, post_delete, pre_delete
+from django.dispatch import receiver
+from .models import Comment, Video, Playlist
+from . import blobs, feeds, pragmas, search, shards, trending
+
+
+@receiver(post_save, sender=Video)
+@receiver(post_save, sender=Playlist)
+def update_search_index(sender, instance, **kwargs):
+    search.index_row(instance)
+
+
+@receiver(post_delete, sender=Video)
+@receiver(post_delete, sender=Playlist)
+def remove_from_search_index(sender, instance, **kwargs):
+    search.unindex_row(instance)
+
+
+@receiver(post_save, sender=Video)
+@receiver(post_delete, sender=Video)
+def invalidate_feeds(sender, instance, **kwargs):
+    feeds.invalidate()
+
+
+@receiver(post_delete, sender=Video)
+def release_blob(sender, instance, **kwargs):
+    '''
+    Drop the reference of a deleted video on its stored file, including
+    videos deleted along with their user
+    '''
+    if instance.blob_id is not None:
+        blobs.release(instance.blob_id)
+
+
+@receiver(post_save, sender=Video)
+def score_video(sender, instance, created, **kwargs):
+    '''
+    Score new videos, edits keep the score since it counts from the
+    upload time
+    '''
+    if created:
+        trending.refresh([instance.id])
+
+
+@receiver(pre_delete, sender=Video)
+def delete_video_comments(sender, instance, **kwargs):
+    '''
+    Delete the comments of a video from its comment shard, they are not
+    reached by the cascade
+    '''
+    shards.delete_for_videos([instance.id])
+
+
+@receiver(pre_delete, sender=User)
+def delete_user_comments(sender, instance, **kwargs):
+    shards.delete_for_user(instance.id)
+
+
+@receiver(post_migrate)
+def reserve_comment_ids(sender, using, **kwargs):
+    if sender.name == 'oyt':
+        shards.reserve_ids(using)
+
+
+@receiver(post_save, sender=Comment)
+def score_commented_video(sender, instance, created, **kwargs):
+    if created:
+        trending.refresh([instance.video_id])
+
+
+@receiver(pre_delete, sender=User)
+def remove_user_likes(sender, instance, **kwargs):
+    '''
+    Take a deleted user's likes off the counters before they cascade away
+    '''
+    liked = list(Video.objects.filter(like__user=instance).values_list('id', flat=True))
+    if liked:
+        Video.objects.filter(id__in=liked).update(num_likes=F('num_likes') - 1)
+        trending.refresh(liked)
+
+
+@receiver(connection_created)
+def tune_connection(sender, connection, **kwargs):
+    pragmas.apply(connection)
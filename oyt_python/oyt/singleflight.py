@@ -0,0 +1,107 @@
+# Copyright 2021 Bhargav SNV
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+from django.conf import settings
+from django.core.cache import cache
+import time
+import uuid
+
+# How often a worker waiting for another one's recomputation looks again
+POLL_INTERVAL = 0.05
+
+
+def lock_key(key):
+    return key + ':lock'
+
+
+def peek(key):
+    '''
+    The cached value of key, fresh or stale, None when there is none
+    '''
+    entry = cache.get(key)
+    return None if entry is None else entry[0]
+
+
+def acquire(key):
+    '''
+    Take the recomputation lock of a key, returning the token to release
+    it with, None when another process holds it
+    '''
+    token = uuid.uuid4().hex
+    if cache.add(lock_key(key), token, settings.CACHE_LOCK_TIMEOUT):
+        return token
+    return None
+
+
+def release(key, token):
+    '''
+    Drop the lock of a key if it is still the one taken with token, not
+    one another process took after it expired
+    '''
+    if cache.get(lock_key(key)) == token:
+        cache.delete(lock_key(key))
+
+
+def refresh(key, compute, timeout):
+    '''
+    Recompute a key and store it. The lock is left alone, callers that
+    took it release it themselves.
+    '''
+    value = compute()
+    cache.set(key, (value, time.time() + timeout), timeout + settings.CACHE_STALE_GRACE)
+    return value
+
+
+def refresh_locked(key, compute, timeout, token):
+    '''
+    Refresh a key for the caller holding its lock, then release it
+    '''
+    try:
+        return refresh(key, compute, timeout)
+    finally:
+        release(key, token)
+
+
+def get_or_set(key, compute, timeout):
+    '''
+    Return the cached value of key, computing it with compute() when it is
+    missing or older than timeout seconds, such that only one process
+    recomputes a key at a time.
+
+    Entries are kept CACHE_STALE_GRACE seconds past their timeout. While
+    one process rebuilds an expired key the others keep serving the old
+    value. When there is no value at all they wait up to CACHE_LOCK_TIMEOUT
+    for the rebuilt one, and compute it themselves if it does not come.
+    '''
+    entry = cache.get(key)
+    if entry is not None:
+        value, fresh_until = entry
+        if time.time() < fresh_until:
+            return value
+        token = acquire(key)
+        if token is None:
+            return value
+        return refresh_locked(key, compute, timeout, token)
+
+    token = acquire(key)
+    if token is not None:
+        return refresh_locked(key, compute, timeout, token)
+
+    deadline = time.time() + settings.CACHE_LOCK_TIMEOUT
+    while time.time() < deadline:
+        time.sleep(POLL_INTERVAL)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry[0]
+    return compute()
@@ -0,0 +1,45 @@
+/* Copyright 2021 Bhargav SNV
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License. */
+
+// Replace "Load more" links with the next page fetched from the link,
+// which ends with the link to the page after it, if any
+(function () {
+  if (!window.fetch) {
+    return;
+  }
+
+  document.addEventListener('click', function (event) {
+    var link = event.target.closest && event.target.closest('a.load-more');
+    if (!link) {
+      return;
+    }
+    event.preventDefault();
+    if (link.classList.contains('disabled')) {
+      return;
+    }
+    link.classList.add('disabled');
+
+    fetch(link.href, { credentials: 'same-origin' }).then(function (response) {
+      if (!response.ok) {
+        throw new Error(response.statusText);
+      }
+      return response.text();
+    }).then(function (html) {
+      link.insertAdjacentHTML('beforebegin', html);
+      link.remove();
+    }).catch(function () {
+      link.classList.remove('disabled');
+    });
+  });
+})();
@@ -0,0 +1,131 @@
+/* Copyright 2021 Bhargav SNV
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License. */
+
+// Seek previews from the storyboard track of the player. The WebVTT file
+// is only fetched once the pointer reaches the controls, and each sprite
+// sheet only once a preview on it is shown.
+(function () {
+  var video = document.querySelector('video[data-storyboard]');
+  if (!video || !window.fetch) {
+    return;
+  }
+
+  // Height of the native control bar the previews follow
+  var CONTROLS_HEIGHT = 48;
+  var trackUrl = new URL(video.getAttribute('data-storyboard'), window.location.href);
+  var cues = null;
+  var loading = false;
+
+  var preview = document.createElement('div');
+  preview.className = 'storyboard-preview';
+  video.parentNode.insertBefore(preview, video.nextSibling);
+
+  function parseTime(text) {
+    var parts = text.trim().split(':');
+    var seconds = 0;
+    for (var i = 0; i < parts.length; i++) {
+      seconds = seconds * 60 + parseFloat(parts[i]);
+    }
+    return seconds;
+  }
+
+  function parse(text) {
+    var parsed = [];
+    text.split(/\r?\n\r?\n/).forEach(function (block) {
+      var lines = block.trim().split(/\r?\n/);
+      for (var i = 0; i + 1 < lines.length; i++) {
+        var times = lines[i].split('-->');
+        var match = /^(.*)#xywh=(\d+),(\d+),(\d+),(\d+)$/.exec(lines[i + 1].trim());
+        if (times.length === 2 && match) {
+          parsed.push({
+            start: parseTime(times[0]),
+            end: parseTime(times[1]),
+            src: new URL(match[1], trackUrl).href,
+            x: +match[2], y: +match[3], w: +match[4], h: +match[5]
+          });
+          break;
+        }
+      }
+    });
+    return parsed;
+  }
+
+  function load() {
+    if (loading) {
+      return;
+    }
+    loading = true;
+    fetch(trackUrl.href, { credentials: 'same-origin' }).then(function (response) {
+      if (!response.ok) {
+        throw new Error(response.statusText);
+      }
+      return response.text();
+    }).then(function (text) {
+      cues = parse(text);
+    }).catch(function () {
+      loading = false;
+    });
+  }
+
+  function show(time, left) {
+    if (!cues) {
+      return;
+    }
+    var cue = null;
+    for (var i = 0; i < cues.length; i++) {
+      if (time >= cues[i].start && time < cues[i].end) {
+        cue = cues[i];
+        break;
+      }
+    }
+    if (!cue) {
+      hide();
+      return;
+    }
+    preview.style.width = cue.w + 'px';
+    preview.style.height = cue.h + 'px';
+    preview.style.backgroundImage = 'url("' + cue.src + '")';
+    preview.style.backgroundPosition = -cue.x + 'px ' + -cue.y + 'px';
+    preview.style.left = video.offsetLeft + Math.max(0, Math.min(
+      left - cue.w / 2, video.offsetWidth - cue.w)) + 'px';
+    preview.style.top = video.offsetTop + video.offsetHeight - CONTROLS_HEIGHT - cue.h - 8 + 'px';
+    preview.style.display = 'block';
+  }
+
+  function hide() {
+    preview.style.display = 'none';
+  }
+
+  video.addEventListener('mouseenter', load);
+  video.addEventListener('focus', load);
+  video.addEventListener('mouseleave', hide);
+
+  video.addEventListener('mousemove', function (event) {
+    var rect = video.getBoundingClientRect();
+    if (!video.duration || event.clientY < rect.bottom - CONTROLS_HEIGHT) {
+      hide();
+      return;
+    }
+    var fraction = (event.clientX - rect.left) / rect.width;
+    show(fraction * video.duration, event.clientX - rect.left);
+  });
+
+  video.addEventListener('seeking', function () {
+    load();
+    if (video.duration) {
+      show(video.currentTime, video.currentTime / video.duration * video.offsetWidth);
+    }
+  });
+  video.addEventListener('seeked', hide);
+})();
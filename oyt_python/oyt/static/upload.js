@@ -0,0 +1,197 @@
+/* Copyright 2021 Bhargav SNV
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License. */
+
+// Upload the new video form in chunks so a dropped connection resumes
+// from the last received byte. Without fetch the form posts as usual.
+(function () {
+  var form = document.getElementById('new-video-form');
+  if (!form || !window.fetch || !window.FormData || !window.localStorage) {
+    return;
+  }
+
+  var csrf = form.elements['csrfmiddlewaretoken'].value;
+  var status = document.getElementById('upload-status');
+  var maxRetries = 5;
+  // Files up to this size are hashed in memory before uploading, so one
+  // already stored is not sent again
+  var maxHashSize = 256 * 1024 * 1024;
+
+  function storageKey(file) {
+    return 'upload:' + file.name + ':' + file.size + ':' + file.lastModified;
+  }
+
+  function report(message) {
+    status.textContent = message;
+  }
+
+  function wait(ms) {
+    return new Promise(function (resolve) { setTimeout(resolve, ms); });
+  }
+
+  function request(url, options) {
+    options = options || {};
+    options.credentials = 'same-origin';
+    options.headers = options.headers || {};
+    options.headers['X-CSRFToken'] = csrf;
+    return fetch(url, options).then(function (response) {
+      return response.json().then(function (body) {
+        body.status = response.status;
+        if (!response.ok && response.status !== 409) {
+          var error = new Error(body.error || response.statusText);
+          error.fatal = response.status < 500;
+          throw error;
+        }
+        return body;
+      });
+    });
+  }
+
+  function digest(file) {
+    if (!window.crypto || !crypto.subtle || !file.arrayBuffer || file.size > maxHashSize) {
+      return Promise.resolve('');
+    }
+    return file.arrayBuffer().then(function (buffer) {
+      return crypto.subtle.digest('SHA-256', buffer);
+    }).then(function (hash) {
+      return Array.prototype.map.call(new Uint8Array(hash), function (byte) {
+        return ('0' + byte.toString(16)).slice(-2);
+      }).join('');
+    }).catch(function () {
+      return '';
+    });
+  }
+
+  function create(file) {
+    var data = new FormData();
+    data.append('title', form.elements['title'].value);
+    data.append('description', form.elements['description'].value);
+    if (form.elements['is_private'].checked) {
+      data.append('is_private', 'on');
+    }
+    data.append('filename', file.name);
+    data.append('content_type', file.type);
+    data.append('size', file.size);
+
+    return digest(file).then(function (hash) {
+      if (hash) {
+        data.append('sha256', hash);
+      }
+      return request('/upload', { method: 'POST', body: data });
+    }).then(function (body) {
+      // Already stored, the video was created without a transfer
+      if (body.video_id) {
+        return { video: body };
+      }
+      localStorage.setItem(storageKey(file), body.upload_id);
+      return { id: body.upload_id, offset: 0, chunkSize: body.chunk_size };
+    });
+  }
+
+  function start(file) {
+    var id = localStorage.getItem(storageKey(file));
+    if (!id) {
+      return create(file);
+    }
+    return request('/upload/' + id).then(function (body) {
+      return { id: id, offset: body.offset, chunkSize: body.chunk_size };
+    }, function () {
+      localStorage.removeItem(storageKey(file));
+      return create(file);
+    });
+  }
+
+  function send(file, upload, retries) {
+    if (upload.offset >= file.size) {
+      return Promise.resolve(upload);
+    }
+    report('Uploading ' + Math.floor(100 * upload.offset / file.size) + '%');
+
+    var end = Math.min(upload.offset + upload.chunkSize, file.size);
+    return request('/upload/' + upload.id, {
+      method: 'PUT',
+      headers: {
+        'Content-Range': 'bytes ' + upload.offset + '-' + (end - 1) + '/' + file.size
+      },
+      body: file.slice(upload.offset, end)
+    }).then(function (body) {
+      upload.offset = body.offset;
+      return send(file, upload, 0);
+    }, function (error) {
+      if (error.fatal || retries >= maxRetries) {
+        throw error;
+      }
+      // Ask the server where to resume from after a dropped chunk
+      report('Connection lost, retrying...');
+      return wait(1000 * Math.pow(2, retries)).then(function () {
+        return request('/upload/' + upload.id);
+      }).then(function (body) {
+        upload.offset = body.offset;
+        return send(file, upload, retries + 1);
+      }, function () {
+        return send(file, upload, retries + 1);
+      });
+    });
+  }
+
+  // A 409 from finalize means the upload is not ready for it yet: bytes
+  // are missing, which are sent again, or another request (an earlier
+  // submit) is assembling it, which is waited for. Either way finalize is
+  // asked again until it answers with the video.
+  function finalize(file, upload, retries) {
+    return request('/upload/' + upload.id + '/finalize', { method: 'POST' }).then(function (body) {
+      if (body.url) {
+        return body;
+      }
+      if (retries >= maxRetries) {
+        throw new Error(body.error || 'Upload could not be finalized');
+      }
+      if (body.offset !== undefined && body.offset < file.size) {
+        upload.offset = body.offset;
+        return send(file, upload, 0).then(function () {
+          return finalize(file, upload, retries + 1);
+        });
+      }
+      report('Waiting for the upload to be processed...');
+      return wait(1000 * Math.pow(2, retries)).then(function () {
+        return finalize(file, upload, retries + 1);
+      });
+    });
+  }
+
+  form.addEventListener('submit', function (event) {
+    var file = form.elements['video'].files[0];
+    if (!file) {
+      return;
+    }
+    event.preventDefault();
+
+    start(file).then(function (upload) {
+      if (upload.video) {
+        return upload;
+      }
+      return send(file, upload, 0);
+    }).then(function (upload) {
+      if (upload.video) {
+        return upload.video;
+      }
+      report('Processing upload...');
+      return finalize(file, upload, 0);
+    }).then(function (body) {
+      localStorage.removeItem(storageKey(file));
+      window.location = body.url;
+    }).catch(function (error) {
+      report('Upload failed: ' + error.message + '. Submit again to resume.');
+    });
+  });
+})();
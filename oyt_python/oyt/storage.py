@@ -0,0 +1,154 @@
+# Copyright 2021 Bhargav SNV
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.utils._os import safe_join
+from django.utils.functional import cached_property
+from django.utils.module_loading import import_string
+from hashlib import sha256
+from .media import DERIVED_DIRS, source_name
+import os
+import shutil
+
+
+class ShardedStorage(FileSystemStorage):
+    '''
+    Media storage spread over several volumes, where each upload and the
+    files derived from it live in a directory fanned out by a hash of the
+    upload name (ab/cd/), so no directory grows past a few thousand
+    entries.
+
+    Names are the media URLs without MEDIA_URL, and are looked up on every
+    volume, in the fanned out layout first and then in the flat layout of
+    older installs until migrate_media has moved them. New uploads go to
+    the volume with the most free space.
+    '''
+
+    def __init__(self, volumes=None, **kwargs):
+        self._volumes = volumes
+        super().__init__(base_url=settings.MEDIA_URL, **kwargs)
+
+    @cached_property
+    def volumes(self):
+        return self._volumes or settings.MEDIA_VOLUMES or [settings.MEDIA_ROOT]
+
+    @cached_property
+    def base_location(self):
+        return self.volumes[0]
+
+    def shard(self, name):
+        '''
+        Path of a name relative to a volume root, in the directory of the
+        upload it belongs to
+        '''
+        digest = sha256(source_name(name).encode()).hexdigest()
+        return os.path.join(digest[:2], digest[2:4], name)
+
+    def candidates(self, name):
+        for root in self.volumes:
+            yield safe_join(root, self.shard(name))
+        for root in self.volumes:
+            yield safe_join(root, name)
+
+    def place(self):
+        '''
+        Pick the volume with the most free space for a new upload
+        '''
+        def free(root):
+            try:
+                return shutil.disk_usage(root).free
+            except FileNotFoundError:
+                return 0
+        return max(self.volumes, key=free)
+
+    def path(self, name):
+        '''
+        Absolute path of a name. Files that do not exist yet are placed
+        next to their upload, or on a new volume for a new upload.
+        '''
+        for path in self.candidates(name):
+            if os.path.lexists(path):
+                return path
+
+        source = source_name(name)
+        if source != name:
+            for path in self.candidates(source):
+                if os.path.exists(path):
+                    return os.path.join(os.path.dirname(path), name)
+        return safe_join(self.place(), self.shard(name))
+
+    def move_in(self, local_path, name):
+        '''
+        Move a local file into storage under name, replacing any file
+        stored under it, and return its absolute path
+        '''
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            os.replace(local_path, path)
+        except OSError:
+            # Another volume, copy next to the target and swap it in
+            shutil.copyfile(local_path, path + '.tmp')
+            os.replace(path + '.tmp', path)
+            os.remove(local_path)
+        return path
+
+
+def media_storage():
+    '''
+    The configured media storage. Built on each call so settings
+    overrides apply, construction is cheap.
+    '''
+    return import_string(settings.MEDIA_STORAGE)()
+
+
+def migrate_flat(storage, busy=()):
+    '''
+    Move uploads stored flat in a volume root, along with the files
+    derived from them, into the fanned out layout on the same volume and
+    return how many were moved. Names in busy are skipped.
+
+    Every file is moved with a single rename, derived files before their
+    upload, so lookups find each file in one layout or the other while
+    the server keeps running.
+    '''
+    moved = 0
+    for root in storage.volumes:
+        if not os.path.isdir(root):
+            continue
+        for entry in os.scandir(root):
+            name = entry.name
+            if (name.startswith('.') or not entry.is_file(follow_symlinks=False)
+                    or source_name(name) != name or name in busy):
+                continue
+
+            target_dir = os.path.join(root, os.path.dirname(storage.shard(name)))
+            os.makedirs(target_dir, exist_ok=True)
+            derived = [name + '.jpg'] + [name + marker.rstrip('/') for marker in DERIVED_DIRS]
+            for file_name in derived + [name]:
+                source = os.path.join(root, file_name)
+                target = os.path.join(target_dir, file_name)
+                if not os.path.lexists(source):
+                    continue
+                if os.path.lexists(target):
+                    # Already moved by an earlier run, drop the stale copy
+                    if os.path.isdir(source):
+                        shutil.rmtree(source)
+                    else:
+                        os.remove(source)
+                    continue
+                os.rename(source, target)
+            moved += 1
+    return moved
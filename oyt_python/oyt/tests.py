@@ -12,12 +12,84 @@
 #    See the License for the specific language governing permissions and
 #    limitations under the License.
 
-from django.test import TestCase
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
 from oyt.models import Playlist
 from oyt.models import User
 from oyt.models import Video
+from oyt.models import Job
+from oyt.models import Upload
+from oyt.uploads import collect_stale
+from oyt import search
+from oyt import likes
+from oyt import likebuffer
+from oyt.likebuffer import buffer as like_buffer
+from oyt import playlists
+from oyt import feeds
+from oyt import viewcounts
+from oyt import trending
+from django.core.management import call_command
+from io import StringIO
+from django.conf import settings
+from django.core.cache import cache
+from oyt.models import Comment
+from oyt.pagination import keyset_page
+from oyt.querybudget import QueryBudgetExceeded, QueryRecorder, query_budget, view_budget
+from oyt.models import Like
+from oyt.models import PlaylistEntry
+from oyt.models import Blob
+from oyt.storage import ShardedStorage, media_storage
+from oyt.servertiming import DatabaseTimer
+from oyt.seeding import solid_jpeg, zipf_weights
+from oyt.queryplans import explain, plan_problems, record_plans
+from oyt import pragmas
+from oyt import replicas
+from oyt import shards
+from oyt.models import CommentShard
+from oyt.backends.sqlite3.base import DatabaseWrapper as ImmediateDatabaseWrapper
+from oyt_python import settings_production
+from django.db import IntegrityError, OperationalError, transaction
+from hashlib import sha256
+from oyt import jobs
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import connection, connections
+from django.test.utils import CaptureQueriesContext
 from django.db.models import Q
+from django.http import HttpResponse
+from datetime import timedelta
+from django.utils import timezone
+from oyt.backends.sqlitecache import SQLiteCache
+from benchmarks import loadtest
+from argparse import Namespace
+from contextlib import redirect_stdout
+import json
+from oyt import singleflight
+import threading
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+
+
+def setUpModule():
+    '''
+    Keep the views counted by page loads in tests out of the real log,
+    and cached entries out of the real cache
+    '''
+    global view_log_override
+    temp_dir = tempfile.mkdtemp()
+    view_log_override = override_settings(
+        VIEW_LOG_DIR=os.path.join(temp_dir, 'view_log'),
+        CACHES={'default': dict(settings.CACHES['default'],
+                                LOCATION=os.path.join(temp_dir, 'cache.sqlite3'))})
+    view_log_override.enable()
+
+
+def tearDownModule():
+    temp_dir = os.path.dirname(settings.VIEW_LOG_DIR)
+    view_log_override.disable()
+    shutil.rmtree(temp_dir)
 
 
 # Create your tests here.
@@ -48,14 +120,12 @@ class PlaylistTestCases(TestCase):
 
         Playlist.objects.create(
             name="test_playlist_1",
-            user=User.objects.get(username="test_user"),
-            video_ids=[]
+            user=User.objects.get(username="test_user")
         )
 
         Playlist.objects.create(
             name="test_playlist_2",
             user=User.objects.get(username="test_user"),
-            video_ids=[],
             is_private=True
         )
 
@@ -81,7 +151,7 @@ class PlaylistTestCases(TestCase):
         Verify newly created playlist has no videos
         '''
         p = Playlist.objects.get(name="test_playlist_1")
-        self.assertEqual(len(p.video_ids), 0)
+        self.assertEqual(p.videos.count(), 0)
 
     def test_playlist_user_delete(self):
         '''
@@ -122,8 +192,7 @@ class VideoTestCases(TestCase):
             title="test_video_1",
             description="test_description",
             user=User.objects.get(username="test_user"),
-            path="/media/test_video.mp4",
-            likes=[]
+            path="/media/test_video.mp4"
         )
 
         Video.objects.create(
@@ -131,7 +200,6 @@ class VideoTestCases(TestCase):
             description="test_description",
             user=User.objects.get(username="test_user"),
             path="/media/test_video.mp4",
-            likes=[],
             is_private=True
         )
 
@@ -198,30 +266,28 @@ class VideoListTestCases(TestCase):
             title="test_video_1",
             description="test_description",
             user=User.objects.get(username="test_user_1"),
-            path="/media/test_video.mp4",
-            likes=[]
+            path="/media/test_video.mp4"
         )
 
-        id1 = User.objects.get(username="test_user_1").id
-        id2 = User.objects.get(username="test_user_2").id
+        u1 = User.objects.get(username="test_user_1")
+        u2 = User.objects.get(username="test_user_2")
 
-        Video.objects.create(
+        v2 = Video.objects.create(
             title="test_video_2",
             description="test_description",
             user=User.objects.get(username="test_user_1"),
-            path="/media/test_video.mp4",
-            likes=[id1],
-            num_likes=1
+            path="/media/test_video.mp4"
         )
+        likes.like(u1, v2.id)
 
-        Video.objects.create(
+        v3 = Video.objects.create(
             title="test_video_3",
             description="test_description",
             user=User.objects.get(username="test_user_1"),
-            path="/media/test_video.mp4",
-            likes=[id1, id2],
-            num_likes=2
+            path="/media/test_video.mp4"
         )
+        likes.like(u1, v3.id)
+        likes.like(u2, v3.id)
 
     def test_recent_video_order(self):
         '''
@@ -252,3 +318,2509 @@ class VideoListTestCases(TestCase):
             v1 = most_liked_videos[i-1]
             v2 = most_liked_videos[i]
             self.assertLessEqual(v2.num_likes, v1.num_likes)
+
+
+class MediaViewTestCases(TestCase):
+    def setUp(self):
+        '''
+        Setup a media directory with a public and a private video
+        '''
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            MEDIA_ROOT=self.media_root, CHUNKED_UPLOAD_DIR=self.media_root + '/.partial')
+        self.settings_override.enable()
+
+        self.content = bytes(range(256)) * 4
+        for name in ['public.mp4', 'private.mp4']:
+            with open(self.media_root + '/' + name, 'wb') as f:
+                f.write(self.content)
+
+        owner = User.objects.create(username="test_user")
+        User.objects.create(username="test_user_2")
+
+        Video.objects.create(
+            title="public",
+            description="test_description",
+            user=owner,
+            path="/media/public.mp4"
+        )
+
+        Video.objects.create(
+            title="private",
+            description="test_description",
+            user=owner,
+            path="/media/private.mp4",
+            is_private=True
+        )
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+
+    def test_full_response(self):
+        '''
+        Verify a plain GET returns the whole file with validators
+        '''
+        response = self.client.get('/media/public.mp4')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Content-Length'], str(len(self.content)))
+        self.assertIn('ETag', response)
+        self.assertIn('Last-Modified', response)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+
+    def test_single_range(self):
+        '''
+        Verify a single range is answered with 206 and only those bytes
+        '''
+        response = self.client.get(
+            '/media/public.mp4', HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 100-199/1024')
+        self.assertEqual(b''.join(response.streaming_content),
+                         self.content[100:200])
+
+        response = self.client.get(
+            '/media/public.mp4', HTTP_RANGE='bytes=-24')
+        self.assertEqual(b''.join(response.streaming_content),
+                         self.content[-24:])
+
+    def test_multiple_ranges(self):
+        '''
+        Verify multiple ranges are sent as multipart/byteranges
+        '''
+        response = self.client.get(
+            '/media/public.mp4', HTTP_RANGE='bytes=0-9,1000-')
+        self.assertEqual(response.status_code, 206)
+        self.assertTrue(response['Content-Type'].startswith(
+            'multipart/byteranges; boundary='))
+        body = b''.join(response.streaming_content)
+        self.assertEqual(len(body), int(response['Content-Length']))
+        self.assertIn(b'Content-Range: bytes 0-9/1024', body)
+        self.assertIn(b'Content-Range: bytes 1000-1023/1024', body)
+        self.assertIn(self.content[1000:], body)
+
+    def test_unsatisfiable_range(self):
+        '''
+        Verify ranges past the end of the file are rejected
+        '''
+        response = self.client.get(
+            '/media/public.mp4', HTTP_RANGE='bytes=5000-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */1024')
+
+    def test_conditional_get(self):
+        '''
+        Verify a matching ETag is answered with 304 and a stale If-Range
+        falls back to the full file
+        '''
+        etag = self.client.get('/media/public.mp4')['ETag']
+        response = self.client.get(
+            '/media/public.mp4', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get(
+            '/media/public.mp4', HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_private_video(self):
+        '''
+        Verify private media is only served to its owner
+        '''
+        response = self.client.get('/media/private.mp4')
+        self.assertEqual(response.status_code, 404)
+
+        self.client.force_login(User.objects.get(username="test_user_2"))
+        response = self.client.get('/media/private.mp4')
+        self.assertEqual(response.status_code, 404)
+
+        self.client.force_login(User.objects.get(username="test_user"))
+        response = self.client.get('/media/private.mp4')
+        self.assertEqual(response.status_code, 200)
+
+    def test_derived_files(self):
+        '''
+        Verify files derived from an upload follow its privacy
+        '''
+        os.makedirs(self.media_root + '/private.mp4.hls')
+        with open(self.media_root + '/private.mp4.hls/master.m3u8', 'w') as f:
+            f.write('#EXTM3U\n')
+
+        response = self.client.get('/media/private.mp4.hls/master.m3u8')
+        self.assertEqual(response.status_code, 404)
+
+        self.client.force_login(User.objects.get(username="test_user"))
+        response = self.client.get('/media/private.mp4.hls/master.m3u8')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'],
+                         'application/vnd.apple.mpegurl')
+
+
+class MediaJobTestCases(TestCase):
+    def setUp(self):
+        '''
+        Setup a user and an isolated media directory
+        '''
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            MEDIA_ROOT=self.media_root, FFMPEG_BINARY='false',
+            CHUNKED_UPLOAD_DIR=self.media_root + '/.partial')
+        self.settings_override.enable()
+
+        self.user = User.objects.create(username="test_user")
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+
+    def upload(self):
+        self.client.force_login(self.user)
+        return self.client.post('/new_video', {
+            'title': 'test_video',
+            'description': 'test_description',
+            'video': SimpleUploadedFile('test.mp4', b'data', content_type='video/mp4')
+        })
+
+    def test_upload_queues_thumbnail(self):
+        '''
+        Verify uploading returns without running ffmpeg and queues a job
+        '''
+        response = self.upload()
+        self.assertEqual(response.status_code, 302)
+
+        v = Video.objects.get(title="test_video")
+        self.assertEqual(v.thumbnail_status, 'pending')
+
+        job = Job.objects.get(video=v, kind='thumbnail')
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertTrue(Job.objects.filter(video=v, kind='hls').exists())
+
+    def test_claim_is_exclusive(self):
+        '''
+        Verify a job can only be claimed once
+        '''
+        self.upload()
+        self.assertEqual(len(jobs.claim_jobs(5)), 3)
+        self.assertEqual(len(jobs.claim_jobs(5)), 0)
+
+    def test_failed_job_retries(self):
+        '''
+        Verify failing jobs are retried and then marked failed on the video
+        '''
+        self.upload()
+        Job.objects.exclude(kind='thumbnail').delete()
+        job = Job.objects.get()
+
+        for attempt in range(1, job.max_attempts + 1):
+            Job.objects.filter(id=job.id).update(run_after=job.created)
+            self.assertEqual(jobs.claim_jobs(1), [job.id])
+            error = jobs.execute_job(job.id)
+            self.assertIsNotNone(error)
+            jobs.finish_job(job.id, error)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(job.attempts, job.max_attempts)
+        self.assertEqual(Video.objects.get().thumbnail_status, 'failed')
+
+    def test_finished_job_marks_ready(self):
+        '''
+        Verify a successful job marks the thumbnail as ready
+        '''
+        self.upload()
+        job = Job.objects.get(kind='thumbnail')
+        jobs.claim_jobs(2)
+        jobs.finish_job(job.id)
+        self.assertEqual(Job.objects.get(id=job.id).status, Job.DONE)
+        self.assertEqual(Video.objects.get().thumbnail_status, 'ready')
+        self.assertEqual(Video.objects.get().hls_status, 'pending')
+
+    @override_settings(HLS_RENDITIONS=[(720, 2500), (240, 400), (480, 1000)])
+    def test_hls_ladder(self):
+        '''
+        Verify renditions never upscale the source
+        '''
+        self.assertEqual(jobs.hls_ladder(1080), [
+                         (240, 400), (480, 1000), (720, 2500)])
+        self.assertEqual(jobs.hls_ladder(480), [(240, 400), (480, 1000)])
+        self.assertEqual(jobs.hls_ladder(144), [(240, 400)])
+
+    def test_player_uses_hls(self):
+        '''
+        Verify the player offers the HLS manifest only once it is ready
+        '''
+        self.upload()
+        v = Video.objects.get()
+        response = self.client.get('/video/{}'.format(v.id))
+        self.assertNotContains(response, 'master.m3u8')
+
+        Video.objects.filter(id=v.id).update(hls_status='ready')
+        response = self.client.get('/video/{}'.format(v.id))
+        self.assertContains(response, v.path + '.hls/master.m3u8')
+        self.assertContains(response, 'type="video/mp4"')
+
+
+class ChunkedUploadTestCases(TestCase):
+    def setUp(self):
+        '''
+        Setup a logged in user and an isolated media directory
+        '''
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            MEDIA_ROOT=self.media_root,
+            CHUNKED_UPLOAD_DIR=self.media_root + '/.partial')
+        self.settings_override.enable()
+
+        self.user = User.objects.create(username="test_user")
+        self.client.force_login(self.user)
+        self.content = os.urandom(1000)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+
+    def init(self):
+        response = self.client.post('/upload', {
+            'title': 'test_video',
+            'description': 'test_description',
+            'filename': 'test.mp4',
+            'content_type': 'video/mp4',
+            'size': len(self.content)
+        })
+        self.assertEqual(response.status_code, 201)
+        return response.json()['upload_id']
+
+    def put(self, upload_id, start, end):
+        return self.client.generic(
+            'PUT', '/upload/{}'.format(upload_id), self.content[start:end + 1],
+            content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE='bytes {}-{}/{}'.format(start, end, len(self.content)))
+
+    def test_resumable_upload(self):
+        '''
+        Verify chunks are appended, can be resumed and assemble into a video
+        '''
+        upload_id = self.init()
+        self.assertEqual(self.put(upload_id, 0, 399).json()['offset'], 400)
+
+        # A resent chunk is rejected with the offset to resume from
+        response = self.put(upload_id, 0, 399)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['offset'], 400)
+
+        response = self.client.get('/upload/{}'.format(upload_id))
+        self.assertEqual(response.json()['offset'], 400)
+
+        # Finalizing early fails
+        response = self.client.post('/upload/{}/finalize'.format(upload_id))
+        self.assertEqual(response.status_code, 409)
+
+        self.put(upload_id, 400, 999)
+        response = self.client.post('/upload/{}/finalize'.format(upload_id))
+        self.assertEqual(response.status_code, 200)
+
+        v = Video.objects.get(id=response.json()['video_id'])
+        self.assertEqual(v.title, 'test_video')
+        with open(jobs.source_path(v), 'rb') as f:
+            self.assertEqual(f.read(), self.content)
+        self.assertEqual(Upload.objects.get().video, v)
+        self.assertTrue(Job.objects.filter(video=v, kind='thumbnail').exists())
+
+        # Finalizing again returns the same video, and no more chunks are taken
+        response = self.client.post('/upload/{}/finalize'.format(upload_id))
+        self.assertEqual(response.json()['video_id'], v.id)
+        self.assertEqual(Video.objects.count(), 1)
+        self.assertEqual(self.put(upload_id, 900, 999).status_code, 409)
+
+    def test_finalizing(self):
+        '''
+        Verify an upload being finalized takes no chunks, cannot be
+        deleted and is not finalized a second time
+        '''
+        upload_id = self.init()
+        self.put(upload_id, 0, 999)
+        Upload.objects.filter(id=upload_id).update(status=Upload.FINALIZING)
+        self.assertEqual(self.put(upload_id, 0, 99).status_code, 409)
+        self.assertEqual(self.client.delete('/upload/{}'.format(upload_id)).status_code, 409)
+        response = self.client.post('/upload/{}/finalize'.format(upload_id))
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(Video.objects.exists())
+
+    def test_upload_owner(self):
+        '''
+        Verify other users cannot see or write to an upload
+        '''
+        upload_id = self.init()
+        self.client.force_login(User.objects.create(username="test_user_2"))
+        self.assertEqual(self.put(upload_id, 0, 99).status_code, 404)
+        response = self.client.get('/upload/{}'.format(upload_id))
+        self.assertEqual(response.status_code, 404)
+
+    def test_collect_stale(self):
+        '''
+        Verify abandoned uploads and their data are garbage collected
+        '''
+        upload_id = self.init()
+        self.put(upload_id, 0, 99)
+        part = self.media_root + '/.partial/{}.part'.format(upload_id)
+        self.assertTrue(os.path.exists(part))
+
+        self.assertEqual(collect_stale(), 0)
+        Upload.objects.update(updated=timezone.now() - timedelta(days=2))
+        self.assertEqual(collect_stale(), 1)
+        self.assertFalse(Upload.objects.exists())
+        self.assertFalse(os.path.exists(part))
+
+
+class SearchTestCases(TestCase):
+    def setUp(self):
+        '''
+        Setup videos and playlists to search through
+        '''
+        self.owner = User.objects.create(username="test_user")
+        self.other = User.objects.create(username="test_user_2")
+
+        Video.objects.create(
+            title="cooking pasta",
+            description="a guide to dinner",
+            user=self.owner,
+            path="/media/test_video.mp4"
+        )
+
+        Video.objects.create(
+            title="dinner party",
+            description="how to plan cooking for ten",
+            user=self.owner,
+            path="/media/test_video.mp4"
+        )
+
+        Video.objects.create(
+            title="secret cooking",
+            description="test_description",
+            user=self.owner,
+            path="/media/test_video.mp4",
+            is_private=True
+        )
+
+        Playlist.objects.create(
+            name="cooking classics",
+            user=self.owner
+        )
+
+    def titles(self, text, user, **kwargs):
+        videos, has_next = search.search(Video, text, user, **kwargs)
+        return [v.title for v in videos]
+
+    def test_ranking(self):
+        '''
+        Verify title matches rank above description matches
+        '''
+        self.assertEqual(self.titles("cooking", self.other),
+                         ["cooking pasta", "dinner party"])
+        self.assertEqual(self.titles("dinner", self.other),
+                         ["dinner party", "cooking pasta"])
+
+    def test_prefix_and_private(self):
+        '''
+        Verify words match as prefixes and private videos only show to owners
+        '''
+        self.assertEqual(len(self.titles("cook", self.other)), 2)
+        self.assertEqual(len(self.titles("cook", self.owner)), 3)
+        self.assertEqual(self.titles('"secret" OR', self.other), [])
+
+    def test_index_follows_changes(self):
+        '''
+        Verify edits and deletions are reflected in results
+        '''
+        v = Video.objects.get(title="cooking pasta")
+        v.title = "baking bread"
+        v.save()
+        self.assertEqual(self.titles("baking", self.other), ["baking bread"])
+
+        v.delete()
+        self.assertEqual(self.titles("baking", self.other), [])
+
+    def test_pagination(self):
+        '''
+        Verify results are paginated
+        '''
+        first, cursor = search.search(
+            Video, "cooking", self.other, per_page=1)
+        self.assertEqual(len(first), 1)
+        self.assertIsNotNone(cursor)
+
+        second, cursor = search.search(
+            Video, "cooking", self.other, cursor, per_page=1)
+        self.assertEqual(len(second), 1)
+        self.assertNotEqual(first[0].id, second[0].id)
+        self.assertIsNone(cursor)
+
+    def test_search_views(self):
+        '''
+        Verify the home and playlist search pages use the index
+        '''
+        response = self.client.post('/', {'search_value': 'pasta'})
+        self.assertEqual([v.title for v in response.context['videos']], [
+                         "cooking pasta"])
+
+        response = self.client.post(
+            '/playlist_index', {'search_value': 'classic'})
+        self.assertEqual(len(response.context['playlists']), 1)
+
+
+class LikeTestCases(TestCase):
+    def setUp(self):
+        '''
+        Setup a video and two users to like it
+        '''
+        self.owner = User.objects.create(username="test_user")
+        self.fan = User.objects.create(username="test_user_2")
+
+        self.video = Video.objects.create(
+            title="test_video_1",
+            description="test_description",
+            user=self.owner,
+            path="/media/test_video.mp4"
+        )
+
+    def num_likes(self):
+        return Video.objects.get(id=self.video.id).num_likes
+
+    def test_like_once(self):
+        '''
+        Verify liking twice only counts once
+        '''
+        self.assertTrue(likes.like(self.fan, self.video.id))
+        self.assertFalse(likes.like(self.fan, self.video.id))
+        self.assertEqual(self.num_likes(), 1)
+        self.assertTrue(likes.has_liked(self.fan, self.video.id))
+        self.assertFalse(likes.has_liked(self.owner, self.video.id))
+
+    def test_unlike(self):
+        '''
+        Verify unliking removes the like and unliking again is a no-op
+        '''
+        likes.like(self.fan, self.video.id)
+        self.assertTrue(likes.unlike(self.fan, self.video.id))
+        self.assertFalse(likes.unlike(self.fan, self.video.id))
+        self.assertEqual(self.num_likes(), 0)
+
+    def test_like_view(self):
+        '''
+        Verify the video page likes and unlikes for the logged in user
+        '''
+        url = '/video/{}'.format(self.video.id)
+        self.client.post(url, {'like': 'True'})
+        self.assertEqual(self.num_likes(), 0)
+
+        self.client.force_login(self.fan)
+        self.client.post(url, {'like': 'True'})
+        self.assertEqual(self.num_likes(), 1)
+        self.assertTrue(self.client.get(url).context['liked'])
+
+        self.client.post(url, {'like': 'False'})
+        self.assertEqual(self.num_likes(), 0)
+        self.assertFalse(self.client.get(url).context['liked'])
+
+    def test_user_delete(self):
+        '''
+        Verify deleting a user removes their likes from the counter
+        '''
+        likes.like(self.fan, self.video.id)
+        likes.like(self.owner, self.video.id)
+        self.fan.delete()
+        self.assertEqual(self.num_likes(), 1)
+        self.assertEqual(Like.objects.count(), 1)
+
+    def test_edit_keeps_likes(self):
+        '''
+        Verify editing a video only writes the edited columns, so likes
+        counted meanwhile are kept
+        '''
+        likes.like(self.fan, self.video.id)
+        self.client.force_login(self.owner)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post('/edit_video/{}'.format(self.video.id), {'title': "test_renamed"})
+        edit = [query['sql'] for query in queries if '"title"' in query['sql']
+                and query['sql'].startswith('UPDATE "oyt_video"')]
+        self.assertEqual(len(edit), 1)
+        self.assertNotIn('num_likes', edit[0])
+        self.assertNotIn('hls_status', edit[0])
+        self.assertEqual(self.num_likes(), 1)
+        edited = Video.objects.get(id=self.video.id)
+        self.assertEqual(edited.title, "test_renamed")
+        self.assertGreater(edited.datetime, self.video.datetime)
+
+
+class PlaylistEntryTestCases(TestCase):
+    def setUp(self):
+        '''
+        Setup a playlist and three videos to add to it
+        '''
+        self.owner = User.objects.create(username="test_user")
+        self.playlist = Playlist.objects.create(
+            name="test_playlist", user=self.owner)
+
+        self.videos = [Video.objects.create(
+            title="test_video_{}".format(i),
+            description="test_description",
+            user=self.owner,
+            path="/media/test_video.mp4"
+        ) for i in range(3)]
+
+    def titles(self):
+        return [v.title for v in playlists.playlist_videos(self.playlist)]
+
+    def test_order(self):
+        '''
+        Verify videos are listed in the order they were added, once each
+        '''
+        for video in [self.videos[2], self.videos[0], self.videos[1]]:
+            self.assertTrue(playlists.add_video(self.playlist.id, video.id))
+        self.assertFalse(playlists.add_video(self.playlist.id, self.videos[0].id))
+
+        self.assertEqual(self.titles(), ["test_video_2", "test_video_0", "test_video_1"])
+
+    def test_remove(self):
+        '''
+        Verify removing videos keeps the order of the others
+        '''
+        for video in self.videos:
+            playlists.add_video(self.playlist.id, video.id)
+        self.client.force_login(self.owner)
+        self.client.post('/remove_from_playlist/{}/'.format(self.playlist.id),
+                         {'checks[]': [str(self.videos[1].id)]})
+
+        self.assertEqual(self.titles(), ["test_video_0", "test_video_2"])
+
+    def test_video_delete(self):
+        '''
+        Verify deleting a video removes it from playlists
+        '''
+        for video in self.videos:
+            playlists.add_video(self.playlist.id, video.id)
+        self.videos[0].delete()
+
+        self.assertEqual(self.titles(), ["test_video_1", "test_video_2"])
+        self.assertEqual(PlaylistEntry.objects.count(), 2)
+
+    def test_add_view_owner(self):
+        '''
+        Verify videos cannot be added to playlists of other users
+        '''
+        other = User.objects.create(username="test_user_2")
+        self.client.force_login(other)
+        self.client.post('/add_to_playlist/{}'.format(self.videos[0].id),
+                         {'checks[]': [str(self.playlist.id)]})
+        self.assertEqual(self.titles(), [])
+
+        self.client.force_login(self.owner)
+        self.client.post('/add_to_playlist/{}'.format(self.videos[0].id),
+                         {'checks[]': [str(self.playlist.id)]})
+        self.assertEqual(self.titles(), ["test_video_0"])
+
+        # Missing videos and private videos of other users are refused
+        hidden = Video.objects.create(title="test_hidden", description="test_description",
+                                      user=other, path="/media/test_video.mp4", is_private=True)
+        for video_id in [hidden.id, 0]:
+            response = self.client.post('/add_to_playlist/{}'.format(video_id),
+                                        {'checks[]': [str(self.playlist.id)]})
+            self.assertContains(response, "Video does not exist")
+        self.assertEqual(self.titles(), ["test_video_0"])
+
+
+@override_settings(QUERY_BUDGET_STRICT=True)
+class QueryBudgetTestCases(TestCase):
+    def setUp(self):
+        '''
+        Setup videos from several users, a playlist and comments, so any
+        query per row shows up in the counts
+        '''
+        self.users = [User.objects.create(username="test_user_{}".format(i))
+                      for i in range(4)]
+        self.videos = [Video.objects.create(
+            title="test_video_{}".format(i),
+            description="test_description",
+            user=self.users[i % 4],
+            path="/media/test_video.mp4"
+        ) for i in range(8)]
+
+        self.playlist = Playlist.objects.create(
+            name="test_playlist", user=self.users[0])
+        for video in self.videos:
+            playlists.add_video(self.playlist.id, video.id)
+        for user in self.users:
+            Comment.objects.create(text="test_comment", user=user, video=self.videos[0])
+
+        cache.clear()
+        self.client.force_login(self.users[0])
+
+    def test_home(self):
+        '''
+        Verify the home page and video search run a fixed number of queries
+        '''
+        with self.assertNumQueries(9):
+            self.client.get('/')
+        with self.assertNumQueries(6):
+            self.client.get('/')
+        with self.assertNumQueries(4):
+            self.client.post('/', {'search_value': 'test_video'})
+
+    def test_playlists(self):
+        '''
+        Verify playlist pages run a fixed number of queries
+        '''
+        with self.assertNumQueries(3):
+            self.client.get('/playlist_index')
+        with self.assertNumQueries(4):
+            self.client.get('/playlist/{}/'.format(self.playlist.id))
+        with self.assertNumQueries(5):
+            self.client.get('/playlist/{}/{}'.format(self.playlist.id, self.videos[0].id))
+        with self.assertNumQueries(4):
+            self.client.get('/remove_from_playlist/{}/'.format(self.playlist.id))
+
+    def test_video(self):
+        '''
+        Verify the video page runs a fixed number of queries
+        '''
+        with self.assertNumQueries(6):
+            self.client.get('/video/{}'.format(self.videos[0].id))
+
+    def test_view_budget(self):
+        '''
+        Verify budgets are found on class-based view handlers
+        '''
+        from oyt.views import HomeView, LogoutView
+        self.assertEqual(view_budget(HomeView.as_view(), 'GET'), 9)
+        self.assertEqual(view_budget(LogoutView.as_view(), 'GET'), None)
+
+    def test_repeated_queries(self):
+        '''
+        Verify the same query shape run for every row is reported
+        '''
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            for video in Video.objects.all():
+                video.user.username
+
+        repeated = recorder.repeated(5)
+        self.assertEqual(len(repeated), 1)
+        self.assertEqual(repeated[0][1], 8)
+        self.assertIn('auth_user', repeated[0][0])
+
+    def test_over_budget(self):
+        '''
+        Verify strict mode fails requests that go over budget
+        '''
+        from oyt.views import HomeView
+        get = HomeView.get
+        try:
+            HomeView.get = query_budget(1)(lambda self, request: get(self, request))
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get('/')
+        finally:
+            HomeView.get = get
+
+
+class HomeFeedTestCases(TestCase):
+    def setUp(self):
+        '''
+        Setup public videos and a private video, with an empty cache
+        '''
+        self.owner = User.objects.create(username="test_user")
+        self.fan = User.objects.create(username="test_user_2")
+
+        self.videos = [Video.objects.create(
+            title="test_video_{}".format(i),
+            description="test_description",
+            user=self.owner,
+            path="/media/test_video.mp4"
+        ) for i in range(3)]
+
+        self.private = Video.objects.create(
+            title="test_private",
+            description="test_description",
+            user=self.owner,
+            path="/media/test_video.mp4",
+            is_private=True
+        )
+
+        cache.clear()
+
+    def titles(self, user, feed):
+        return [v.title for v in feeds.home_feeds(user)[feed]]
+
+    def test_hits(self):
+        '''
+        Verify public lists are computed once and then served from cache
+        '''
+        feeds.home_feeds(self.fan)
+        self.assertEqual(feeds.stats(), {'hits': 0, 'misses': 3})
+        feeds.home_feeds(self.fan)
+        self.assertEqual(feeds.stats(), {'hits': 3, 'misses': 3})
+
+    def test_private_merge(self):
+        '''
+        Verify private videos are only merged into their owner's feeds
+        '''
+        self.assertEqual(self.titles(self.owner, 'recent'),
+                         ["test_private", "test_video_2", "test_video_1", "test_video_0"])
+        self.assertEqual(self.titles(self.fan, 'recent'),
+                         ["test_video_2", "test_video_1", "test_video_0"])
+
+    def test_invalidation(self):
+        '''
+        Verify uploads, likes, edits and deletes show up in cached feeds
+        '''
+        self.titles(self.fan, 'recent')
+
+        Video.objects.create(
+            title="test_video_3",
+            description="test_description",
+            user=self.owner,
+            path="/media/test_video.mp4"
+        )
+        self.assertEqual(self.titles(self.fan, 'recent')[0], "test_video_3")
+
+        # Only a video entering the trending list drops it
+        with override_settings(HOME_FEED_SIZE=2):
+            self.assertEqual(self.titles(self.fan, 'trending'), ["test_video_3", "test_video_2"])
+            likes.like(self.fan, self.videos[0].id)
+            self.assertEqual(self.titles(self.fan, 'trending')[0], "test_video_0")
+            misses = feeds.stats()['misses']
+            likes.like(self.owner, self.videos[0].id)
+            self.titles(self.fan, 'trending')
+            self.assertEqual(feeds.stats()['misses'], misses)
+
+        self.videos[0].is_private = True
+        self.videos[0].save()
+        self.assertNotIn("test_video_0", self.titles(self.fan, 'trending'))
+
+        self.videos[1].delete()
+        self.assertNotIn("test_video_1", self.titles(self.fan, 'recent'))
+
+
+@override_settings(COMMENT_PAGE_SIZE=5, PLAYLIST_PAGE_SIZE=4, SEARCH_PAGE_SIZE=4)
+class PaginationTestCases(TestCase):
+    def setUp(self):
+        '''
+        Setup a video with comments sharing timestamps, a playlist and
+        several playlists to page through
+        '''
+        self.owner = User.objects.create(username="test_user")
+        self.video = Video.objects.create(
+            title="test_video",
+            description="test_description",
+            user=self.owner,
+            path="/media/test_video.mp4"
+        )
+        for i in range(12):
+            Comment.objects.create(text="comment_{}".format(i), user=self.owner, video=self.video)
+        # Ties on datetime must be broken by id
+        Comment.objects.update(datetime=timezone.now())
+
+        self.playlist = Playlist.objects.create(name="test_playlist", user=self.owner)
+        for i in range(10):
+            video = Video.objects.create(
+                title="playlist_video_{}".format(i),
+                description="test_description",
+                user=self.owner,
+                path="/media/test_video.mp4"
+            )
+            playlists.add_video(self.playlist.id, video.id)
+        for i in range(9):
+            Playlist.objects.create(name="more_playlist_{}".format(i), user=self.owner)
+
+    def walk(self, response, key, attr):
+        '''
+        Follow "load more" links from a page and collect every row
+        '''
+        rows = [getattr(row, attr) for row in response.context[key]]
+        next_url = response.context['next_url']
+        while next_url:
+            response = self.client.get(next_url)
+            self.assertEqual(response.status_code, 200)
+            rows += [getattr(row, attr) for row in response.context[key]]
+            next_url = response.context['next_url']
+        return rows
+
+    def test_comments(self):
+        '''
+        Verify comments are paged newest first without gaps or repeats
+        '''
+        response = self.client.get('/video/{}'.format(self.video.id))
+        self.assertEqual(len(response.context['comments']), 5)
+        self.assertContains(response, 'load-more')
+        texts = self.walk(response, 'comments', 'text')
+        self.assertEqual(texts, ["comment_{}".format(i) for i in reversed(range(12))])
+
+    def test_playlist(self):
+        '''
+        Verify playlist videos are paged in playlist order
+        '''
+        response = self.client.get('/playlist/{}/'.format(self.playlist.id))
+        titles = self.walk(response, 'videos', 'title')
+        self.assertEqual(titles, ["playlist_video_{}".format(i) for i in range(10)])
+
+    def test_playlist_index(self):
+        '''
+        Verify the playlist index is paged by name
+        '''
+        response = self.client.get('/playlist_index')
+        names = self.walk(response, 'playlists', 'name')
+        self.assertEqual(names, sorted(names))
+        self.assertEqual(len(names), 10)
+
+    def test_search(self):
+        '''
+        Verify search results are paged through load more
+        '''
+        response = self.client.post('/', {'search_value': 'playlist_video'})
+        self.assertEqual(len(self.walk(response, 'videos', 'id')), 10)
+
+    def test_deep_page_cost(self):
+        '''
+        Verify a deep page runs the same queries as the second page
+        '''
+        first, cursor = keyset_page(Comment.objects.all(), ['-datetime', '-id'], size=1)
+        with self.assertNumQueries(1):
+            keyset_page(Comment.objects.all(), ['-datetime', '-id'], cursor, 1)
+        for _ in range(9):
+            rows, cursor = keyset_page(Comment.objects.all(), ['-datetime', '-id'], cursor, 1)
+        with self.assertNumQueries(1):
+            rows, cursor = keyset_page(Comment.objects.all(), ['-datetime', '-id'], cursor, 1)
+        self.assertEqual(rows[0].text, "comment_1")
+
+    def test_invalid_cursor(self):
+        '''
+        Verify tampered cursors and private playlists are rejected
+        '''
+        response = self.client.get('/video/{}/comments'.format(self.video.id), {'cursor': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+        self.playlist.is_private = True
+        self.playlist.save()
+        response = self.client.get('/playlist/{}/more'.format(self.playlist.id))
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(LIKE_BUFFER=True, LIKE_BUFFER_FLUSH_INTERVAL=0, LIKE_BUFFER_MAX_EVENTS=100)
+class LikeBufferTestCases(TestCase):
+    def setUp(self):
+        '''
+        Setup two videos and users, with an empty buffer and cache
+        '''
+        self.owner = User.objects.create(username="test_user")
+        self.fans = [User.objects.create(username="test_fan_{}".format(i)) for i in range(3)]
+        self.videos = [Video.objects.create(
+            title="test_video_{}".format(i),
+            description="test_description",
+            user=self.owner,
+            path="/media/test_video.mp4"
+        ) for i in range(2)]
+
+        like_buffer.states = {}
+        cache.clear()
+
+    def num_likes(self, video):
+        return Video.objects.get(id=video.id).num_likes
+
+    def test_read_your_writes(self):
+        '''
+        Verify a buffered like shows for its user before it is flushed
+        '''
+        url = '/video/{}'.format(self.videos[0].id)
+        self.client.force_login(self.fans[0])
+        self.client.post(url, {'like': 'True'})
+        self.assertEqual(self.num_likes(self.videos[0]), 0)
+
+        response = self.client.get(url)
+        self.assertTrue(response.context['liked'])
+        self.assertEqual(response.context['num_likes'], 1)
+
+        self.client.force_login(self.fans[1])
+        response = self.client.get(url)
+        self.assertFalse(response.context['liked'])
+        self.assertEqual(response.context['num_likes'], 0)
+
+        self.assertEqual(like_buffer.flush(), 1)
+        self.assertEqual(self.num_likes(self.videos[0]), 1)
+
+    def test_coalesce(self):
+        '''
+        Verify only the net effect of the buffered events is written
+        '''
+        likes.like(self.fans[0], self.videos[0].id)
+        likes.unlike(self.fans[0], self.videos[0].id)
+        likes.like(self.fans[0], self.videos[0].id)
+        for fan in self.fans:
+            likes.like(fan, self.videos[1].id)
+        likes.unlike(self.fans[2], self.videos[0].id)
+
+        self.assertEqual(like_buffer.flush(), 4)
+        self.assertEqual(self.num_likes(self.videos[0]), 1)
+        self.assertEqual(self.num_likes(self.videos[1]), 3)
+        self.assertEqual(Like.objects.count(), 4)
+
+        likes.unlike(self.fans[0], self.videos[1].id)
+        likes.like(self.fans[1], self.videos[1].id)
+        self.assertEqual(like_buffer.flush(), 1)
+        self.assertEqual(self.num_likes(self.videos[1]), 2)
+
+    def test_deleted_video(self):
+        '''
+        Verify likes of videos deleted before the flush are dropped
+        '''
+        likes.like(self.fans[0], self.videos[0].id)
+        likes.like(self.fans[0], self.videos[1].id)
+        self.videos[0].delete()
+
+        self.assertEqual(like_buffer.flush(), 1)
+        self.assertEqual(Like.objects.count(), 1)
+
+    def test_processes(self):
+        '''
+        Verify the last click wins when its events sit in the buffers of
+        different processes, whichever flushes first
+        '''
+        other = likebuffer.LikeBuffer()
+        likes.like(self.fans[0], self.videos[0].id)
+        other.record(self.fans[0].id, self.videos[0].id, False)
+        other.record(self.fans[1].id, self.videos[0].id, True)
+        likes.unlike(self.fans[1], self.videos[0].id)
+
+        self.assertEqual(other.flush(), 0)
+        self.assertEqual(like_buffer.flush(), 0)
+        self.assertEqual(self.num_likes(self.videos[0]), 0)
+        self.assertEqual(Like.objects.count(), 0)
+
+    def test_concurrent_insert(self):
+        '''
+        Verify likes another process inserted first are not counted again
+        '''
+        Like.objects.create(user=self.fans[0], video=self.videos[0])
+        inserted = likebuffer.insert_likes(
+            [(self.fans[0].id, self.videos[0].id), (self.fans[1].id, self.videos[0].id)])
+        self.assertEqual(inserted, [(self.fans[1].id, self.videos[0].id)])
+        self.assertEqual(Like.objects.count(), 2)
+
+    @override_settings(LIKE_BUFFER_MAX_EVENTS=2)
+    def test_size_threshold(self):
+        '''
+        Verify the buffer flushes once enough states are pending
+        '''
+        likes.like(self.fans[0], self.videos[0].id)
+        self.assertEqual(self.num_likes(self.videos[0]), 0)
+        likes.like(self.fans[1], self.videos[0].id)
+        self.assertEqual(self.num_likes(self.videos[0]), 2)
+        self.assertEqual(like_buffer.states, {})
+
+
+class ViewCountTestCases(TestCase):
+    def setUp(self):
+        '''
+        Setup videos and an empty view log
+        '''
+        self.log_dir = tempfile.mkdtemp()
+        self.settings_override = override_settings(VIEW_LOG_DIR=self.log_dir)
+        self.settings_override.enable()
+
+        self.owner = User.objects.create(username="test_user")
+        self.videos = [Video.objects.create(
+            title="test_video_{}".format(i),
+            description="test_description",
+            user=self.owner,
+            path="/media/test_video.mp4"
+        ) for i in range(3)]
+        cache.clear()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.log_dir)
+
+    def num_views(self, video):
+        return Video.objects.get(id=video.id).num_views
+
+    def test_buffered(self):
+        '''
+        Verify page loads are logged and only counted by the flush
+        '''
+        self.client.get('/video/{}'.format(self.videos[0].id))
+        self.assertEqual(self.num_views(self.videos[0]), 0)
+
+        self.assertEqual(viewcounts.flush_views(), 1)
+        self.assertEqual(self.num_views(self.videos[0]), 1)
+        self.assertEqual(viewcounts.flush_views(), 0)
+
+    def test_dedup(self):
+        '''
+        Verify repeat views within the window are counted once
+        '''
+        url = '/video/{}'.format(self.videos[0].id)
+        self.client.get(url)
+        self.client.get(url)
+        viewcounts.flush_views()
+        self.assertEqual(self.num_views(self.videos[0]), 1)
+
+        with self.settings(VIEW_DEDUP_WINDOW=0):
+            self.client.get(url)
+            self.client.get(url)
+        viewcounts.flush_views()
+        self.assertEqual(self.num_views(self.videos[0]), 3)
+
+    def test_playlist_private(self):
+        '''
+        Verify playlist pages do not show or count private and missing videos
+        '''
+        playlist = Playlist.objects.create(name="test_playlist", user=self.owner)
+        playlists.add_video(playlist.id, self.videos[0].id)
+        Video.objects.filter(id=self.videos[0].id).update(is_private=True)
+        url = '/playlist/{}/{}'.format(playlist.id, self.videos[0].id)
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(self.client.get('/playlist/{}/0'.format(playlist.id)).status_code, 404)
+        self.assertEqual(viewcounts.flush_views(), 0)
+
+        self.client.force_login(self.owner)
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertEqual(viewcounts.flush_views(), 1)
+
+    def test_aggregate(self):
+        '''
+        Verify views are added per video with one UPDATE per distinct count
+        '''
+        for video, views in zip(self.videos, [2, 2, 5]):
+            for _ in range(views):
+                viewcounts.append(video.id)
+
+        with self.assertNumQueries(7):
+            # Savepoint, one UPDATE for the videos viewed twice, one for
+            # the video viewed five times, release, then the trending
+            # rescore: read videos, count comments, one UPDATE
+            self.assertEqual(viewcounts.flush_views(), 9)
+        self.assertEqual([self.num_views(video) for video in self.videos], [2, 2, 5])
+
+    def test_leftover_log(self):
+        '''
+        Verify a log left by a failed flush is applied by the next one
+        '''
+        with open(os.path.join(self.log_dir, viewcounts.FLUSHING_NAME), 'w') as log:
+            log.write('{}\n'.format(self.videos[0].id))
+        viewcounts.append(self.videos[0].id)
+
+        self.assertEqual(viewcounts.flush_views(), 2)
+        self.assertEqual(self.num_views(self.videos[0]), 2)
+
+    def test_most_viewed(self):
+        '''
+        Verify the home page lists the most viewed videos first
+        '''
+        for video, views in zip(self.videos, [1, 3, 2]):
+            for _ in range(views):
+                viewcounts.append(video.id)
+        viewcounts.flush_views()
+
+        response = self.client.get('/')
+        self.assertEqual([v.title for v in response.context['most_viewed_videos']],
+                         ["test_video_1", "test_video_2", "test_video_0"])
+
+
+class TrendingTestCases(TestCase):
+    def setUp(self):
+        '''
+        Setup an old and a new video and a user to engage with them
+        '''
+        self.owner = User.objects.create(username="test_user")
+        self.fan = User.objects.create(username="test_user_2")
+        self.old = Video.objects.create(
+            title="old_video",
+            description="test_description",
+            user=self.owner,
+            path="/media/test_video.mp4"
+        )
+        self.new = Video.objects.create(
+            title="new_video",
+            description="test_description",
+            user=self.owner,
+            path="/media/test_video.mp4"
+        )
+        # Backdate with update(), auto_now_add only applies on insert
+        Video.objects.filter(id=self.old.id).update(
+            uploaded=timezone.now() - timedelta(days=3))
+        trending.recompute()
+        cache.clear()
+
+    def score(self, video):
+        return Video.objects.get(id=video.id).trending_score
+
+    def test_decay(self):
+        '''
+        Verify engagement has to double every half-life to keep the rank
+        '''
+        now = timezone.now()
+        day = timedelta(seconds=settings.TRENDING_HALF_LIFE)
+        self.assertGreater(trending.score(now, 0, 0, 0), trending.score(now - day, 0, 0, 0))
+        self.assertAlmostEqual(trending.score(now, 0, 0, 1),
+                               trending.score(now - day, 0, 0, 3))
+
+    def test_events(self):
+        '''
+        Verify likes, comments and views raise the score as they arrive
+        '''
+        score = self.score(self.old)
+        likes.like(self.fan, self.old.id)
+        self.assertGreater(self.score(self.old), score)
+
+        score = self.score(self.old)
+        Comment.objects.create(text="test_comment", user=self.fan, video=self.old)
+        self.assertGreater(self.score(self.old), score)
+
+        score = self.score(self.old)
+        viewcounts.apply_views({self.old.id: 10})
+        self.assertGreater(self.score(self.old), score)
+
+        # The incremental scores match a full recompute
+        incremental = self.score(self.old)
+        call_command('recompute_trending', stdout=StringIO())
+        self.assertAlmostEqual(self.score(self.old), incremental)
+
+    def test_edit(self):
+        '''
+        Verify saving a video, which moves its datetime, keeps its age
+        '''
+        score = self.score(self.old)
+        video = Video.objects.get(id=self.old.id)
+        video.title = "edited_video"
+        video.save()
+        self.assertGreater(Video.objects.get(id=self.old.id).datetime, video.uploaded)
+
+        trending.refresh([self.old.id])
+        self.assertAlmostEqual(self.score(self.old), score)
+
+    def test_home(self):
+        '''
+        Verify the home page lists trending videos, with old videos
+        needing more engagement than new ones
+        '''
+        response = self.client.get('/')
+        self.assertEqual([v.title for v in response.context['trending_videos']],
+                         ["new_video", "old_video"])
+
+        viewcounts.apply_views({self.old.id: 100})
+        response = self.client.get('/')
+        self.assertEqual([v.title for v in response.context['trending_videos']],
+                         ["old_video", "new_video"])
+
+
+class ThumbnailTestCases(TestCase):
+    def setUp(self):
+        '''
+        Setup a media directory with a video and a stand-in ffmpeg that
+        writes its arguments to the output file
+        '''
+        self.media_root = tempfile.mkdtemp()
+        ffmpeg = os.path.join(self.media_root, 'ffmpeg')
+        with open(ffmpeg, 'w') as f:
+            f.write('#!/bin/sh\nfor last; do :; done\necho "$@" > "$last"\n')
+        os.chmod(ffmpeg, 0o755)
+
+        self.settings_override = override_settings(
+            MEDIA_ROOT=self.media_root, FFMPEG_BINARY=ffmpeg,
+            CHUNKED_UPLOAD_DIR=self.media_root + '/.partial',
+            THUMBNAIL_WIDTHS=[320, 160], THUMBNAIL_FORMATS=['webp', 'jpg'])
+        self.settings_override.enable()
+
+        with open(os.path.join(self.media_root, 'test.mp4'), 'wb') as f:
+            f.write(b'data')
+        self.user = User.objects.create(username="test_user")
+        self.video = Video.objects.create(
+            title="test_video",
+            description="test_description",
+            user=self.user,
+            path="/media/test.mp4"
+        )
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+
+    def generate(self):
+        job = jobs.enqueue(self.video, 'thumbnail')
+        self.assertIsNone(jobs.execute_job(job.id))
+        jobs.finish_job(job.id)
+        return Video.objects.get(id=self.video.id)
+
+    def test_sizes(self):
+        '''
+        Verify every width is written in every format under hashed names
+        '''
+        video = self.generate()
+        names = sorted(os.listdir(os.path.join(self.media_root, 'test.mp4.thumbs')))
+        self.assertEqual(len(names), 4)
+        self.assertEqual([name.split('.')[0] for name in names], ['160', '160', '320', '320'])
+        self.assertTrue(all(len(name.split('.')[1]) == 12 for name in names))
+
+        self.assertEqual(video.thumbnails['webp'].count('/media/test.mp4.thumbs/'), 2)
+        self.assertTrue(video.thumbnails['jpg'].endswith(' 320w'))
+        self.assertTrue(video.thumbnails['src'].startswith('/media/test.mp4.thumbs/320.'))
+
+    def test_listing(self):
+        '''
+        Verify listings use lazy loaded responsive images
+        '''
+        self.generate()
+        response = self.client.get('/')
+        self.assertContains(response, 'type="image/webp"')
+        self.assertContains(response, 'loading="lazy"')
+        self.assertContains(response, 'sizes="(max-width: 30rem) 100vw, 30rem"')
+
+    def test_immutable(self):
+        '''
+        Verify hashed thumbnails are cached forever, other media is not
+        '''
+        video = self.generate()
+        response = self.client.get(video.thumbnails['src'])
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn('public', response['Cache-Control'])
+
+        response = self.client.get('/media/test.mp4')
+        self.assertFalse(response.has_header('Cache-Control'))
+
+        Video.objects.filter(id=video.id).update(is_private=True)
+        self.client.force_login(self.user)
+        response = self.client.get(video.thumbnails['src'])
+        self.assertIn('private', response['Cache-Control'])
+
+    def test_backfill(self):
+        '''
+        Verify the backfill queues videos without thumbnails once
+        '''
+        call_command('backfill_thumbnails', stdout=StringIO())
+        call_command('backfill_thumbnails', stdout=StringIO())
+        self.assertEqual(Job.objects.filter(kind='thumbnail').count(), 1)
+
+        Job.objects.all().delete()
+        self.generate()
+        Job.objects.all().delete()
+        call_command('backfill_thumbnails', stdout=StringIO())
+        self.assertEqual(Job.objects.count(), 0)
+
+
+class StoryboardTestCases(TestCase):
+    def setUp(self):
+        '''
+        Setup a media directory with a video, a stand-in ffprobe reporting
+        a 640x360 stream of 12 seconds and a stand-in ffmpeg that writes
+        its arguments to the output file
+        '''
+        self.media_root = tempfile.mkdtemp()
+        ffmpeg = os.path.join(self.media_root, 'ffmpeg')
+        with open(ffmpeg, 'w') as f:
+            f.write('#!/bin/sh\nfor last; do :; done\necho "$@" > "$last"\n')
+        ffprobe = os.path.join(self.media_root, 'ffprobe')
+        with open(ffprobe, 'w') as f:
+            f.write('#!/bin/sh\necho \'{"streams": [{"codec_type": "video", "width": 640, '
+                    '"height": 360}], "format": {"duration": "12.0"}}\'\n')
+        os.chmod(ffmpeg, 0o755)
+        os.chmod(ffprobe, 0o755)
+
+        self.settings_override = override_settings(
+            MEDIA_ROOT=self.media_root, FFMPEG_BINARY=ffmpeg, FFPROBE_BINARY=ffprobe,
+            CHUNKED_UPLOAD_DIR=self.media_root + '/.partial',
+            STORYBOARD_INTERVAL=5, STORYBOARD_MAX_FRAMES=200, STORYBOARD_TILE_WIDTH=160,
+            STORYBOARD_COLUMNS=2, STORYBOARD_ROWS=2)
+        self.settings_override.enable()
+
+        with open(os.path.join(self.media_root, 'test.mp4'), 'wb') as f:
+            f.write(b'data')
+        self.user = User.objects.create(username="test_user")
+        self.video = Video.objects.create(
+            title="test_video",
+            description="test_description",
+            user=self.user,
+            path="/media/test.mp4"
+        )
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+
+    def generate(self):
+        job = jobs.enqueue(self.video, 'storyboard')
+        self.assertIsNone(jobs.execute_job(job.id))
+        jobs.finish_job(job.id)
+        return Video.objects.get(id=self.video.id)
+
+    def test_vtt(self):
+        '''
+        Verify cues walk the tiles of each sheet and end with the video
+        '''
+        track = jobs.storyboard_vtt(22, 5, 160, 90)
+        self.assertTrue(track.startswith('WEBVTT\n'))
+        self.assertIn('00:00:00.000 --> 00:00:05.000\nsprite_001.jpg#xywh=0,0,160,90', track)
+        self.assertIn('00:00:15.000 --> 00:00:20.000\nsprite_001.jpg#xywh=160,90,160,90', track)
+        self.assertIn('00:00:20.000 --> 00:00:22.000\nsprite_002.jpg#xywh=0,0,160,90', track)
+        self.assertEqual(track.count('-->'), 5)
+
+    def test_interval(self):
+        '''
+        Verify long videos are sampled less often to bound the frame count
+        '''
+        self.assertEqual(jobs.storyboard_interval(60), 5)
+        self.assertEqual(jobs.storyboard_interval(3600), 18)
+
+    def test_generate(self):
+        '''
+        Verify the job tiles scaled frames and writes the track next to them
+        '''
+        video = self.generate()
+        self.assertEqual(video.storyboard_status, 'ready')
+        output_dir = os.path.join(self.media_root, 'test.mp4.storyboard')
+        self.assertFalse(os.path.exists(output_dir + '.tmp'))
+
+        with open(os.path.join(output_dir, 'sprite_%03d.jpg')) as f:
+            self.assertIn('fps=1/5,scale=160:90,tile=2x2', f.read())
+        with open(os.path.join(output_dir, 'storyboard.vtt')) as f:
+            track = f.read()
+        self.assertEqual(track.count('-->'), 3)
+        self.assertIn('00:00:10.000 --> 00:00:12.000', track)
+
+    def test_player(self):
+        '''
+        Verify the player references the track only once it is ready, and
+        the track is served with the privacy of its video
+        '''
+        response = self.client.get('/video/{}'.format(self.video.id))
+        self.assertNotContains(response, 'data-storyboard')
+
+        self.generate()
+        response = self.client.get('/video/{}'.format(self.video.id))
+        self.assertContains(response, 'data-storyboard="/media/test.mp4.storyboard/storyboard.vtt"')
+        self.assertContains(response, 'storyboard.js')
+
+        response = self.client.get('/media/test.mp4.storyboard/storyboard.vtt')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/vtt')
+
+        Video.objects.filter(id=self.video.id).update(is_private=True)
+        response = self.client.get('/media/test.mp4.storyboard/storyboard.vtt')
+        self.assertEqual(response.status_code, 404)
+
+
+class BlobTestCases(TestCase):
+    def setUp(self):
+        '''
+        Setup two users and an isolated media directory
+        '''
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            MEDIA_ROOT=self.media_root,
+            CHUNKED_UPLOAD_DIR=self.media_root + '/.partial')
+        self.settings_override.enable()
+
+        self.user = User.objects.create(username="test_user")
+        self.user_2 = User.objects.create(username="test_user_2")
+        self.content = os.urandom(1000)
+        self.digest = sha256(self.content).hexdigest()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+
+    def upload(self, user, is_private=False):
+        self.client.force_login(user)
+        data = {
+            'title': 'test_video',
+            'description': 'test_description',
+            'video': SimpleUploadedFile('test.mp4', self.content, content_type='video/mp4')
+        }
+        if is_private:
+            data['is_private'] = 'on'
+        self.client.post('/new_video', data)
+        return Video.objects.filter(user=user).latest('id')
+
+    def init(self, user, digest):
+        self.client.force_login(user)
+        return self.client.post('/upload', {
+            'title': 'test_video',
+            'description': 'test_description',
+            'filename': 'test.mp4',
+            'content_type': 'video/mp4',
+            'size': len(self.content),
+            'sha256': digest
+        })
+
+    def test_dedup(self):
+        '''
+        Verify identical uploads are stored once under their hash
+        '''
+        first = self.upload(self.user)
+        second = self.upload(self.user_2)
+        self.assertEqual(first.path, '/media/{}.mp4'.format(self.digest))
+        self.assertEqual(second.path, first.path)
+
+        blob = Blob.objects.get()
+        self.assertEqual(blob.refcount, 2)
+        self.assertEqual(blob.size, len(self.content))
+        stored = [name for name in os.listdir(self.media_root) if not name.startswith('.')]
+        self.assertEqual(len(stored), 1)
+        with open(jobs.source_path(first), 'rb') as f:
+            self.assertEqual(f.read(), self.content)
+
+    def test_release(self):
+        '''
+        Verify the file is only removed with the last video referencing it
+        '''
+        first = self.upload(self.user)
+        second = self.upload(self.user_2)
+        path = jobs.source_path(first)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/delete_video/{}/'.format(second.id))
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(Blob.objects.get().refcount, 1)
+
+        # Deleting the user cascades to the video
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.delete()
+        self.assertFalse(Video.objects.filter(id=first.id).exists())
+        self.assertFalse(Blob.objects.exists())
+        self.assertFalse(os.path.exists(path))
+
+        # A store of the same content moving its file in before its row
+        # is committed keeps the file
+        third = self.upload(self.user_2)
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.client.post('/delete_video/{}/'.format(third.id))
+        part = os.path.join(self.media_root, 'test.part')
+        with open(part, 'wb') as f:
+            f.write(self.content)
+        media_storage().move_in(part, third.path[len('/media/'):])
+        for callback in callbacks:
+            callback()
+        self.assertTrue(os.path.exists(path))
+
+    def test_skip_transfer(self):
+        '''
+        Verify announcing the hash of a stored file creates the video
+        without a transfer, taking over its processed outputs
+        '''
+        first = self.upload(self.user)
+        Video.objects.filter(id=first.id).update(
+            thumbnail_status='ready', hls_status='ready', thumbnails={'src': 'thumb.jpg'})
+
+        response = self.init(self.user_2, self.digest)
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(Upload.objects.exists())
+
+        v = Video.objects.get(id=response.json()['video_id'])
+        self.assertEqual(v.path, first.path)
+        self.assertEqual(v.thumbnails, {'src': 'thumb.jpg'})
+        self.assertEqual(v.hls_status, 'ready')
+        self.assertEqual(list(Job.objects.filter(video=v).values_list('kind', flat=True)),
+                         ['storyboard'])
+        self.assertEqual(Blob.objects.get().refcount, 2)
+
+    def test_private_not_shared(self):
+        '''
+        Verify the hash of another user's private video starts a normal upload
+        '''
+        self.upload(self.user, is_private=True)
+        response = self.init(self.user_2, self.digest)
+        self.assertEqual(response.status_code, 201)
+        self.assertIn('upload_id', response.json())
+        self.assertEqual(Blob.objects.get().refcount, 1)
+
+        # The owner may reuse it
+        response = self.init(self.user, self.digest)
+        self.assertIn('video_id', response.json())
+
+    def test_hash_mismatch(self):
+        '''
+        Verify an upload not matching its announced hash is discarded
+        '''
+        upload_id = self.init(self.user, '0' * 64).json()['upload_id']
+        self.client.generic(
+            'PUT', '/upload/{}'.format(upload_id), self.content,
+            content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE='bytes 0-999/1000')
+
+        response = self.client.post('/upload/{}/finalize'.format(upload_id))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['offset'], 0)
+        self.assertFalse(Blob.objects.exists())
+        self.assertFalse(os.path.exists(
+            self.media_root + '/.partial/{}.part'.format(upload_id)))
+
+
+class StorageTestCases(TestCase):
+    def setUp(self):
+        '''
+        Setup two storage volumes and a user
+        '''
+        self.volumes = [tempfile.mkdtemp(), tempfile.mkdtemp()]
+        self.settings_override = override_settings(
+            MEDIA_ROOT=self.volumes[0], MEDIA_VOLUMES=self.volumes,
+            CHUNKED_UPLOAD_DIR=self.volumes[0] + '/.partial')
+        self.settings_override.enable()
+        self.user = User.objects.create(username="test_user")
+
+    def tearDown(self):
+        self.settings_override.disable()
+        for volume in self.volumes:
+            shutil.rmtree(volume)
+
+    def test_layout(self):
+        '''
+        Verify files are fanned out by hash and derived files follow them
+        '''
+        storage = ShardedStorage(volumes=self.volumes[:1])
+        digest = sha256(b'test.mp4').hexdigest()
+        self.assertEqual(storage.path('test.mp4'), os.path.join(
+            self.volumes[0], digest[:2], digest[2:4], 'test.mp4'))
+        self.assertEqual(storage.path('test.mp4.thumbs/160.jpg'), os.path.join(
+            self.volumes[0], digest[:2], digest[2:4], 'test.mp4.thumbs/160.jpg'))
+
+    def test_volumes(self):
+        '''
+        Verify files are found on any volume and new ones avoid missing volumes
+        '''
+        storage = ShardedStorage(volumes=self.volumes)
+        with open(os.path.join(self.volumes[1], 'old.mp4'), 'wb') as f:
+            f.write(b'data')
+        self.assertEqual(storage.path('old.mp4'), os.path.join(self.volumes[1], 'old.mp4'))
+        self.assertEqual(storage.path('old.mp4.jpg'), os.path.join(self.volumes[1], 'old.mp4.jpg'))
+
+        missing = os.path.join(self.volumes[0], 'missing')
+        storage = ShardedStorage(volumes=[missing, self.volumes[1]])
+        self.assertTrue(storage.path('new.mp4').startswith(self.volumes[1]))
+
+    def test_migrate(self):
+        '''
+        Verify flat files move into the fanned out layout and stay served
+        '''
+        root = self.volumes[0]
+        with open(os.path.join(root, 'test.mp4'), 'wb') as f:
+            f.write(b'data')
+        with open(os.path.join(root, 'test.mp4.jpg'), 'wb') as f:
+            f.write(b'poster')
+        os.makedirs(os.path.join(root, 'test.mp4.thumbs'))
+        with open(os.path.join(root, 'test.mp4.thumbs', '160.jpg'), 'wb') as f:
+            f.write(b'thumb')
+        Video.objects.create(title="test_video", description="test_description",
+                             user=self.user, path="/media/test.mp4")
+        self.assertEqual(self.client.get('/media/test.mp4.jpg').status_code, 200)
+
+        call_command('migrate_media', stdout=StringIO())
+        for name in ['test.mp4', 'test.mp4.jpg', 'test.mp4.thumbs/160.jpg']:
+            self.assertFalse(os.path.exists(os.path.join(root, name)))
+            response = self.client.get('/media/' + name)
+            self.assertEqual(response.status_code, 200)
+
+        out = StringIO()
+        call_command('migrate_media', stdout=out)
+        self.assertIn('Moved 0', out.getvalue())
+
+    def test_migrate_skips_busy(self):
+        '''
+        Verify uploads with a running job are left in place
+        '''
+        with open(os.path.join(self.volumes[0], 'test.mp4'), 'wb') as f:
+            f.write(b'data')
+        video = Video.objects.create(title="test_video", description="test_description",
+                                     user=self.user, path="/media/test.mp4")
+        Job.objects.create(kind='hls', video=video, status=Job.RUNNING)
+
+        call_command('migrate_media', stdout=StringIO())
+        self.assertTrue(os.path.exists(os.path.join(self.volumes[0], 'test.mp4')))
+
+
+class ServerTimingTestCases(TestCase):
+    def setUp(self):
+        '''
+        Setup a user and a video to comment on
+        '''
+        self.user = User.objects.create(username="test_user")
+        self.video = Video.objects.create(
+            title="test_video",
+            description="test_description",
+            user=self.user,
+            path="/media/test.mp4"
+        )
+
+    def test_disabled(self):
+        '''
+        Verify timings are not exposed unless enabled
+        '''
+        response = self.client.get('/')
+        self.assertFalse(response.has_header('Server-Timing'))
+
+    @override_settings(SERVER_TIMING=True)
+    def test_header(self):
+        '''
+        Verify responses report their database time and query count
+        '''
+        response = self.client.get('/video/{}'.format(self.video.id))
+        header = response['Server-Timing']
+        self.assertRegex(header, r'^db;dur=[\d.]+;desc="\d+ queries", db-write;dur=[\d.]+, '
+                                 r'db-locked;desc=0$')
+
+    def test_writes(self):
+        '''
+        Verify only write statements count towards the write time
+        '''
+        timer = DatabaseTimer()
+
+        def execute(sql, params, many, context):
+            time.sleep(0.002)
+
+        timer(execute, 'SELECT 1', [], False, {})
+        self.assertEqual(timer.write_seconds, 0)
+        timer(execute, '  UPDATE oyt_video SET num_views = 1', [], False, {})
+        self.assertGreater(timer.write_seconds, 0)
+        self.assertEqual(timer.queries, 2)
+
+    def test_locked(self):
+        '''
+        Verify statements failing on a locked database are counted
+        '''
+        timer = DatabaseTimer()
+
+        def execute(sql, params, many, context):
+            raise OperationalError('database is locked')
+
+        with self.assertRaises(OperationalError):
+            timer(execute, 'INSERT INTO oyt_like VALUES (1)', [], False, {})
+        self.assertEqual(timer.locked, 1)
+        self.assertIn('db-locked;desc=1', timer.header())
+
+
+class SeedScaleTestCases(TestCase):
+    def setUp(self):
+        '''
+        Setup an isolated media directory and seed a small dataset
+        '''
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            MEDIA_ROOT=self.media_root,
+            CHUNKED_UPLOAD_DIR=self.media_root + '/.partial')
+        self.settings_override.enable()
+        self.seed()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+
+    def seed(self):
+        call_command('seed_scale', users=20, videos=60, comments=200, likes=300,
+                     playlists=10, media=3, media_size=1024, seed=7, stdout=StringIO())
+
+    def test_counts(self):
+        '''
+        Verify the requested rows are created and counters match them
+        '''
+        self.assertEqual(User.objects.count(), 20)
+        self.assertEqual(Video.objects.count(), 60)
+        self.assertEqual(Comment.objects.count(), 200)
+        self.assertEqual(Playlist.objects.count(), 10)
+        self.assertTrue(0 < Like.objects.count() <= 300)
+        for video in Video.objects.all():
+            self.assertEqual(video.num_likes, Like.objects.filter(video=video).count())
+        self.assertFalse(Like.objects.filter(video__is_private=True).exists())
+
+    def test_media(self):
+        '''
+        Verify videos share a few stored files with reference counts and
+        serve their thumbnails
+        '''
+        self.assertEqual(Blob.objects.count(), 3)
+        self.assertEqual(sum(Blob.objects.values_list('refcount', flat=True)), 60)
+        video = Video.objects.filter(is_private=False).first()
+        self.assertTrue(os.path.exists(jobs.source_path(video)))
+
+        response = self.client.get(video.thumbnails['src'])
+        self.assertEqual(response.status_code, 200)
+        content = b''.join(response.streaming_content)
+        self.assertTrue(content.startswith(b'\xff\xd8') and content.endswith(b'\xff\xd9'))
+
+    def test_derived_state(self):
+        '''
+        Verify search and trending are rebuilt, bulk inserts send no signals
+        '''
+        video = Video.objects.filter(is_private=False).first()
+        rows, _ = search.search(Video, video.title, User.objects.first())
+        self.assertIn(video, rows)
+        self.assertFalse(Video.objects.filter(trending_score=0).exists())
+        self.assertEqual(len(set(Video.objects.values_list('datetime', flat=True))), 60)
+
+    def test_reproducible(self):
+        '''
+        Verify the same seed produces the same dataset
+        '''
+        titles = list(Video.objects.order_by('id').values_list('title', 'num_views'))
+        Video.objects.all().delete()
+        User.objects.all().delete()
+        self.seed()
+        self.assertEqual(list(Video.objects.order_by('id').values_list(
+            'title', 'num_views')), titles)
+
+    def test_helpers(self):
+        '''
+        Verify Zipf weights fall off by rank and images have the given size
+        '''
+        self.assertEqual(zipf_weights(3, 1.0), [1.0, 0.5, 1 / 3])
+        image = solid_jpeg((10, 20, 30), 16, 9)
+        self.assertEqual(image[:2], b'\xff\xd8')
+        self.assertIn(b'\xff\xc0\x00\x11\x08\x00\x09\x00\x10', image)
+
+
+class QueryPlanTestCases(TestCase):
+    def setUp(self):
+        '''
+        Setup public and private videos with comments, and a playlist
+        '''
+        self.user = User.objects.create(username="test_user")
+        self.video = Video.objects.create(
+            title="test_video",
+            description="test_description",
+            user=self.user,
+            path="/media/test_video.mp4"
+        )
+        Video.objects.create(
+            title="test_private",
+            description="test_description",
+            user=self.user,
+            path="/media/test_private.mp4",
+            is_private=True
+        )
+        Comment.objects.create(text="test_comment", user=self.user, video=self.video)
+        self.playlist = Playlist.objects.create(name="test_playlist", user=self.user)
+        playlists.add_video(self.playlist.id, self.video.id)
+
+        self.client.force_login(self.user)
+        cache.clear()
+
+    def assertIndexed(self, *urls):
+        '''
+        Load each URL and fail on any SELECT it ran that scans a whole
+        table or sorts in a temporary B-tree
+        '''
+        with record_plans() as recorders:
+            for url in urls:
+                self.client.get(url)
+        problems = [problem for recorder in recorders for problem in recorder.problems()]
+        self.assertEqual(problems, [])
+
+    def test_home(self):
+        '''
+        Verify every home feed, public and private, is read from an index
+        '''
+        self.assertIndexed('/')
+        self.client.logout()
+        cache.clear()
+        self.assertIndexed('/')
+
+    def test_video(self):
+        '''
+        Verify the video page and its comment pages are read from indexes
+        '''
+        self.assertIndexed('/video/{}'.format(self.video.id),
+                           '/video/{}/comments'.format(self.video.id),
+                           '/media/test_video.mp4')
+
+    def test_playlists(self):
+        '''
+        Verify the playlist index, a playlist and the playlist picker are
+        read from indexes
+        '''
+        self.assertIndexed('/playlist_index',
+                           '/playlist/{}/'.format(self.playlist.id),
+                           '/playlist/{}/{}'.format(self.playlist.id, self.video.id),
+                           '/add_to_playlist/{}'.format(self.video.id))
+
+    def test_problems(self):
+        '''
+        Verify full scans and temporary sorts are reported, index walks
+        and lookups are not
+        '''
+        sql, params = Video.objects.order_by('title').query.sql_with_params()
+        self.assertEqual(plan_problems(explain(sql, params)),
+                         ['SCAN oyt_video', 'USE TEMP B-TREE FOR ORDER BY'])
+        self.assertEqual(plan_problems(['SCAN TABLE oyt_video',
+                                        'SCAN TABLE oyt_video USING INDEX video_path']),
+                         ['SCAN TABLE oyt_video'])
+
+        sql, params = Video.objects.filter(is_private=False).order_by(
+            '-datetime', '-id').query.sql_with_params()
+        self.assertEqual(plan_problems(explain(sql, params)), [])
+
+
+class PragmaTestCases(TestCase):
+    def setUp(self):
+        '''
+        Setup a file database next to the in-memory test database, as WAL
+        needs a real file
+        '''
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        settings_dict = dict(connection.settings_dict,
+                             NAME=os.path.join(self.dir, 'test.sqlite3'))
+        self.other = type(connections['default'])(settings_dict, alias='pragma_test')
+        self.addCleanup(self.other.close)
+
+    def test_production(self):
+        '''
+        Verify the production pragmas are applied to new connections
+        '''
+        with override_settings(SQLITE_PRAGMAS=settings_production.SQLITE_PRAGMAS):
+            self.other.ensure_connection()
+        self.assertEqual(pragmas.current(self.other, [
+            'journal_mode', 'synchronous', 'mmap_size', 'cache_size', 'busy_timeout']), {
+            'journal_mode': 'wal',
+            'synchronous': 1,
+            'mmap_size': 256 * 1024 * 1024,
+            'cache_size': -64 * 1024,
+            'busy_timeout': 5000,
+        })
+        self.assertEqual(settings_production.DATABASES['default']['CONN_MAX_AGE'], 600)
+
+    def test_default(self):
+        '''
+        Verify connections keep SQLite defaults without any pragmas
+        '''
+        self.other.ensure_connection()
+        self.assertEqual(pragmas.current(self.other, ['journal_mode', 'synchronous']),
+                         {'journal_mode': 'delete', 'synchronous': 2})
+
+    def test_order(self):
+        '''
+        Verify pragmas run in order, so later ones see the earlier ones
+        '''
+        with override_settings(SQLITE_PRAGMAS={'cache_size': -1000, 'busy_timeout': 250}):
+            self.other.ensure_connection()
+            self.assertEqual(pragmas.current(self.other, ['cache_size', 'busy_timeout']),
+                             {'cache_size': -1000, 'busy_timeout': 250})
+
+    def test_immediate(self):
+        '''
+        Verify the production backend takes the write lock when a
+        transaction begins, not at its first write
+        '''
+        self.assertEqual(settings_production.DATABASES['default']['ENGINE'],
+                         'oyt.backends.sqlite3')
+        settings_dict = dict(self.other.settings_dict, ENGINE='oyt.backends.sqlite3')
+        immediate = ImmediateDatabaseWrapper(settings_dict, alias='pragma_test')
+        self.addCleanup(immediate.close)
+        immediate.ensure_connection()
+        immediate._start_transaction_under_autocommit()
+
+        writer = sqlite3.connect(settings_dict['NAME'], timeout=0)
+        self.addCleanup(writer.close)
+        with self.assertRaisesMessage(sqlite3.OperationalError, 'database is locked'):
+            writer.execute('BEGIN IMMEDIATE')
+
+    def test_other_vendor(self):
+        '''
+        Verify connections to other databases are left alone
+        '''
+        class Other:
+            vendor = 'postgresql'
+
+            def cursor(self):
+                raise AssertionError('pragmas sent to a non-SQLite database')
+
+        with override_settings(SQLITE_PRAGMAS={'cache_size': -1000}):
+            pragmas.apply(Other())
+
+
+class ReplicaTestCases(TransactionTestCase):
+    def setUp(self):
+        '''
+        Setup two SQLite replica files and a router over them. Replica
+        reads are off inside transactions, so these tests run outside the
+        transaction TestCase wraps every test in.
+        '''
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.replicas = {}
+        for alias in ['replica_a', 'replica_b']:
+            settings_dict = dict(connections['default'].settings_dict,
+                                 NAME=os.path.join(self.dir, alias + '.sqlite3'))
+            self.replicas[alias] = type(connections['default'])(settings_dict, alias=alias)
+            self.addCleanup(self.replicas[alias].close)
+
+        override = override_settings(DATABASE_REPLICAS=['replica_a', 'replica_b'],
+                                     REPLICA_CHECK_INTERVAL=60, REPLICA_PIN_SECONDS=15)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.router = replicas.ReplicaRouter()
+        self.router.pool = replicas.ReplicaPool(self.replicas)
+        self.user = User.objects.create(username="test_user")
+        Video.objects.create(
+            title="test_video",
+            description="test_description",
+            user=self.user,
+            path="/media/test_video.mp4"
+        )
+
+    def sync(self):
+        for replica in self.replicas.values():
+            replicas.sync(replica.settings_dict['NAME'])
+
+    def request(self, method, cookies=None):
+        '''
+        Run a request through the middleware, returning the database each
+        read and write of the view was routed to and the response
+        '''
+        routed = []
+
+        def view(request):
+            routed.append(self.router.db_for_read(Video))
+            routed.append(self.router.db_for_read(Comment))
+            if request.method == 'POST':
+                routed.append(self.router.db_for_write(Comment))
+                routed.append(self.router.db_for_read(Comment))
+            return HttpResponse()
+
+        request = getattr(RequestFactory(), method.lower())('/')
+        request.COOKIES.update(cookies or {})
+        return routed, replicas.ReplicaMiddleware(view)(request)
+
+    def test_sync(self):
+        '''
+        Verify replicas join the rotation once synced with the primary
+        '''
+        self.assertEqual(self.router.pool.healthy(), [])
+        self.sync()
+        self.router.pool = replicas.ReplicaPool(self.replicas)
+        self.assertEqual(self.router.pool.healthy(), ['replica_a', 'replica_b'])
+        with self.replicas['replica_b'].cursor() as cursor:
+            cursor.execute('SELECT title FROM oyt_video')
+            self.assertEqual(cursor.fetchall(), [('test_video',)])
+
+    def test_routing(self):
+        '''
+        Verify safe requests read from one replica, writes go to the
+        primary and pin the client to it
+        '''
+        self.sync()
+        self.assertEqual(self.router.db_for_read(Video), 'default')
+
+        routed, response = self.request('GET')
+        self.assertIn(routed[0], ['replica_a', 'replica_b'])
+        self.assertEqual(routed[1], routed[0])
+        self.assertNotIn(replicas.PIN_COOKIE, response.cookies)
+
+        routed, response = self.request('POST')
+        self.assertEqual(routed, ['default'] * 4)
+        self.assertEqual(response.cookies[replicas.PIN_COOKIE]['max-age'], 15)
+
+        routed, response = self.request('GET', {replicas.PIN_COOKIE: '1'})
+        self.assertEqual(routed, ['default', 'default'])
+
+    def test_health(self):
+        '''
+        Verify failed replicas leave the rotation, and reads fall back to
+        the primary without any
+        '''
+        self.sync()
+        self.router.pool.fail('replica_a')
+        self.assertEqual(self.router.pool.healthy(), ['replica_b'])
+        self.assertEqual(self.request('GET')[0], ['replica_b', 'replica_b'])
+
+        self.router.pool.fail('replica_b')
+        self.assertEqual(self.request('GET')[0], ['default', 'default'])
+
+    @override_settings(REPLICA_MAX_LAG=60)
+    def test_lag(self):
+        '''
+        Verify replicas whose last sync is too old leave the rotation
+        '''
+        self.sync()
+        stale = sqlite3.connect(self.replicas['replica_a'].settings_dict['NAME'])
+        stale.execute('PRAGMA user_version = {}'.format(int(time.time()) - 120))
+        stale.close()
+        self.assertEqual(self.router.pool.healthy(), ['replica_b'])
+
+
+@override_settings(COMMENT_DATABASES=['default', 'comments_test'], COMMENT_SHARD_COUNT=2,
+                   COMMENT_PLACEMENT_TTL=0)
+class CommentShardTestCases(TransactionTestCase):
+    # Resolved in setUpClass, once comments_test exists
+    databases = '__all__'
+
+    @classmethod
+    def setUpClass(cls):
+        '''
+        Add a second comment database, a SQLite file holding the odd shard
+        '''
+        cls.dir = tempfile.mkdtemp()
+        connections.databases['comments_test'] = dict(
+            connections.databases['default'], NAME=os.path.join(cls.dir, 'comments.sqlite3'))
+        super().setUpClass()
+        call_command('migrate', database='comments_test', verbosity=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections['comments_test'].close()
+        del connections.databases['comments_test']
+        shutil.rmtree(cls.dir)
+
+    def setUp(self):
+        '''
+        Setup a video on each shard and a logged in commenter
+        '''
+        self.owner = User.objects.create(username="test_user")
+        self.user = User.objects.create(username="test_user_2")
+        videos = [Video.objects.create(
+            title="test_video_{}".format(i),
+            description="test_description",
+            user=self.owner,
+            path="/media/test_video.mp4"
+        ) for i in range(2)]
+        self.home, self.away = sorted(videos, key=lambda video: video.id % 2)
+        self.client.force_login(self.user)
+        self.addCleanup(shards.placement.clear)
+
+    def comment(self, video, text):
+        return self.client.post('/comment', {'text': text, 'video': video.id})
+
+    def stored(self, database):
+        return list(Comment.objects.using(database).values_list('text', flat=True))
+
+    def test_routing(self):
+        '''
+        Verify comments are stored on their video's shard, with ids from
+        that database's range, and shown from there
+        '''
+        self.comment(self.home, "test_home")
+        self.comment(self.away, "test_away")
+        self.assertEqual(self.stored('default'), ["test_home"])
+        self.assertEqual(self.stored('comments_test'), ["test_away"])
+        self.assertLess(Comment.objects.using('default').get().id, shards.ID_SPACE)
+        self.assertGreater(Comment.objects.using('comments_test').get().id, shards.ID_SPACE)
+
+        response = self.client.get('/video/{}'.format(self.away.id))
+        self.assertContains(response, "test_away")
+        self.assertContains(response, "by test_user_2")
+        self.assertEqual(shards.count_by_video([self.home.id, self.away.id]),
+                         {self.home.id: 1, self.away.id: 1})
+
+    def test_cascade(self):
+        '''
+        Verify deleting a video or a user deletes their comments on every
+        database
+        '''
+        self.comment(self.home, "test_home")
+        self.comment(self.away, "test_away")
+        self.away.delete()
+        self.assertEqual(self.stored('comments_test'), [])
+        self.assertEqual(self.stored('default'), ["test_home"])
+
+        self.comment(self.home, "test_home_2")
+        self.user.delete()
+        self.assertEqual(self.stored('default'), [])
+
+        # A delete that is rolled back keeps the comments
+        self.client.force_login(self.owner)
+        self.comment(self.home, "test_home_3")
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                Video.objects.get(id=self.home.id).delete()
+                raise IntegrityError
+        self.assertEqual(self.stored('default'), ["test_home_3"])
+
+        # and a shard being moved refuses the delete
+        shards.set_placement(shards.shard_of(self.home.id), 'default', moving=True)
+        response = self.client.post('/delete_video/{}/'.format(self.home.id))
+        self.assertContains(response, "being moved")
+        self.assertTrue(Video.objects.filter(id=self.home.id).exists())
+        self.assertEqual(self.stored('default'), ["test_home_3"])
+
+    def test_rebalance(self):
+        '''
+        Verify a moved shard keeps its comments and dates, takes ids from
+        its new database and is served from there
+        '''
+        self.comment(self.away, "test_away")
+        before = Comment.objects.using('comments_test').get()
+
+        call_command('rebalance_comments', shard=[1], to='default', wait=0, stdout=StringIO())
+        after = Comment.objects.using('default').get()
+        self.assertEqual((after.datetime, after.text), (before.datetime, before.text))
+        self.assertLess(after.id, shards.ID_SPACE)
+        self.assertEqual(shards.find(after.id), after)
+        self.assertEqual(self.stored('comments_test'), [])
+        self.assertContains(self.client.get('/video/{}'.format(self.away.id)), "test_away")
+
+        self.comment(self.away, "test_away_2")
+        self.assertEqual(len(self.stored('default')), 2)
+
+        call_command('rebalance_comments', shard=[1], to='comments_test', wait=0,
+                     stdout=StringIO())
+        self.assertEqual(len(self.stored('comments_test')), 2)
+        self.assertFalse(CommentShard.objects.exists())
+
+    def test_moving(self):
+        '''
+        Verify writes to a shard being moved are refused, reads still work
+        '''
+        self.comment(self.away, "test_away")
+        shards.set_placement(1, 'comments_test', moving=True)
+        response = self.comment(self.away, "test_away_2")
+        self.assertContains(response, "being moved")
+        self.assertEqual(self.stored('comments_test'), ["test_away"])
+        self.assertContains(self.client.get('/video/{}'.format(self.away.id)), "test_away")
+
+        self.comment(self.home, "test_home")
+        self.assertEqual(self.stored('default'), ["test_home"])
+
+    def test_admin(self):
+        '''
+        Verify the admin lists comments per database and opens comments
+        on any of them
+        '''
+        self.comment(self.away, "test_away")
+        admin_user = User.objects.create(username="test_admin", is_staff=True,
+                                         is_superuser=True)
+        self.client.force_login(admin_user)
+
+        self.assertNotContains(self.client.get('/admin/oyt/comment/'), "test_away")
+        self.assertContains(self.client.get('/admin/oyt/comment/?database=comments_test'),
+                            "test_away")
+        comment = Comment.objects.using('comments_test').get()
+        self.assertContains(self.client.get('/admin/oyt/comment/{}/change/'.format(comment.id)),
+                            "test_away")
+
+
+@override_settings(COMMENT_PAGE_SIZE=2, PLAYLIST_PAGE_SIZE=2, QUERY_BUDGET_STRICT=True)
+class ApiTestCases(TestCase):
+    def setUp(self):
+        '''
+        Setup two users with public and private videos, a playlist and
+        comments
+        '''
+        self.user = User.objects.create(username="test_user")
+        self.other = User.objects.create(username="test_other")
+        self.videos = [Video.objects.create(
+            title="test_video_{}".format(i),
+            description="test_description",
+            user=self.user,
+            path="/media/test_video_{}.mp4".format(i)
+        ) for i in range(3)]
+        self.private = Video.objects.create(
+            title="test_private", description="test_description",
+            user=self.other, path="/media/test_private.mp4", is_private=True)
+
+        self.playlist = Playlist.objects.create(name="test_playlist", user=self.user)
+        for video in self.videos:
+            playlists.add_video(self.playlist.id, video.id)
+        for i in range(3):
+            Comment.objects.create(text="test_comment_{}".format(i),
+                                   user=self.other, video=self.videos[0])
+        cache.clear()
+
+    def test_etag(self):
+        '''
+        Verify a matching If-None-Match gets a 304, and any update to the
+        row changes the ETag
+        '''
+        url = '/api/videos/{}'.format(self.videos[0].id)
+        response = self.client.get(url)
+        self.assertEqual(response.json()['title'], "test_video_0")
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+        etag = response['ETag']
+        self.assertFalse(etag.startswith('W/'))
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+        # Counters keep the version, their values are in the ETag instead
+        version = Video.objects.get(id=self.videos[0].id).version
+        Video.objects.filter(id=self.videos[0].id).update(num_views=5)
+        self.assertEqual(Video.objects.get(id=self.videos[0].id).version, version)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['views'], 5)
+        self.assertNotEqual(response['ETag'], etag)
+
+        # Updates that skip save() bump the version, and a stale instance
+        # saved in full still moves it forward
+        stale = Video.objects.get(id=self.videos[0].id)
+        Video.objects.filter(id=stale.id).update(description="test_changed")
+        stale.title = "test_renamed"
+        stale.save()
+        self.assertEqual(Video.objects.get(id=stale.id).version, stale.version + 2)
+        self.assertNotEqual(self.client.get(url)['ETag'], response['ETag'])
+
+    def test_triggers(self):
+        '''
+        Verify the version triggers survived every migration, SQLite drops
+        them when a migration rebuilds their table
+        '''
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT tbl_name FROM sqlite_master "
+                           "WHERE type = 'trigger' AND name LIKE '%_version'")
+            self.assertEqual(sorted(row[0] for row in cursor.fetchall()),
+                             ['oyt_playlist', 'oyt_video'])
+
+        Playlist.objects.filter(id=self.playlist.id).update(name="test_renamed")
+        self.assertEqual(Playlist.objects.get(id=self.playlist.id).version,
+                         self.playlist.version + 1)
+
+    def test_fields(self):
+        '''
+        Verify ?fields= limits both the document and the columns read
+        '''
+        url = '/api/videos/{}?fields=title,likes'.format(self.videos[0].id)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.json(), {'title': "test_video_0", 'likes': 0})
+        self.assertFalse(any('"description"' in query['sql'] for query in queries))
+        self.assertNotEqual(response['ETag'], self.client.get(
+            '/api/videos/{}?fields=title'.format(self.videos[0].id))['ETag'])
+
+        response = self.client.get(url + ',secret')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'error': "Unknown fields: secret"})
+
+    def test_batch(self):
+        '''
+        Verify ?ids= returns the visible videos in the requested order
+        '''
+        ids = [self.videos[2].id, self.private.id, 0, self.videos[0].id]
+        response = self.client.get('/api/videos?fields=id&ids={}'.format(
+            ','.join(str(id) for id in ids)))
+        self.assertEqual(response.json(), {'videos': [
+            {'id': self.videos[2].id}, {'id': self.videos[0].id}]})
+
+        self.client.force_login(self.other)
+        response = self.client.get('/api/videos?fields=id&ids={}'.format(self.private.id))
+        self.assertEqual(response.json(), {'videos': [{'id': self.private.id}]})
+        self.assertEqual(self.client.get('/api/videos?ids=1,x').status_code, 400)
+        with override_settings(API_BATCH_SIZE=2):
+            self.assertEqual(self.client.get('/api/videos?ids=1,2,3').status_code, 400)
+
+    def test_listings(self):
+        '''
+        Verify feeds, playlists and comments are paged and answer 304
+        until their rows change
+        '''
+        response = self.client.get('/api/videos?feed=recent&fields=title')
+        self.assertEqual([video['title'] for video in response.json()['videos']],
+                         ["test_video_2", "test_video_1", "test_video_0"])
+        self.assertEqual(self.client.get('/api/videos?feed=oldest').status_code, 400)
+
+        url = '/api/playlists/{}?fields=id'.format(self.playlist.id)
+        response = self.client.get(url)
+        self.assertEqual(response.json()['videos'], [
+            {'id': self.videos[0].id}, {'id': self.videos[1].id}])
+        page = self.client.get('/api/playlists/{}'.format(self.playlist.id), {
+            'fields': 'id', 'cursor': response.json()['next']}).json()
+        self.assertEqual(page['videos'], [{'id': self.videos[2].id}])
+        self.assertIsNone(page['next'])
+        etag = response['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Video.objects.filter(id=self.videos[1].id).update(title="test_renamed")
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        url = '/api/videos/{}/comments'.format(self.videos[0].id)
+        response = self.client.get(url)
+        self.assertEqual([comment['text'] for comment in response.json()['comments']],
+                         ["test_comment_2", "test_comment_1"])
+        etag = response['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Comment.objects.create(text="test_comment_3", user=self.user, video=self.videos[0])
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.assertEqual(self.client.get(url, {'cursor': 'x'}).status_code, 400)
+
+    def test_private(self):
+        '''
+        Verify private videos and their comments are only served to their
+        owner
+        '''
+        url = '/api/videos/{}'.format(self.private.id)
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(self.client.get(url + '/comments').status_code, 404)
+        self.client.force_login(self.other)
+        self.assertTrue(self.client.get(url).json()['private'])
+        self.assertEqual(self.client.get(url + '/comments').json(),
+                         {'comments': [], 'next': None})
+
+
+class SQLiteCacheTestCases(TestCase):
+    def setUp(self):
+        '''
+        Setup two cache instances on one file, standing in for two worker
+        processes
+        '''
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'cache.sqlite3')
+        params = {'OPTIONS': {'MAX_ENTRIES': 3, 'CULL_FREQUENCY': 2, 'CULL_EVERY': 2,
+                              'ACCESS_RESOLUTION': 0}}
+        self.first = SQLiteCache(self.path, params)
+        self.second = SQLiteCache(self.path, params)
+        cache.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_shared(self):
+        '''
+        Verify entries, add() and incr() are shared between instances
+        '''
+        self.first.set('key', {'ids': [1, 2]})
+        self.assertEqual(self.second.get('key'), {'ids': [1, 2]})
+        self.assertTrue(self.first.add('counter', 0))
+        self.assertFalse(self.second.add('counter', 5))
+        self.assertEqual(self.second.incr('counter'), 1)
+        self.assertEqual(self.first.incr('counter', 2), 3)
+        with self.assertRaises(ValueError):
+            self.first.incr('missing')
+
+        self.second.delete_many(['key', 'counter'])
+        self.assertIsNone(self.first.get('key'))
+        self.assertFalse(self.first.has_key('counter'))
+
+    def test_expiry(self):
+        '''
+        Verify expired entries are not returned and can be added again
+        '''
+        self.first.set('key', 1, timeout=0)
+        self.assertIsNone(self.second.get('key'))
+        self.assertTrue(self.second.add('key', 2, timeout=None))
+        self.assertTrue(self.first.touch('key', timeout=0))
+        self.assertFalse(self.first.has_key('key'))
+
+    def test_lru(self):
+        '''
+        Verify the least recently used entries are dropped beyond
+        MAX_ENTRIES
+        '''
+        for key in ['a', 'b', 'c']:
+            self.first.set(key, key)
+            time.sleep(0.01)
+        self.assertEqual(self.second.get('a'), 'a')
+        time.sleep(0.01)
+        self.first.set('d', 'd')
+        self.assertEqual([self.first.get(key) for key in ['a', 'b', 'c', 'd']],
+                         ['a', None, None, 'd'])
+
+    @override_settings(CACHE_LOCK_TIMEOUT=5)
+    def test_single_flight(self):
+        '''
+        Verify concurrent misses compute a key once, and an expired key is
+        served stale while another process recomputes it
+        '''
+        computed = []
+
+        def compute():
+            computed.append(1)
+            time.sleep(0.2)
+            return len(computed)
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+            singleflight.get_or_set('key', compute, 60))) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [1, 1, 1, 1])
+
+        cache.set('key', ('stale', time.time() - 1), 60)
+        cache.add(singleflight.lock_key('key'), True)
+        self.assertEqual(singleflight.get_or_set('key', compute, 60), 'stale')
+        cache.delete(singleflight.lock_key('key'))
+        self.assertEqual(singleflight.get_or_set('key', compute, 60), 2)
+        self.assertEqual(singleflight.get_or_set('key', compute, 60), 2)
+
+    def test_warm_cache(self):
+        '''
+        Verify warm_cache fills the feeds, so the first page load hits
+        '''
+        token = singleflight.acquire(feeds.cache_key('recent'))
+        out = StringIO()
+        call_command('warm_cache', stdout=out)
+        self.assertIn('Warmed feeds:public:recent', out.getvalue())
+        feeds.home_feeds(User.objects.create(username="test_user"))
+        self.assertEqual(feeds.stats(), {'hits': 3, 'misses': 0})
+
+        # The lock taken before the warm-up is still held, and only its
+        # token releases it
+        self.assertFalse(singleflight.acquire(feeds.cache_key('recent')))
+        singleflight.release(feeds.cache_key('recent'), 'other')
+        self.assertFalse(singleflight.acquire(feeds.cache_key('recent')))
+        singleflight.release(feeds.cache_key('recent'), token)
+        self.assertTrue(singleflight.acquire(feeds.cache_key('recent')))
+
+
+class LoadTestStatsTestCases(TestCase):
+    def setUp(self):
+        '''
+        Setup load test samples of 1 to 100ms, every tenth one failed
+        '''
+        self.samples = [{'seconds': ms / 1000, 'status': 500 if ms % 10 == 0 else 200,
+                         'ok': ms % 10 != 0, 'db_ms': None, 'db_write_ms': None,
+                         'db_locked': None} for ms in range(1, 101)]
+        self.report_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.report_dir)
+
+    def test_percentile(self):
+        '''
+        Verify percentiles take the nearest rank
+        '''
+        values = list(range(1, 101))
+        self.assertEqual(loadtest.percentile(values, 0.50), 50)
+        self.assertEqual(loadtest.percentile(values, 0.95), 95)
+        self.assertEqual(loadtest.percentile(values, 0.07), 7)
+        self.assertEqual(loadtest.percentile(values, 1), 100)
+        self.assertEqual(loadtest.percentile([4], 0.99), 4)
+        self.assertIsNone(loadtest.percentile([], 0.5))
+
+    def test_summarize(self):
+        '''
+        Verify a summary counts requests, errors and statuses
+        '''
+        summary = loadtest.summarize(self.samples, 10)
+        self.assertEqual(summary['requests'], 100)
+        self.assertEqual(summary['errors'], 10)
+        self.assertAlmostEqual(summary['error_rate'], 0.1)
+        self.assertAlmostEqual(summary['throughput'], 10)
+        self.assertAlmostEqual(summary['p99_ms'], 99)
+        self.assertAlmostEqual(summary['max_ms'], 100)
+        self.assertEqual(summary['statuses'], {'200': 90, '500': 10})
+        self.assertNotIn('db_ms_mean', summary)
+
+        self.samples[0].update(db_ms=2.0, db_write_ms=1.0, db_locked=1)
+        self.assertEqual(loadtest.summarize(self.samples, 10)['db_locked'], 1)
+
+    def compare(self, before, after, fail_over=10):
+        paths = []
+        for name, samples in (('before', before), ('after', after)):
+            paths.append(os.path.join(self.report_dir, name + '.json'))
+            with open(paths[-1], 'w') as f:
+                json.dump({'total': loadtest.summarize(samples, 10),
+                           'endpoints': {'home': loadtest.summarize(samples, 10)}}, f)
+        with redirect_stdout(StringIO()):
+            return loadtest.compare(Namespace(before=paths[0], after=paths[1],
+                                              fail_over=fail_over))
+
+    def test_compare(self):
+        '''
+        Verify compare fails on a p95 or error rate regression only
+        '''
+        self.assertEqual(self.compare(self.samples, self.samples), 0)
+
+        slower = [dict(sample, seconds=sample['seconds'] * 2) for sample in self.samples]
+        self.assertEqual(self.compare(self.samples, slower), 1)
+        self.assertEqual(self.compare(self.samples, slower, fail_over=None), 0)
+        self.assertEqual(self.compare(slower, self.samples), 0)
+
+        failing = [dict(sample, ok=False) for sample in self.samples]
+        self.assertEqual(self.compare(self.samples, failing), 1)
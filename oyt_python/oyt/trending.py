@@ -0,0 +1,111 @@
+# Copyright 2021 Bhargav SNV
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+from datetime import datetime, timezone as dt_timezone
+from django.conf import settings
+from .models import Video
+from . import feeds, shards
+import math
+
+# Reference point for the age term, scores only need a common origin
+EPOCH = datetime(2021, 1, 1, tzinfo=dt_timezone.utc)
+
+# Videos rescored per query by recompute()
+BATCH_SIZE = 1000
+
+
+def score(uploaded, num_likes, num_comments, num_views):
+    '''
+    Trending score of a video.
+
+    The log of the weighted engagement plus the upload time in half-lives:
+    a video has to double its engagement every TRENDING_HALF_LIFE seconds
+    to keep its rank, which is exponential decay by age expressed so that
+    scores never change on their own and can live in an index.
+    '''
+    weights = settings.TRENDING_WEIGHTS
+    engagement = (weights['likes'] * max(num_likes, 0)
+                  + weights['comments'] * num_comments
+                  + weights['views'] * num_views)
+    age = (uploaded - EPOCH).total_seconds() / settings.TRENDING_HALF_LIFE
+    return math.log2(1 + engagement) + age
+
+
+def rescore(videos, comment_counts):
+    for video in videos:
+        video.trending_score = score(video.uploaded, video.num_likes,
+                                     comment_counts.get(video.id, 0), video.num_views)
+    Video.objects.bulk_update(videos, ['trending_score'])
+
+
+def changes_top(videos, old_scores):
+    '''
+    Whether rescored videos may have moved into or out of the cached
+    trending list. Moves within the list wait for it to expire, so likes
+    and views on videos already trending do not drop it every time.
+    '''
+    ids = feeds.cached_ids('trending')
+    if ids is None:
+        return False
+    listed = set(ids)
+    public = [video for video in videos if not video.is_private]
+
+    # A listed video that lost score may fall below one outside the list
+    if any(video.id in listed and video.trending_score < old_scores[video.id]
+           for video in public):
+        return True
+
+    outside = [video for video in public if video.id not in listed]
+    if not outside:
+        return False
+    if len(ids) < settings.HOME_FEED_SIZE:
+        return True
+    lowest = Video.objects.filter(id=ids[-1]).values_list('trending_score', flat=True).first()
+    return lowest is None or any(video.trending_score > lowest for video in outside)
+
+
+def refresh(video_ids):
+    '''
+    Recompute the score of videos that just got likes, comments or views,
+    in one read of the videos, one count of their comments and one UPDATE
+    '''
+    video_ids = list(set(video_ids))
+    if not video_ids:
+        return
+    videos = list(Video.objects.filter(id__in=video_ids).only(
+        'id', 'uploaded', 'num_likes', 'num_views', 'trending_score', 'is_private'))
+    old_scores = dict((video.id, video.trending_score) for video in videos)
+    comment_counts = shards.count_by_video(video_ids)
+    rescore(videos, comment_counts)
+    if changes_top(videos, old_scores):
+        feeds.invalidate('trending')
+
+
+def recompute():
+    '''
+    Recompute the score of every video, returning how many were scored
+    '''
+    scored = 0
+    last_id = 0
+    while True:
+        videos = list(Video.objects.filter(id__gt=last_id).order_by('id').only(
+            'id', 'uploaded', 'num_likes', 'num_views')[:BATCH_SIZE])
+        if not videos:
+            break
+        last_id = videos[-1].id
+        comment_counts = shards.count_in_range(videos[0].id, last_id)
+        rescore(videos, comment_counts)
+        scored += len(videos)
+    feeds.invalidate('trending')
+    return scored
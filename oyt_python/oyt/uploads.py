@@ -0,0 +1,181 @@
+# Copyright 2021 Bhargav SNV
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+from .blobs import file_digest, store
+from .models import Upload
+import fcntl
+import os
+import re
+
+# Size of the blocks copied from the request body to disk
+BLOCK_SIZE = 64 * 1024
+
+content_range_re = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+
+class UploadError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def part_path(upload):
+    '''
+    Path of the partially received file of a chunked upload
+    '''
+    return os.path.join(settings.CHUNKED_UPLOAD_DIR, '{}.part'.format(upload.id))
+
+
+def parse_content_range(header):
+    '''
+    Parse "Content-Range: bytes start-end/total" into (start, end, total)
+    '''
+    match = content_range_re.match(header or '')
+    if match is None:
+        raise UploadError('Content-Range header required')
+    start, end, total = [int(group) for group in match.groups()]
+    if end < start:
+        raise UploadError('Invalid Content-Range')
+    return start, end, total
+
+
+def write_chunk(upload, stream, start, length):
+    '''
+    Copy length bytes from stream into the part file at offset start, in
+    fixed size blocks so memory use does not depend on the chunk size.
+
+    Only appending at the current offset is accepted, so an interrupted
+    chunk is simply resent from the offset reported by the status call.
+    The part file is locked from reading the offset until the new one is
+    stored, so retried or overlapping chunks cannot write over each other.
+    '''
+    if start + length > upload.size:
+        raise UploadError('Chunk runs past the declared size')
+    if length > settings.CHUNKED_UPLOAD_MAX_CHUNK:
+        raise UploadError('Chunk too large', 413)
+
+    os.makedirs(settings.CHUNKED_UPLOAD_DIR, exist_ok=True)
+    fd = os.open(part_path(upload), os.O_WRONLY | os.O_CREAT, 0o600)
+    written = 0
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        received = Upload.objects.filter(id=upload.id, status=Upload.RECEIVING).values_list(
+            'received', flat=True).first()
+        if received is None:
+            raise UploadError('Upload is already being finalized', 409)
+        upload.received = received
+        if start != received:
+            raise UploadError('Expected offset {}'.format(received), 409)
+
+        os.lseek(fd, start, os.SEEK_SET)
+        while written < length:
+            block = stream.read(min(BLOCK_SIZE, length - written))
+            if not block:
+                break
+            os.write(fd, block)
+            written += len(block)
+        os.ftruncate(fd, start + written)
+
+        Upload.objects.filter(id=upload.id).update(
+            received=start + written, updated=timezone.now())
+        upload.received = start + written
+    finally:
+        # Closing the file releases the lock
+        os.close(fd)
+
+    if written < length:
+        raise UploadError('Chunk truncated after {} bytes'.format(written))
+    return upload.received
+
+
+def claim(upload):
+    '''
+    Mark a completely received upload as being finalized. Only one of
+    several racing finalize requests gets True.
+    '''
+    claimed = Upload.objects.filter(
+        id=upload.id, status=Upload.RECEIVING, received=F('size')).update(
+        status=Upload.FINALIZING, updated=timezone.now())
+    if claimed:
+        upload.status = Upload.FINALIZING
+    return bool(claimed)
+
+
+def unclaim(upload):
+    '''
+    Let an upload whose finalizing failed take chunks again
+    '''
+    Upload.objects.filter(id=upload.id).update(status=Upload.RECEIVING)
+    upload.status = Upload.RECEIVING
+
+
+def assemble(upload):
+    '''
+    Move a completed upload into blob storage and return its blob.
+
+    Chunks arrive over many requests, so the part file is hashed once
+    here. A part whose hash differs from the one the client announced is
+    discarded.
+    '''
+    if upload.received != upload.size:
+        raise UploadError('Upload incomplete, {} of {} bytes received'.format(
+            upload.received, upload.size), 409)
+
+    digest = file_digest(part_path(upload))
+    if upload.sha256 and upload.sha256 != digest:
+        collect_part(upload)
+        Upload.objects.filter(id=upload.id).update(received=0)
+        upload.received = 0
+        raise UploadError('Content does not match the announced sha256')
+    return store(part_path(upload), digest, upload.content_type)
+
+
+def collect_part(upload):
+    '''
+    Remove the part file of an upload, if any data was received
+    '''
+    try:
+        os.remove(part_path(upload))
+    except FileNotFoundError:
+        pass
+
+
+def collect_stale(now=None):
+    '''
+    Delete chunked uploads that have not received data within
+    CHUNKED_UPLOAD_EXPIRY, along with part files that lost their row
+    '''
+    now = now or timezone.now()
+    cutoff = now - timedelta(seconds=settings.CHUNKED_UPLOAD_EXPIRY)
+    expired = Upload.objects.filter(updated__lt=cutoff)
+
+    removed = 0
+    for upload in expired:
+        collect_part(upload)
+        upload.delete()
+        removed += 1
+
+    if os.path.isdir(settings.CHUNKED_UPLOAD_DIR):
+        live = set(str(id) for id in Upload.objects.values_list('id', flat=True))
+        for entry in os.scandir(settings.CHUNKED_UPLOAD_DIR):
+            upload_id = entry.name[:-len('.part')]
+            if (entry.name.endswith('.part') and upload_id not in live
+                    and entry.stat().st_mtime < cutoff.timestamp()):
+                os.remove(entry.path)
+                removed += 1
+    return removed
@@ -0,0 +1,143 @@
+# Copyright 2021 Bhargav SNV
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+from collections import Counter
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from .models import Video
+from . import feeds, trending
+import fcntl
+import os
+
+LOG_NAME = 'views.log'
+FLUSHING_NAME = 'views.log.flushing'
+LOCK_NAME = 'flush.lock'
+
+# Largest number of ids in one UPDATE, below SQLite's variable limit
+UPDATE_BATCH = 500
+
+
+def viewer_key(request):
+    '''
+    Identify the viewer for dedup: the session if there is one, else the
+    client address
+    '''
+    if request.session.session_key:
+        return 's:' + request.session.session_key
+    return 'a:' + request.META.get('REMOTE_ADDR', '')
+
+
+def append(video_id):
+    '''
+    Append a view to the shared log. Writers hold a shared lock while
+    appending and make sure the file was not rotated away in between, so
+    the flush, which rotates and then takes an exclusive lock, never
+    misses a line.
+    '''
+    os.makedirs(settings.VIEW_LOG_DIR, exist_ok=True)
+    path = os.path.join(settings.VIEW_LOG_DIR, LOG_NAME)
+    while True:
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH)
+            try:
+                current = os.stat(path).st_ino == os.fstat(fd).st_ino
+            except FileNotFoundError:
+                current = False
+            if current:
+                os.write(fd, '{}\n'.format(video_id).encode())
+                return
+        finally:
+            os.close(fd)
+
+
+def record_view(request, video_id):
+    '''
+    Count a view of a video without writing to the database. Repeat views
+    from the same viewer within VIEW_DEDUP_WINDOW seconds are ignored.
+    '''
+    window = settings.VIEW_DEDUP_WINDOW
+    if window:
+        key = 'views:seen:{}:{}'.format(viewer_key(request), video_id)
+        if not cache.add(key, 1, window):
+            return False
+    append(video_id)
+    return True
+
+
+def apply_views(counts):
+    '''
+    Add {video_id: views} to num_views with one UPDATE per distinct count
+    (and batch of ids), all in one transaction
+    '''
+    by_count = {}
+    for video_id, views in counts.items():
+        by_count.setdefault(views, []).append(video_id)
+
+    with transaction.atomic():
+        for views, ids in by_count.items():
+            for start in range(0, len(ids), UPDATE_BATCH):
+                Video.objects.filter(id__in=ids[start:start + UPDATE_BATCH]).update(
+                    num_views=F('num_views') + views)
+    if counts:
+        feeds.invalidate('viewed')
+        trending.refresh(counts.keys())
+
+
+def apply_log(path):
+    '''
+    Add the views in a rotated log to num_views and remove it
+    '''
+    counts = Counter()
+    with open(path, 'rb') as log:
+        # Wait for writers that opened the file before it was rotated
+        fcntl.flock(log.fileno(), fcntl.LOCK_EX)
+        for line in log:
+            line = line.strip()
+            if line.isdigit():
+                counts[int(line)] += 1
+    apply_views(counts)
+    os.remove(path)
+    return sum(counts.values())
+
+
+def flush_views():
+    '''
+    Rotate the view log and add its counts to num_views, returning the
+    number of views flushed (None if another flush is running).
+
+    A log left over by a failed flush is applied before the current one
+    is rotated, so views are never dropped; a crash between the UPDATE
+    and removing the file can count a batch twice.
+    '''
+    os.makedirs(settings.VIEW_LOG_DIR, exist_ok=True)
+    log = os.path.join(settings.VIEW_LOG_DIR, LOG_NAME)
+    flushing = os.path.join(settings.VIEW_LOG_DIR, FLUSHING_NAME)
+
+    with open(os.path.join(settings.VIEW_LOG_DIR, LOCK_NAME), 'w') as lock:
+        try:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+
+        flushed = 0
+        if os.path.exists(flushing):
+            flushed += apply_log(flushing)
+        try:
+            os.rename(log, flushing)
+        except FileNotFoundError:
+            return flushed
+        return flushed + apply_log(flushing)
@@ -14,19 +14,67 @@
 
 from django.shortcuts import render
 from django.views.generic.base import View, HttpResponse, HttpResponseRedirect
-from .forms import LoginForm, RegisterForm, NewVideoForm, CommentForm, EditVideoForm, EditUserForm, NewPlaylistForm
+from django.http import FileResponse, Http404, StreamingHttpResponse, JsonResponse
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe, urlencode
+from .forms import LoginForm, RegisterForm, NewVideoForm, CommentForm, EditVideoForm, EditUserForm, NewPlaylistForm, ChunkedUploadForm
 from django.contrib.auth.models import User
 from django.core.exceptions import ObjectDoesNotExist
 from django.contrib.auth import login, authenticate, logout
+from django.db import transaction
 from django.db.models import Q
-from django.urls import reverse
-from .models import Video, Comment, Playlist
-from hashlib import sha256
-import string
-import random
-import time
-import os
-import subprocess
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from .models import Video, Comment, Playlist, Upload
+from .jobs import enqueue_processing, source_path
+from .storage import media_storage
+from .blobs import HashingUploadHandler, acquire, store_upload, remove_files
+from .uploads import UploadError, parse_content_range, write_chunk, claim, unclaim, assemble, collect_part
+from .search import search
+from .likes import like, unlike, like_state
+from .feeds import home_feeds
+from .viewcounts import record_view
+from .pagination import InvalidCursor, keyset_page
+from .playlists import add_video, remove_videos, playlist_videos, playlist_page
+from .querybudget import query_budget
+from . import api, shards
+from .media import source_name, hls_url, storyboard_url, is_immutable, stat_media, file_etag, parse_range_header, open_range, MultiRangeIterator
+from abc import ABCMeta, abstractmethod
+import mimetypes
+
+
+def more_url(path, cursor, **params):
+    '''
+    URL of the "load more" endpoint for the page after cursor, None when
+    there are no more pages
+    '''
+    if cursor is None:
+        return None
+    params['cursor'] = cursor
+    return '{}?{}'.format(path, urlencode(params))
+
+
+def create_video(user, blob, title, description, is_private):
+    '''
+    Create a video for a stored blob that a reference was taken on, and
+    queue its processing
+    '''
+    new_video = Video(
+        title=title,
+        description=description,
+        user=user,
+        path="/media/" + blob.name,
+        video=blob.name,
+        blob=blob,
+        is_private=is_private
+    )
+    new_video.save()
+
+    # Generate thumbnail and HLS renditions in the background
+    enqueue_processing(new_video)
+    return new_video
 
 
 class LogoutView(View):
@@ -39,46 +87,127 @@ class LogoutView(View):
 class HomeView(View):
     template_name = 'index.html'
 
-    # Fetch videos from db
     # Fetch only public videos or private videos owned by user
+    # Public videos come from cached feeds, private ones are merged in
+    @query_budget(9)
     def get(self, request):
-        most_recent_videos = Video.objects.order_by(
-            '-datetime').filter(Q(is_private=False) | Q(user_id=request.user.id))[:10]
-        most_liked_videos = Video.objects.order_by(
-            '-num_likes').filter(Q(is_private=False) | Q(user_id=request.user.id))[:10]
-        return render(request, self.template_name, {'most_recent_videos': most_recent_videos, 'most_liked_videos': most_liked_videos})
-
-    # Get string searched for and filter videos with
-    # string in name or description
+        feeds = home_feeds(request.user)
+        return render(request, self.template_name, {
+            'most_recent_videos': feeds['recent'],
+            'trending_videos': feeds['trending'],
+            'most_viewed_videos': feeds['viewed']
+        })
+
+    # Get string searched for and return the first page of videos
+    # ranked by how well their name or description match
+    @query_budget(4)
     def post(self, request):
-        name = request.POST.get('search_value')
-        videos = Video.objects.filter(Q(is_private=False) | Q(
-            user_id=request.user.id)).filter(Q(title__contains=name) | Q(description__contains=name))
-        return render(request, self.template_name, {'searched': True, 'videos': videos})
+        name = request.POST.get('search_value', '')
+        videos, cursor = search(
+            Video, name, request.user, per_page=settings.SEARCH_PAGE_SIZE)
+        return render(request, self.template_name, {
+            'searched': True,
+            'videos': videos,
+            'search_value': name,
+            'next_url': more_url('/search/videos', cursor, q=name)
+        })
 
 
 class PlaylistIndexView(View):
     template_name = 'playlist_index.html'
 
-    # Fetch videos from db
-    # Fetch only public videos or private videos owned by user
+    # Fetch playlists from db
+    # Fetch only public playlists or private playlists owned by user
+    @query_budget(3)
     def get(self, request):
-        most_recent_playlists = Playlist.objects.filter(
-            Q(is_private=False) | Q(user_id=request.user.id)).order_by('name')[:10]
-        return render(request, self.template_name, {'playlists': most_recent_playlists})
-
-    # Get string searched for and filter playlists with
-    # string in name or description
+        playlists, cursor = keyset_page(
+            Playlist.objects.select_related('user').filter(
+                Q(is_private=False) | Q(user_id=request.user.id)),
+            ['name', 'id'], size=settings.PLAYLIST_PAGE_SIZE)
+        return render(request, self.template_name, {
+            'playlists': playlists,
+            'next_url': more_url('/playlist_index/more', cursor)
+        })
+
+    # Get string searched for and return the first page of playlists
+    # ranked by how well their name or description match
+    @query_budget(4)
     def post(self, request):
-        name = request.POST.get('search_value')
-        playlists = Playlist.objects.filter(Q(is_private=False) | Q(
-            user_id=request.user.id)).filter(Q(name__contains=name) | Q(description__contains=name))
-        return render(request, self.template_name, {'playlists': playlists})
+        name = request.POST.get('search_value', '')
+        playlists, cursor = search(
+            Playlist, name, request.user, per_page=settings.SEARCH_PAGE_SIZE)
+        return render(request, self.template_name, {
+            'playlists': playlists,
+            'search_value': name,
+            'next_url': more_url('/search/playlists', cursor, q=name)
+        })
+
+
+class SearchMoreView(View):
+    '''
+    Return the next page of search results after the cursor, rendered
+    on its own for "load more"
+    '''
+    model = None
+    template_name = None
+    context_name = None
+    path = None
+
+    @query_budget(4)
+    def get(self, request):
+        name = request.GET.get('q', '')
+        try:
+            rows, cursor = search(self.model, name, request.user,
+                                  request.GET.get('cursor'), settings.SEARCH_PAGE_SIZE)
+        except InvalidCursor as e:
+            return HttpResponse(str(e), status=400)
+
+        return render(request, self.template_name, {
+            self.context_name: rows,
+            'next_url': more_url(self.path, cursor, q=name)
+        })
+
+
+class VideoSearchMoreView(SearchMoreView):
+    model = Video
+    template_name = 'video_cards.html'
+    context_name = 'videos'
+    path = '/search/videos'
+
+
+class PlaylistSearchMoreView(SearchMoreView):
+    model = Playlist
+    template_name = 'playlist_cards.html'
+    context_name = 'playlists'
+    path = '/search/playlists'
+
+
+class PlaylistIndexMoreView(View):
+    template_name = 'playlist_cards.html'
+
+    @query_budget(3)
+    def get(self, request):
+        '''
+        Return the next page of the playlist index after the cursor
+        '''
+        try:
+            playlists, cursor = keyset_page(
+                Playlist.objects.select_related('user').filter(
+                    Q(is_private=False) | Q(user_id=request.user.id)),
+                ['name', 'id'], request.GET.get('cursor'), settings.PLAYLIST_PAGE_SIZE)
+        except InvalidCursor as e:
+            return HttpResponse(str(e), status=400)
+
+        return render(request, self.template_name, {
+            'playlists': playlists,
+            'next_url': more_url('/playlist_index/more', cursor)
+        })
 
 
 class VideoView(View):
     template_name = "video.html"
 
+    @query_budget(6)
     def get(self, request, id):
         '''
         Get requested video by ID
@@ -93,6 +222,8 @@ class VideoView(View):
         context = {
             "video": video_by_id,
             "video_type": video_by_id.path.split(".")[-1],
+            "hls_url": hls_url(video_by_id),
+            "storyboard_url": storyboard_url(video_by_id),
             "liked": False
         }
 
@@ -100,23 +231,23 @@ class VideoView(View):
         if video_by_id.is_private and request.user.id != video_by_id.user_id:
             return render(request, "error.html", {'error': "Error: Invalid video URL. video does not exist!"})
 
-        # Compute likes
-        liked_ids = video_by_id.likes
-        if request.user.is_authenticated:
-            if request.user.id in liked_ids:
-                context['liked'] = True
+        # Count the view, it reaches num_views with the next flush
+        record_view(request, video_by_id.id)
 
-        context['num_likes'] = video_by_id.num_likes
+        # Check whether the user liked the video, including a like of
+        # theirs that is still buffered
+        context['liked'], context['num_likes'] = like_state(
+            request.user, video_by_id.id, video_by_id.num_likes)
 
         # Display comment box only if user is authenticaed
         if request.user.is_authenticated == True:
             comment_form = CommentForm()
             context['form'] = comment_form
 
-        # Display comments for video
-        comments = Comment.objects.filter(
-            video__id=id).order_by('-datetime')[:5]
+        # Display first page of comments for video
+        comments, cursor = video_comments(id)
         context['comments'] = comments
+        context['next_url'] = more_url('/video/{}/comments'.format(id), cursor)
 
         return render(request, self.template_name, context)
 
@@ -130,18 +261,19 @@ class VideoView(View):
             video_by_id = Video.objects.get(id=id)
         except ObjectDoesNotExist:
             return render(request, "error.html", {'error': "Error: Invalid Video URL. Video does not exist!"})
-        like = request.POST['like']
 
-        # Add/remove userID to liked IDs
-        if like == 'True':
-            if request.user.id not in video_by_id.likes:
-                video_by_id.likes.append(request.user.id)
-        else:
-            video_by_id.likes.remove(request.user.id)
+        if request.user.is_authenticated == False:
+            return HttpResponseRedirect('/login')
 
-        # Compute number of likes
-        video_by_id.num_likes = len(video_by_id.likes)
-        video_by_id.save()
+        # Handle case if video is private and not owned by user
+        if video_by_id.is_private and request.user.id != video_by_id.user_id:
+            return render(request, "error.html", {'error': "Error: Invalid video URL. video does not exist!"})
+
+        # Add/remove like, the counter is updated in the same transaction
+        if request.POST.get('like') == 'True':
+            like(request.user, video_by_id.id)
+        else:
+            unlike(request.user, video_by_id.id)
 
         return HttpResponseRedirect('/video/{}'.format(id))
 
@@ -149,6 +281,7 @@ class VideoView(View):
 class PlaylistView(View):
     template_name = "playlist.html"
 
+    @query_budget(4)
     def get(self, request, playlist_id):
         '''
         Display videos inside playlist
@@ -164,16 +297,52 @@ class PlaylistView(View):
         if playlist_by_id.is_private and request.user.id != playlist_by_id.user_id:
             return render(request, "error.html", {'error': "Error: Invalid Playlist URL. Playlist does not exist!"})
 
-        video_ids = playlist_by_id.video_ids
-        videos = Video.objects.filter(id__in=video_ids)
-        context = {'videos': videos, 'playlist': playlist_by_id}
+        videos, cursor = playlist_page(playlist_by_id, size=settings.PLAYLIST_PAGE_SIZE)
+        context = {
+            'videos': videos,
+            'playlist': playlist_by_id,
+            'next_url': more_url('/playlist/{}/more'.format(playlist_id), cursor)
+        }
 
         return render(request, self.template_name, context)
 
 
+class PlaylistMoreView(View):
+    template_name = "video_cards.html"
+
+    @query_budget(4)
+    def get(self, request, playlist_id):
+        '''
+        Return the next page of videos in a playlist after the cursor
+        '''
+
+        # Throw exception if playlist does not exist
+        try:
+            playlist_by_id = Playlist.objects.get(id=playlist_id)
+        except ObjectDoesNotExist:
+            raise Http404
+
+        # Handle case when playlist is private and not owned by user
+        if playlist_by_id.is_private and request.user.id != playlist_by_id.user_id:
+            raise Http404
+
+        try:
+            videos, cursor = playlist_page(
+                playlist_by_id, request.GET.get('cursor'), settings.PLAYLIST_PAGE_SIZE)
+        except InvalidCursor as e:
+            return HttpResponse(str(e), status=400)
+
+        return render(request, self.template_name, {
+            'videos': videos,
+            'playlist': playlist_by_id,
+            'next_url': more_url('/playlist/{}/more'.format(playlist_id), cursor)
+        })
+
+
 class PlaylistVideoView(View):
     template_name = "playlist_video.html"
 
+    @query_budget(5)
     def get(self, request, playlist_id, video_id):
         '''
         Display video within playlist along with list of video
@@ -189,16 +358,22 @@ class PlaylistVideoView(View):
         if playlist_by_id.is_private and request.user.id != playlist_by_id.user_id:
             return render(request, "error.html", {'error': "Error: Invalid Playlist URL. Playlist does not exist!"})
 
-        # fetch video IDs and videos
-        video_ids = playlist_by_id.video_ids
-        videos = Video.objects.filter(id__in=video_ids)
+        # fetch videos in playlist order
+        videos = playlist_videos(playlist_by_id)
+
+        # Same visibility as VideoView, checked before the view is counted
+        video_by_id = Video.objects.filter(id=video_id).first()
+        if video_by_id is None or (video_by_id.is_private and request.user.id != video_by_id.user_id):
+            raise Http404
+        record_view(request, video_by_id.id)
 
-        video_by_id = Video.objects.get(id=video_id)
         context = {
             'video': video_by_id,
             'videos': videos,
             'playlist': playlist_by_id,
-            'video_type': video_by_id.path.split(".")[-1]
+            'video_type': video_by_id.path.split(".")[-1],
+            'hls_url': hls_url(video_by_id),
+            'storyboard_url': storyboard_url(video_by_id)
         }
 
         return render(request, self.template_name, context)
@@ -243,6 +418,15 @@ class LoginView(View):
         return HttpResponseRedirect('/')
 
 
+def video_comments(video_id, cursor=None):
+    '''
+    One page of comments on a video, newest first
+    '''
+    comments, next_cursor = keyset_page(shards.comments(video_id), ['-datetime', '-id'],
+                                        cursor, settings.COMMENT_PAGE_SIZE)
+    return shards.attach_users(comments), next_cursor
+
+
 class CommentView(View):
     template_name = "comment.html"
 
@@ -272,13 +456,46 @@ class CommentView(View):
                 video=video
             )
 
-            new_comment.save()
+            try:
+                new_comment.save()
+            except shards.ShardMoving as e:
+                return render(request, "error.html", {'error': "Error: {}".format(e)})
 
             return HttpResponseRedirect('/video/{}'.format(str(video_id)))
         else:
             return render(request, "error.html", {'error': "Error: Inavlid Form Input!"})
 
 
+class CommentsMoreView(View):
+    template_name = "comment_items.html"
+
+    @query_budget(5)
+    def get(self, request, id):
+        '''
+        Return the next page of comments on a video after the cursor
+        '''
+
+        # Throw exception if video does not exist
+        try:
+            video_by_id = Video.objects.get(id=id)
+        except ObjectDoesNotExist:
+            raise Http404
+
+        # Handle case if video is private and not owned by user
+        if video_by_id.is_private and request.user.id != video_by_id.user_id:
+            raise Http404
+
+        try:
+            comments, cursor = video_comments(id, request.GET.get('cursor'))
+        except InvalidCursor as e:
+            return HttpResponse(str(e), status=400)
+
+        return render(request, self.template_name, {
+            'comments': comments,
+            'next_url': more_url('/video/{}/comments'.format(id), cursor)
+        })
+
+
 class RegisterView(View):
     template_name = "register.html"
 
@@ -341,6 +558,7 @@ class RegisterView(View):
             return render(request, "error.html", {'error': "Error: Inavlid Form Input!"})
 
 
+@method_decorator(csrf_exempt, name='dispatch')
 class NewVideoView(View):
     template_name = 'new_video.html'
     supported_types = ['video/mp4', 'video/webm']
@@ -356,6 +574,17 @@ class NewVideoView(View):
         return render(request, self.template_name, {'form': form})
 
     def post(self, request):
+        '''
+        Hash the upload while it streams in, then save the video
+        '''
+        # Upload handlers have to be set before the CSRF check reads the
+        # body, so the check runs in create() instead of on dispatch
+        hasher = HashingUploadHandler(request)
+        request.upload_handlers.insert(0, hasher)
+        return self.create(request, hasher)
+
+    @method_decorator(csrf_protect)
+    def create(self, request, hasher):
         '''
         Validate video upload input and save video
         '''
@@ -372,34 +601,10 @@ class NewVideoView(View):
             if video.content_type not in self.supported_types:
                 return render(request, "error.html", {'error': "Error: Inavlid Video format {}!".format(video.content_type)})
 
-            # Generate unique string for video
-            hash_str = str(round(time.time() * 1000)) + \
-                str(video.name) + str(request.user)
-
-            hash = sha256(hash_str.encode())
-            path = hash.hexdigest()[:10] + "_" + video.name
-            video.name = path
-
-            # Create and save video object
-            new_video = Video(
-                title=title,
-                description=description,
-                user=request.user,
-                path="/media/" + path,
-                video=video,
-                is_private=is_private,
-                likes=[]
-            )
-            new_video.save()
-
-            # Generate thumbnail for video
-            dir_path = os.path.dirname(
-                os.path.dirname(os.path.realpath(__file__)))
-
-            video_input_path = dir_path + '/media/' + path
-            img_output_path = dir_path + '/media/' + path + '.jpg'
-            os.system('ffmpeg -i {ip} -ss 00:00:00.000 -vframes 1 {op}'.format(
-                ip=video_input_path, op=img_output_path))
+            # Store the file under its hash, shared with identical uploads
+            with transaction.atomic():
+                blob = store_upload(video, hasher.digests['video'], video.content_type)
+                new_video = create_video(request.user, blob, title, description, is_private)
 
             # redirect to detail view template of a Video
             return HttpResponseRedirect('/video/{id}'.format(id=new_video.id))
@@ -407,6 +612,147 @@ class NewVideoView(View):
             return render(request, "error.html", {'error': "Error: Inavlid Form Input!"})
 
 
+class ChunkedUploadView(View):
+
+    def post(self, request):
+        '''
+        Start a resumable upload and return its ID
+        '''
+        if request.user.is_authenticated == False:
+            return JsonResponse({'error': "Login required"}, status=403)
+
+        form = ChunkedUploadForm(request.POST)
+        if not form.is_valid():
+            return JsonResponse({'error': "Invalid form input", 'fields': form.errors}, status=400)
+
+        # Verify video format and size
+        content_type = form.cleaned_data['content_type']
+        if content_type not in NewVideoView.supported_types:
+            return JsonResponse({'error': "Invalid video format {}".format(content_type)}, status=400)
+        if form.cleaned_data['size'] > settings.CHUNKED_UPLOAD_MAX_SIZE:
+            return JsonResponse({'error': "Video too large"}, status=413)
+
+        # Skip the transfer when the announced content is already stored
+        digest = form.cleaned_data['sha256']
+        if digest:
+            with transaction.atomic():
+                blob = acquire(digest, request.user, form.cleaned_data['size'])
+                if blob is not None:
+                    new_video = create_video(
+                        request.user, blob, form.cleaned_data['title'],
+                        form.cleaned_data['description'], form.cleaned_data['is_private'])
+            if blob is not None:
+                return JsonResponse({
+                    'video_id': new_video.id,
+                    'url': '/video/{}'.format(new_video.id),
+                    'offset': blob.size
+                }, status=201)
+
+        upload = Upload.objects.create(
+            user=request.user,
+            filename=form.cleaned_data['filename'],
+            content_type=content_type,
+            size=form.cleaned_data['size'],
+            title=form.cleaned_data['title'],
+            description=form.cleaned_data['description'],
+            is_private=form.cleaned_data['is_private'],
+            sha256=digest
+        )
+
+        return JsonResponse({
+            'upload_id': str(upload.id),
+            'offset': 0,
+            'chunk_size': settings.CHUNKED_UPLOAD_CHUNK_SIZE
+        }, status=201)
+
+
+class ChunkedUploadDetailView(View):
+
+    def get_upload(self, request, upload_id):
+        '''
+        Fetch an upload owned by the user
+        '''
+        try:
+            return Upload.objects.get(id=upload_id, user_id=request.user.id)
+        except ObjectDoesNotExist:
+            raise Http404
+
+    def get(self, request, upload_id):
+        '''
+        Report how much of the upload has been received, to resume from
+        '''
+        upload = self.get_upload(request, upload_id)
+        return JsonResponse({
+            'offset': upload.received,
+            'size': upload.size,
+            'chunk_size': settings.CHUNKED_UPLOAD_CHUNK_SIZE
+        })
+
+    def put(self, request, upload_id):
+        '''
+        Append a chunk sent with "Content-Range: bytes start-end/total"
+        '''
+        upload = self.get_upload(request, upload_id)
+
+        try:
+            start, end, total = parse_content_range(
+                request.META.get('HTTP_CONTENT_RANGE'))
+            if total != upload.size:
+                raise UploadError("Total size does not match the upload")
+            length = end - start + 1
+            if int(request.META.get('CONTENT_LENGTH') or 0) != length:
+                raise UploadError("Content-Length does not match Content-Range")
+            offset = write_chunk(upload, request, start, length)
+        except UploadError as e:
+            return JsonResponse({'error': str(e), 'offset': upload.received}, status=e.status)
+
+        return JsonResponse({'offset': offset, 'size': upload.size})
+
+    def delete(self, request, upload_id):
+        '''
+        Abandon an upload and discard the received data
+        '''
+        upload = self.get_upload(request, upload_id)
+        if upload.status == Upload.FINALIZING:
+            return JsonResponse({'error': "Upload is being finalized"}, status=409)
+        collect_part(upload)
+        upload.delete()
+        return JsonResponse({'deleted': True})
+
+
+class FinalizeUploadView(ChunkedUploadDetailView):
+
+    def post(self, request, upload_id):
+        '''
+        Assemble a completed upload and create its video
+        '''
+        upload = self.get_upload(request, upload_id)
+
+        if not claim(upload):
+            # A repeated finalize gets the video made by the first one
+            upload.refresh_from_db()
+            if upload.status == Upload.DONE and upload.video_id is not None:
+                return JsonResponse({'video_id': upload.video_id,
+                                     'url': '/video/{}'.format(upload.video_id)})
+            if upload.status == Upload.RECEIVING:
+                return JsonResponse({'error': "Upload incomplete, {} of {} bytes received".format(
+                    upload.received, upload.size), 'offset': upload.received}, status=409)
+            return JsonResponse({'error': "Upload is already being finalized"}, status=409)
+
+        try:
+            blob = assemble(upload)
+        except UploadError as e:
+            unclaim(upload)
+            return JsonResponse({'error': str(e), 'offset': upload.received}, status=e.status)
+
+        with transaction.atomic():
+            new_video = create_video(request.user, blob, upload.title,
+                                     upload.description, upload.is_private)
+            Upload.objects.filter(id=upload.id).update(status=Upload.DONE, video=new_video)
+
+        return JsonResponse({'video_id': new_video.id, 'url': '/video/{}'.format(new_video.id)})
+
+
 class CreatePlaylistView(View):
     template_name = "new_playlist.html"
 
@@ -437,8 +783,7 @@ class CreatePlaylistView(View):
                 name=name,
                 is_private=is_private,
                 user=user,
-                description=description,
-                video_ids=[]
+                description=description
             )
 
             new_playlist.save()
@@ -470,14 +815,18 @@ class AddVideoToPlaylistView(View):
 
         playlists = request.POST.getlist('checks[]')
         video_id = id
-        for playlist in playlists:
-            playlist_id = int(playlist)
-            playlist_obj = Playlist.objects.get(id=playlist_id)
-            video_list = playlist_obj.video_ids
-            if video_id not in video_list:
-                video_list.append(video_id)
-            playlist_obj.video_ids = video_list
-            playlist_obj.save()
+
+        # Only videos visible to the user can be added
+        if not Video.objects.filter(Q(is_private=False) | Q(user_id=request.user.id),
+                                    id=video_id).exists():
+            return render(request, "error.html", {'error': "Error: Invalid Video URL. Video does not exist!"})
+
+        # Only playlists owned by the user can be modified
+        playlist_ids = Playlist.objects.filter(
+            id__in=[int(playlist) for playlist in playlists],
+            user_id=request.user.id).values_list('id', flat=True)
+        for playlist_id in playlist_ids:
+            add_video(playlist_id, video_id)
 
         return HttpResponseRedirect('/')
 
@@ -523,7 +872,10 @@ class EditVideoView(View):
             if is_private == True or is_private == False:
                 video_by_id.is_private = is_private
 
-            video_by_id.save()
+            # Counters, scores and media statuses are updated in place by
+            # other requests and jobs, only write back what the form edits.
+            # datetime (auto_now) moves an edited video up the recent feed
+            video_by_id.save(update_fields=['title', 'description', 'is_private', 'datetime'])
             return HttpResponseRedirect('/video/{id}'.format(id=video_by_id.id))
         else:
             return render(request, "error.html", {'error': "Error: Inavlid Form Input!"})
@@ -588,7 +940,7 @@ class DeleteVideoView(View):
 
     def post(self, request, id):
         '''
-        Delete video and corresponding playlist entries
+        Delete video, playlist entries are removed by cascade
         '''
 
         try:
@@ -599,24 +951,15 @@ class DeleteVideoView(View):
         if request.user.id != video_by_id.user_id:
             return render(request, "error.html", {'error': "Error: you are not the owner. You cannot modify this video!"})
 
-        playlists = Playlist.objects.all()
-        for playlist in playlists:
-            video_ids = playlist.video_ids
-            try:
-                video_ids.remove(id)
-            except:
-                continue
-            playlist.save()
-
-        dir_path = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
-
-        path = dir_path + video_by_id.path
+        # Comments cannot be deleted while their shard is being moved
         try:
-            os.remove(path)
-            os.remove(path + '.jpg')
-        except:
-            pass
-        video_by_id.delete()
+            video_by_id.delete()
+        except shards.ShardMoving as e:
+            return render(request, "error.html", {'error': "Error: {}".format(e)})
+
+        # Stored blobs are removed with their last video by a signal
+        if video_by_id.blob_id is None:
+            remove_files(source_path(video_by_id))
 
         return render(request, "error.html", {'msg': "Video Deleted!"})
 
@@ -624,14 +967,14 @@ class DeleteVideoView(View):
 class RemoveVideoView(View):
     template_name = "remove_from_playlist.html"
 
+    @query_budget(4)
     def get(self, request, id):
         '''
         Render remove video from playlist page
         '''
 
         playlist_by_id = Playlist.objects.get(id=id)
-        video_ids = playlist_by_id.video_ids
-        videos = Video.objects.filter(id__in=video_ids)
+        videos = playlist_videos(playlist_by_id)
         context = {'videos': videos, 'playlist': playlist_by_id}
 
         return render(request, self.template_name, context)
@@ -643,16 +986,17 @@ class RemoveVideoView(View):
 
         videos = request.POST.getlist('checks[]')
         playlist_id = id
-        playlist_obj = Playlist.objects.get(id=playlist_id)
-        video_list = playlist_obj.video_ids
-        for video in videos:
-            video_id = int(video)
-            try:
-                video_list.remove(video_id)
-            except:
-                continue
-        playlist_obj.video_ids = video_list
-        playlist_obj.save()
+
+        # Throw exception if playlist does not exist
+        try:
+            playlist_obj = Playlist.objects.get(id=playlist_id)
+        except ObjectDoesNotExist:
+            return render(request, "error.html", {'error': "Error: Invalid Playlist URL. Playlist does not exist!"})
+
+        if request.user.id != playlist_obj.user_id:
+            return render(request, "error.html", {'error': "Error: you do not own this playlist. You cannot modify it!"})
+
+        remove_videos(playlist_id, [int(video) for video in videos])
 
         return HttpResponseRedirect('/playlist/{}'.format(playlist_id))
 
@@ -686,6 +1030,182 @@ class DeletePlaylistView(View):
         return render(request, "error.html", {'msg': "Playlist Deleted!"})
 
 
+class MediaView(View):
+
+    @query_budget(3)
+    def get(self, request, name):
+        '''
+        Stream an uploaded file, honouring Range requests and video privacy
+        '''
+
+        try:
+            path = media_storage().path(name)
+        except SuspiciousFileOperation:
+            raise Http404
+
+        # Only serve files that belong to a video visible to the user.
+        # Identical uploads share files, prefer a public video to cache.
+        video = Video.objects.filter(path='/media/' + source_name(name)).filter(
+            Q(is_private=False) | Q(user_id=request.user.id)).order_by('is_private').first()
+        if video is None:
+            raise Http404
+
+        stat = stat_media(path)
+        if stat is None:
+            raise Http404
+
+        size = stat.st_size
+        etag = file_etag(stat)
+        last_modified = int(stat.st_mtime)
+        content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+        # Content-hashed files never change, let clients keep them
+        cache_control = None
+        if is_immutable(name):
+            cache_control = '{}, max-age={}, immutable'.format(
+                'private' if video.is_private else 'public', settings.MEDIA_IMMUTABLE_MAX_AGE)
+
+        # Answer If-None-Match/If-Modified-Since without touching the file
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+        if response is not None:
+            if cache_control:
+                response['Cache-Control'] = cache_control
+            return response
+
+        ranges = None
+        range_header = request.META.get('HTTP_RANGE')
+        if range_header and size > 0 and self.if_range_matches(request, etag, last_modified):
+            ranges = parse_range_header(range_header, size)
+
+        if ranges is None:
+            status = 200
+            start, end = 0, size - 1
+            length = size
+        elif len(ranges) == 0:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */{}'.format(size)
+            response['Accept-Ranges'] = 'bytes'
+            return response
+        elif len(ranges) == 1:
+            status = 206
+            start, end = ranges[0]
+            length = end - start + 1
+        else:
+            status = 206
+            body = MultiRangeIterator(path, ranges, size, content_type)
+            content_type = 'multipart/byteranges; boundary=' + body.boundary
+            length = body.content_length()
+
+        if request.method == 'HEAD':
+            response = HttpResponse(status=status, content_type=content_type)
+        elif ranges is not None and len(ranges) > 1:
+            response = StreamingHttpResponse(
+                body, status=status, content_type=content_type)
+        else:
+            response = FileResponse(
+                open_range(path, start, end), status=status, content_type=content_type)
+
+        if status == 206 and len(ranges) == 1:
+            response['Content-Range'] = 'bytes {}-{}/{}'.format(
+                start, end, size)
+        response['Content-Length'] = str(length)
+        response['Accept-Ranges'] = 'bytes'
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        if cache_control:
+            response['Cache-Control'] = cache_control
+        return response
+
+    def if_range_matches(self, request, etag, last_modified):
+        '''
+        Check the If-Range precondition, a stale validator means the client
+        gets the whole file instead of splicing in bytes from a new version
+        '''
+        if_range = request.META.get('HTTP_IF_RANGE')
+        if not if_range:
+            return True
+        if if_range.startswith('"') or if_range.startswith('W/'):
+            return if_range == etag
+        return parse_http_date_safe(if_range) == last_modified
+
+
+class ApiView(View, metaclass=ABCMeta):
+    '''
+    Base of the read-only JSON API. Subclasses return the validator and
+    builder of their document from document(), see oyt.api.respond
+    '''
+
+    @abstractmethod
+    def document(self, request, **kwargs):
+        pass
+
+    def get(self, request, **kwargs):
+        try:
+            validator, build = self.document(request, **kwargs)
+        except InvalidCursor as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        except api.ApiError as e:
+            return JsonResponse({'error': str(e)}, status=e.status)
+        return api.respond(request, validator, build)
+
+
+class ApiVideosView(ApiView):
+
+    @query_budget(4)
+    def get(self, request):
+        '''
+        List the videos of a home page feed, or the videos with ?ids=
+        '''
+        return super().get(request)
+
+    def document(self, request):
+        fields = api.parse_fields(request.GET.get('fields'))
+        if 'ids' in request.GET:
+            return api.batch_videos(request.user, api.parse_ids(request.GET['ids']), fields)
+        return api.feed_videos(request.user, request.GET.get('feed', 'recent'), fields)
+
+
+class ApiVideoView(ApiView):
+
+    @query_budget(3)
+    def get(self, request, id):
+        '''
+        Get the metadata of one video
+        '''
+        return super().get(request, id=id)
+
+    def document(self, request, id):
+        return api.single_video(request.user, id, api.parse_fields(request.GET.get('fields')))
+
+
+class ApiPlaylistView(ApiView):
+
+    @query_budget(4)
+    def get(self, request, playlist_id):
+        '''
+        Get a playlist and one page of its videos
+        '''
+        return super().get(request, playlist_id=playlist_id)
+
+    def document(self, request, playlist_id):
+        return api.playlist_videos(request.user, playlist_id, request.GET.get('cursor'),
+                                   api.parse_fields(request.GET.get('fields')))
+
+
+class ApiCommentsView(ApiView):
+
+    @query_budget(5)
+    def get(self, request, id):
+        '''
+        Get one page of comments on a video, newest first
+        '''
+        return super().get(request, id=id)
+
+    def document(self, request, id):
+        return api.video_comments(request.user, id, request.GET.get('cursor'))
+
+
 class ErrorView(View):
     template_name = "error.html"
     error_string = "error"
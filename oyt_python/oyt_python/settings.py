@@ -59,12 +59,15 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'debug_toolbar.middleware.DebugToolbarMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'oyt.replicas.ReplicaMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'oyt.servertiming.ServerTimingMiddleware',
+    'oyt.querybudget.QueryBudgetMiddleware',
 ]
 
 ROOT_URLCONF = 'oyt_python.urls'
@@ -88,6 +91,28 @@ TEMPLATES = [
 WSGI_APPLICATION = 'oyt_python.wsgi.application'
 
 
+# Cache shared by every process on the host, kept in a SQLite file. The
+# feeds, their hit counters, pending likes and view dedup keys all need
+# every worker to see the same entries. Least recently used entries are
+# dropped beyond MAX_ENTRIES
+CACHES = {
+    'default': {
+        'BACKEND': 'oyt.backends.sqlitecache.SQLiteCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache.sqlite3'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+            'CULL_FREQUENCY': 10,
+            'CULL_EVERY': 100,
+        }
+    }
+}
+
+# Expired entries read through oyt.singleflight are kept CACHE_STALE_GRACE
+# seconds longer and served while one process recomputes them. Processes
+# finding no entry wait up to CACHE_LOCK_TIMEOUT for the one recomputing it
+CACHE_STALE_GRACE = 60
+CACHE_LOCK_TIMEOUT = 10
+
 # Database
 # https://docs.djangoproject.com/en/2.1/ref/settings/#databases
 
@@ -98,6 +123,30 @@ DATABASES = {
     }
 }
 
+# Read replicas, aliases in DATABASES that reads of safe requests are spread
+# over. A client that writes reads from the primary for REPLICA_PIN_SECONDS
+# afterwards. Replicas are probed every REPLICA_CHECK_INTERVAL seconds, and
+# with REPLICA_MAX_LAG set, SQLite copies last synced (manage.py
+# sync_replicas) longer ago than that are skipped. See settings_replicas.py
+DATABASE_ROUTERS = ['oyt.shards.CommentRouter', 'oyt.replicas.ReplicaRouter']
+DATABASE_REPLICAS = []
+REPLICA_PIN_SECONDS = 15
+REPLICA_CHECK_INTERVAL = 5
+REPLICA_MAX_LAG = None
+
+# Comments are split by video into COMMENT_SHARD_COUNT shards, dealt out
+# over the COMMENT_DATABASES aliases until manage.py rebalance_comments
+# moves them. Each alias allocates comment ids from its own range, picked
+# by its position, so only ever append to the list. Processes cache where
+# moved shards live for COMMENT_PLACEMENT_TTL seconds.
+COMMENT_DATABASES = ['default']
+COMMENT_SHARD_COUNT = 64
+COMMENT_PLACEMENT_TTL = 5
+
+# PRAGMA statements run on every new SQLite connection, in order. Empty
+# here; oyt_python/settings_production.py turns on WAL and friends.
+SQLITE_PRAGMAS = {}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
@@ -144,4 +193,92 @@ STATICFILES_DIRS = [
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
+
+# Media storage backend. The default fans files out into ab/cd/
+# directories and places new uploads on the MEDIA_VOLUMES root with the
+# most free space (just MEDIA_ROOT when empty). Files stored flat by
+# older installs are moved with manage.py migrate_media.
+MEDIA_STORAGE = 'oyt.storage.ShardedStorage'
+MEDIA_VOLUMES = []
 LOGOUT_REDIRECT_URL = ''
+
+# Background media processing (manage.py run_media_worker)
+FFMPEG_BINARY = 'ffmpeg'
+FFPROBE_BINARY = 'ffprobe'
+MEDIA_WORKER_PROCESSES = 2
+MEDIA_WORKER_POLL_INTERVAL = 2
+MEDIA_JOB_TIMEOUT = 300
+MEDIA_JOB_MAX_ATTEMPTS = 3
+
+# HLS rendition ladder as (height, video kbps), renditions taller than the
+# upload are skipped
+HLS_RENDITIONS = [(240, 400), (480, 1000), (720, 2500)]
+HLS_SEGMENT_SECONDS = 4
+HLS_JOB_TIMEOUT = 3600
+
+# Listing thumbnails, scaled to each width in each format and served with
+# srcset; their content-hashed files are cached for MEDIA_IMMUTABLE_MAX_AGE
+THUMBNAIL_WIDTHS = [160, 320, 480, 640]
+THUMBNAIL_FORMATS = ['webp', 'jpg']
+MEDIA_IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+# Seek preview storyboards, a frame every STORYBOARD_INTERVAL seconds
+# (stretched to keep at most STORYBOARD_MAX_FRAMES) tiled into sprite sheets
+STORYBOARD_INTERVAL = 5
+STORYBOARD_MAX_FRAMES = 200
+STORYBOARD_TILE_WIDTH = 160
+STORYBOARD_COLUMNS = 10
+STORYBOARD_ROWS = 10
+
+# Resumable chunked uploads, part files live on the same filesystem as
+# MEDIA_ROOT so finished uploads are moved into place with a rename
+CHUNKED_UPLOAD_DIR = os.path.join(MEDIA_ROOT, '.partial')
+CHUNKED_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+CHUNKED_UPLOAD_MAX_CHUNK = 64 * 1024 * 1024
+CHUNKED_UPLOAD_MAX_SIZE = 4 * 1024 * 1024 * 1024
+CHUNKED_UPLOAD_EXPIRY = 24 * 60 * 60
+
+# Page sizes, further pages are fetched with "load more" cursors
+SEARCH_PAGE_SIZE = 20
+PLAYLIST_PAGE_SIZE = 20
+COMMENT_PAGE_SIZE = 5
+
+# Query budgets, checked per request by oyt.querybudget.QueryBudgetMiddleware.
+# Views declare their own budget with @query_budget; over-budget requests and
+# query shapes repeated REPEAT_THRESHOLD times are logged, or raised if STRICT
+QUERY_BUDGET_DEFAULT = None
+QUERY_BUDGET_REPEAT_THRESHOLD = 5
+QUERY_BUDGET_STRICT = False
+
+# Add a Server-Timing header with the database time, write time and lock
+# errors of each response, for benchmarks/loadtest.py. Off by default as
+# it exposes server timings to every client.
+SERVER_TIMING = False
+
+# Home page feeds, the public part of each feed is cached as a list of ids
+# and invalidated whenever a video is saved or deleted. Trending is only
+# invalidated when a new score moves a video into or out of the list
+HOME_FEED_SIZE = 10
+HOME_FEED_CACHE_TIMEOUT = 15 * 60
+
+# Write-behind likes: queue like/unlike in memory and write them in batches
+# instead of updating the video row per click. A user's own pending likes
+# are kept in the cache, which needs a shared backend with several processes
+LIKE_BUFFER = False
+LIKE_BUFFER_FLUSH_INTERVAL = 2
+LIKE_BUFFER_MAX_EVENTS = 500
+
+# View counting, views are appended to a log in VIEW_LOG_DIR and added to
+# num_views by the media worker every VIEW_FLUSH_INTERVAL seconds. Repeat
+# views by a session within VIEW_DEDUP_WINDOW seconds are ignored (0 = off)
+VIEW_LOG_DIR = os.path.join(BASE_DIR, 'view_log')
+VIEW_FLUSH_INTERVAL = 30
+VIEW_DEDUP_WINDOW = 30 * 60
+
+# Trending ranking, a video needs twice the weighted engagement every
+# TRENDING_HALF_LIFE seconds to keep its place
+TRENDING_HALF_LIFE = 24 * 60 * 60
+TRENDING_WEIGHTS = {'likes': 3.0, 'comments': 5.0, 'views': 1.0}
+
+# JSON API, largest number of videos fetched by one ?ids= request
+API_BATCH_SIZE = 100
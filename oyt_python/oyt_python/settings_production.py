@@ -0,0 +1,48 @@
+# Copyright 2021 Bhargav SNV
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""
+Production settings, the development settings with a tuned database.
+
+Select them with DJANGO_SETTINGS_MODULE=oyt_python.settings_production.
+"""
+
+from .settings import *
+
+DEBUG = False
+
+ALLOWED_HOSTS = os.environ.get('OYT_ALLOWED_HOSTS', 'localhost').split(',')
+
+# Transactions take the write lock up front, see oyt.backends.sqlite3. Each
+# worker's connection stays open across requests instead of being opened
+# (and running the pragmas) per request.
+DATABASES = {
+    'default': dict(DATABASES['default'], ENGINE='oyt.backends.sqlite3', CONN_MAX_AGE=600),
+}
+
+# journal_mode: write-ahead log, readers and the writer no longer block
+#   each other. Stored in the database file, so it sticks once set.
+# synchronous: with WAL, NORMAL only syncs at checkpoints. A power loss
+#   may drop the last commits but never corrupts the database.
+# mmap_size: read pages straight from a memory map of the database file.
+# cache_size: page cache per connection, negative values are KiB.
+# busy_timeout: milliseconds a writer waits for the lock before failing
+#   with "database is locked".
+SQLITE_PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,
+    'busy_timeout': 5000,
+}
@@ -0,0 +1,39 @@
+# Copyright 2021 Bhargav SNV
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""
+Development settings with two local SQLite read replicas, copies of the
+primary refreshed by manage.py sync_replicas --interval 5.
+
+Select them with DJANGO_SETTINGS_MODULE=oyt_python.settings_replicas.
+"""
+
+from .settings import *
+
+
+def replica(name):
+    return {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, name),
+        # Tests read the test database through the replica aliases
+        'TEST': {'MIRROR': 'default'},
+    }
+
+
+DATABASES = dict(DATABASES, replica1=replica('db_replica1.sqlite3'),
+                 replica2=replica('db_replica2.sqlite3'))
+DATABASE_REPLICAS = ['replica1', 'replica2']
+
+# Copies older than two missed syncs are taken out of rotation
+REPLICA_MAX_LAG = 15
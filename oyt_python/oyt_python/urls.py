@@ -49,6 +49,19 @@ from oyt.views import PlaylistVideoView
 from oyt.views import DeleteVideoView
 from oyt.views import RemoveVideoView
 from oyt.views import DeletePlaylistView
+from oyt.views import MediaView
+from oyt.views import ChunkedUploadView
+from oyt.views import ChunkedUploadDetailView
+from oyt.views import FinalizeUploadView
+from oyt.views import VideoSearchMoreView
+from oyt.views import PlaylistSearchMoreView
+from oyt.views import PlaylistIndexMoreView
+from oyt.views import PlaylistMoreView
+from oyt.views import CommentsMoreView
+from oyt.views import ApiVideosView
+from oyt.views import ApiVideoView
+from oyt.views import ApiPlaylistView
+from oyt.views import ApiCommentsView
 import debug_toolbar
 from django.conf import settings
 from django.conf.urls.static import static
@@ -58,24 +71,37 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('', HomeView.as_view()),
     path('new_video', NewVideoView.as_view()),
+    path('upload', ChunkedUploadView.as_view()),
+    path('upload/<uuid:upload_id>', ChunkedUploadDetailView.as_view()),
+    path('upload/<uuid:upload_id>/finalize', FinalizeUploadView.as_view()),
     path('login', LoginView.as_view()),
     path('register', RegisterView.as_view()),
     path('error', ErrorView.as_view()),
     path('video/<int:id>', VideoView.as_view()),
+    path('video/<int:id>/comments', CommentsMoreView.as_view()),
     path('comment', CommentView.as_view()),
     path('logout', LogoutView.as_view()),
     path('edit_video/<int:id>', EditVideoView.as_view()),
     path('edit_user', EditUserView.as_view()),
     path('new_playlist', CreatePlaylistView.as_view()),
     path('playlist_index', PlaylistIndexView.as_view()),
+    path('playlist_index/more', PlaylistIndexMoreView.as_view()),
+    path('search/videos', VideoSearchMoreView.as_view()),
+    path('search/playlists', PlaylistSearchMoreView.as_view()),
     path('add_to_playlist/<int:id>', AddVideoToPlaylistView.as_view()),
     path('playlist/<int:playlist_id>/', PlaylistView.as_view()),
+    path('playlist/<int:playlist_id>/more', PlaylistMoreView.as_view()),
     path('playlist/<int:playlist_id>/<int:video_id>',
          PlaylistVideoView.as_view()),
     path('delete_video/<int:id>/', DeleteVideoView.as_view()),
     path('remove_from_playlist/<int:id>/', RemoveVideoView.as_view()),
     path('delete_playlist/<int:id>/', DeletePlaylistView.as_view()),
-] + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT) + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    path('media/<path:name>', MediaView.as_view()),
+    path('api/videos', ApiVideosView.as_view()),
+    path('api/videos/<int:id>', ApiVideoView.as_view()),
+    path('api/videos/<int:id>/comments', ApiCommentsView.as_view()),
+    path('api/playlists/<int:playlist_id>', ApiPlaylistView.as_view()),
+] + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
 
 if settings.DEBUG:
     urlpatterns.append(path('__debug__/', include(debug_toolbar.urls)))